@@ -0,0 +1,139 @@
+"""
+弹幕排版基准测试：用合成弹幕对比原来 bilibili_api 自带的 ASS 导出（基线）、
+逐条排版和 numpy 批量排版的速度，并核对后两者输出一致。
+基线要先把弹幕写成 XML 再整体转换，计时包含写 XML 和写出 ASS 文件，和它原来的用法一样
+
+    uv run benchmarks/bench_danmaku_layout.py
+    uv run benchmarks/bench_danmaku_layout.py --sizes 10000 100000 1000000
+"""
+
+import argparse, hashlib, pathlib, random, sys, tempfile, time
+from typing import Optional
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "src"))
+
+from core import danmaku_layout
+from core.danmaku_layout import danmakuItem
+
+# 和导出时一样按 6 分钟一段喂给排版
+SEGMENT_SECONDS = 360
+# 平均每秒多少条弹幕，热门视频的高峰大概是这个量级
+DENSITY = 20
+
+_WORDS = ["哈哈哈", "前方高能", "awsl", "233333", "泪目", "名场面", "？？？", "好耶", "gkd", "来了来了"]
+_MODES = [1] * 16 + [4, 5, 6]
+_SIZES = [25] * 18 + [18, 36]
+_COLORS = [0xFFFFFF] * 12 + [0xFE0302, 0x00CD00, 0xFFFF00, 0x4266BE]
+
+
+def synthesize(count: int, seed: int = 0) -> list[list[danmakuItem]]:
+    rng = random.Random(seed)
+    duration = count / DENSITY
+    items = [
+        danmakuItem(
+            rng.uniform(0, duration),
+            rng.choice(_MODES),
+            rng.choice(_SIZES),
+            rng.choice(_COLORS),
+            "".join(rng.choices(_WORDS, k=rng.randint(1, 3))),
+        )
+        for _ in range(count)
+    ]
+    items.sort(key=lambda item: item.time)
+
+    segments: list[list[danmakuItem]] = []
+    for item in items:
+        seg = int(item.time // SEGMENT_SECONDS)
+        while len(segments) <= seg:
+            segments.append([])
+        segments[seg].append(item)
+
+    return segments
+
+
+def runBaseline(segments: list[list[danmakuItem]]) -> Optional[float]:
+    # 原来的导出路径：bilibili_api.ass 把 XML 弹幕整体转成 ASS；没装 bilibili_api 时返回 None
+    try:
+        from bilibili_api import ass
+    except ImportError:
+        return None
+
+    with tempfile.TemporaryDirectory() as folder:
+        xmlPath = pathlib.Path(folder) / "danmaku.xml"
+        assPath = pathlib.Path(folder) / "danmaku.ass"
+
+        begin = time.perf_counter()
+
+        with open(xmlPath, "w", encoding="utf-8") as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?><i>')
+            allItems = (item for items in segments for item in items)
+            for i, item in enumerate(allItems):
+                f.write(
+                    f'<d p="{item.time:.3f},{item.mode},{item.size},{item.color},0,0,0,{i}">'
+                    f"{escape(item.text)}</d>"
+                )
+            f.write("</i>")
+
+        ass.export_ass_from_xml(str(xmlPath), str(assPath), (1920, 1080), "Simsun", 25.0, 1, 7, 5)
+
+        return time.perf_counter() - begin
+
+
+def run(layout: danmaku_layout.danmakuLayout, segments: list[list[danmakuItem]]):
+    digest = hashlib.sha256()
+    begin = time.perf_counter()
+
+    for items in segments:
+        for line in layout.place(items):
+            digest.update(line.encode())
+
+    return time.perf_counter() - begin, digest.hexdigest()
+
+
+def main(args: argparse.Namespace):
+    if danmaku_layout.np is None:
+        print("没有安装 numpy，只能测逐条排版")
+
+    if not args.no_baseline and runBaseline([]) is None:
+        print("没有安装 bilibili_api，跳过基线")
+
+    # 全角表只建一次，不算进任何一方的耗时
+    danmaku_layout.textWidth("预热", 1.0)
+
+    print(
+        f"{'条数':>10}{'基线(s)':>10}{'逐条(s)':>10}{'批量(s)':>10}"
+        f"{'对基线':>8}{'对逐条':>8}  输出一致"
+    )
+
+    for count in args.sizes:
+        segments = synthesize(count)
+        baseTime = None if args.no_baseline else runBaseline(segments)
+        plainTime, plainDigest = run(danmaku_layout.danmakuLayout(), segments)
+
+        baseText = f"{baseTime:>10.2f}" if baseTime is not None else f"{'-':>10}"
+
+        if danmaku_layout.np is None:
+            baseGain = f"{baseTime / plainTime:>7.1f}x" if baseTime is not None else f"{'-':>8}"
+            print(f"{count:>10}{baseText}{plainTime:>10.2f}{'-':>10}{baseGain}{'-':>8}  -")
+            continue
+
+        vectorTime, vectorDigest = run(danmaku_layout.vectorLayout(), segments)
+        baseGain = f"{baseTime / vectorTime:>7.1f}x" if baseTime is not None else f"{'-':>8}"
+
+        print(
+            f"{count:>10}{baseText}{plainTime:>10.2f}{vectorTime:>10.2f}"
+            f"{baseGain}{plainTime / vectorTime:>7.1f}x  {plainDigest == vectorDigest}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="弹幕排版基准测试")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument(
+        "--no-baseline", action="store_true", help="不跑 bilibili_api 基线（百万条时很慢）"
+    )
+
+    main(parser.parse_args())
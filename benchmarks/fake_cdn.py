@@ -0,0 +1,476 @@
+"""
+本地假 CDN：模拟 b站 playurl 接口和 upos 视频分发、表情图片服务器，
+用来在不访问 b站的情况下测下载链路的吞吐。
+
+单独运行：
+    uv run benchmarks/fake_cdn.py --port 8765 --bandwidth 4096 --latency 30
+"""
+
+import argparse, asyncio, random, struct, time
+from dataclasses import dataclass
+from typing import Optional
+from aiohttp import web
+
+# 每个分片的时长（秒）和大小，决定生成的 m4s 里有多少个 moof/mdat
+FRAGMENT_SECONDS = 2
+FRAGMENT_SIZE = 1024 * 1024
+# 限速时每次写出的块大小
+SEND_CHUNK_SIZE = 64 * 1024
+
+VIDEO_TIMESCALE = 16000
+AUDIO_TIMESCALE = 48000
+
+
+@dataclass
+class cdnProfile:
+    # 单条连接的带宽上限（字节/秒），0 表示不限
+    bandwidth: int = 0
+    # 每个请求返回响应头之前的延迟（秒）
+    latency: float = 0.0
+    # 随机返回 403/5xx 的概率
+    errorRate: float = 0.0
+    # 响应传到一半时断开连接的概率
+    resetRate: float = 0.0
+    # 下载地址的有效期（秒），过期后返回 403，和真实的 deadline 参数一致
+    urlTtl: int = 3600
+    # 每个镜像相对 bandwidth 的速度倍率，第一个是 base_url，其余是 backup_url
+    mirrorFactors: tuple[float, ...] = (1.0,)
+    seed: Optional[int] = None
+
+
+PROFILES = {
+    "clean": cdnProfile(bandwidth=8 * 1024 * 1024, latency=0.02),
+    "slow": cdnProfile(bandwidth=1024 * 1024, latency=0.15),
+    "flaky": cdnProfile(
+        bandwidth=4 * 1024 * 1024, latency=0.05, errorRate=0.05, resetRate=0.03
+    ),
+    # 主地址是个慢节点，测镜像竞速和迁移
+    "mirrors": cdnProfile(
+        bandwidth=4 * 1024 * 1024, latency=0.03, mirrorFactors=(0.1, 1.0, 0.5)
+    ),
+    "unlimited": cdnProfile(),
+}
+
+
+def _box(boxType: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), boxType) + payload
+
+
+def _fullBox(boxType: bytes, version: int, flags: int, payload: bytes) -> bytes:
+    return _box(boxType, struct.pack(">I", (version << 24) | flags) + payload)
+
+
+def _sampleEntry(codec: bytes) -> bytes:
+    # 只保证结构合法，内容不是真的能播放的码流
+    head = bytes(6) + struct.pack(">H", 1)
+
+    if codec == b"mp4a":
+        body = bytes(8) + struct.pack(">HHHHI", 2, 16, 0, 0, AUDIO_TIMESCALE << 16)
+    else:
+        body = (
+            bytes(16)
+            + struct.pack(">HHIIIH", 1920, 1080, 0x00480000, 0x00480000, 0, 1)
+            + bytes(32)
+            + struct.pack(">Hh", 0x0018, -1)
+        )
+
+    return _box(codec, head + body)
+
+
+def makeFragmentedMp4(codec: bytes, size: int) -> bytes:
+    """
+    生成一个结构上和 b站 DASH m4s 一致的单轨道分片 MP4：
+    ftyp + moov(mvhd, trak, mvex/trex) + sidx + 若干 moof/mdat，总大小接近 size
+    """
+    isAudio = codec == b"mp4a"
+    timescale = AUDIO_TIMESCALE if isAudio else VIDEO_TIMESCALE
+    fragmentCount = max(1, size // FRAGMENT_SIZE)
+    duration = fragmentCount * FRAGMENT_SECONDS * timescale
+
+    ftyp = _box(b"ftyp", b"iso5" + struct.pack(">I", 512) + b"iso5iso6mp41")
+
+    matrix = struct.pack(">9I", 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000)
+    mvhd = _fullBox(
+        b"mvhd",
+        0,
+        0,
+        struct.pack(">IIIIIH", 0, 0, 1000, 0, 0x00010000, 0x0100)
+        + bytes(10)
+        + matrix
+        + bytes(24)
+        + struct.pack(">I", 2),
+    )
+    tkhd = _fullBox(
+        b"tkhd",
+        0,
+        3,
+        struct.pack(">IIIII", 0, 0, 1, 0, 0)
+        + bytes(8)
+        + struct.pack(">hhhH", 0, 0, 0x0100 if isAudio else 0, 0)
+        + matrix
+        + struct.pack(">II", 0 if isAudio else 1920 << 16, 0 if isAudio else 1080 << 16),
+    )
+    mdhd = _fullBox(
+        b"mdhd", 0, 0, struct.pack(">IIIIHH", 0, 0, timescale, duration, 0x55C4, 0)
+    )
+    hdlr = _fullBox(
+        b"hdlr", 0, 0, bytes(4) + (b"soun" if isAudio else b"vide") + bytes(12) + b"\0"
+    )
+    mediaHeader = (
+        _fullBox(b"smhd", 0, 0, bytes(4))
+        if isAudio
+        else _fullBox(b"vmhd", 0, 1, bytes(8))
+    )
+    dinf = _box(
+        b"dinf",
+        _fullBox(b"dref", 0, 0, struct.pack(">I", 1) + _fullBox(b"url ", 0, 1, b"")),
+    )
+    stbl = _box(
+        b"stbl",
+        _fullBox(b"stsd", 0, 0, struct.pack(">I", 1) + _sampleEntry(codec))
+        + _fullBox(b"stts", 0, 0, bytes(4))
+        + _fullBox(b"stsc", 0, 0, bytes(4))
+        + _fullBox(b"stsz", 0, 0, bytes(8))
+        + _fullBox(b"stco", 0, 0, bytes(4)),
+    )
+    trak = _box(
+        b"trak",
+        tkhd + _box(b"mdia", mdhd + hdlr + _box(b"minf", mediaHeader + dinf + stbl)),
+    )
+    trex = _fullBox(b"trex", 0, 0, struct.pack(">IIIII", 1, 1, 0, 0, 0))
+    moov = _box(b"moov", mvhd + trak + _box(b"mvex", trex))
+
+    fragments = []
+    payloadSize = max(1, (size - len(ftyp) - len(moov)) // fragmentCount - 132)
+    payload = (bytes(range(256)) * (payloadSize // 256 + 1))[:payloadSize]
+
+    for index in range(fragmentCount):
+        # tfhd 只带 default-base-is-moof，trun 带数据偏移和一个样本的大小
+        tfhd = _fullBox(b"tfhd", 0, 0x020000, struct.pack(">I", 1))
+        tfdt = _fullBox(
+            b"tfdt", 1, 0, struct.pack(">Q", index * FRAGMENT_SECONDS * timescale)
+        )
+        trunSize = 8 + 4 + 12
+        trafSize = 8 + len(tfhd) + len(tfdt) + trunSize
+        moofSize = 8 + 16 + trafSize
+        trun = _fullBox(b"trun", 0, 0x000201, struct.pack(">IiI", 1, moofSize + 8, payloadSize))
+        mfhd = _fullBox(b"mfhd", 0, 0, struct.pack(">I", index + 1))
+
+        fragments.append(
+            _box(b"moof", mfhd + _box(b"traf", tfhd + tfdt + trun))
+            + _box(b"mdat", payload)
+        )
+
+    # sidx 紧跟在 moov 后面，每个分片一条引用，都从关键帧开始
+    references = b"".join(
+        struct.pack(">III", len(fragment), FRAGMENT_SECONDS * timescale, 0x90000000)
+        for fragment in fragments
+    )
+    sidx = _fullBox(
+        b"sidx",
+        0,
+        0,
+        struct.pack(">IIIIHH", 1, timescale, 0, 0, 0, fragmentCount) + references,
+    )
+
+    return b"".join([ftyp, moov, sidx] + fragments)
+
+
+def indexRanges(data: bytes) -> tuple[str, str]:
+    # 和 playurl 里 segment_base 一样的写法："起点-终点"，终点包含在内
+    ranges = {}
+    pos = 0
+    while pos < len(data) and len(ranges) < 3:
+        size, boxType = struct.unpack_from(">I4s", data, pos)
+        ranges[boxType] = (pos, pos + size)
+        pos += size
+
+    return f"0-{ranges[b'moov'][1] - 1}", f"{ranges[b'sidx'][0]}-{ranges[b'sidx'][1] - 1}"
+
+
+def mediaSeconds(size: int) -> int:
+    # 和 makeFragmentedMp4 一样按大小决定分片数，每个分片固定时长
+    return max(1, size // FRAGMENT_SIZE) * FRAGMENT_SECONDS
+
+
+class fakeCdn:
+    """
+    /x/player/wbi/playurl  返回和真实接口同结构的 dash 信息
+    /upos/{name}           支持 Range 的媒体文件，带 deadline 校验
+    /emoji/{name}          表情图片
+    """
+
+    def __init__(self, profile: cdnProfile):
+        self.profile = profile
+        self.baseUrl = ""
+
+        self._random = random.Random(profile.seed)
+        self._media: dict[str, bytes] = {}
+        # cid -> (视频文件名, 音频文件名)
+        self._pages: dict[int, tuple[str, str]] = {}
+        # 文件名 -> 时长（秒）
+        self._durations: dict[str, int] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+        # 统计信息，基准测试结束后可以看服务端一共发了多少
+        self.requests = 0
+        self.bytesSent = 0
+        self.faults = 0
+
+    def addPage(self, cid: int, videoSize: int, audioSize: int):
+        videoName = f"{cid}-1-100050.m4s"
+        audioName = f"{cid}-1-30280.m4s"
+
+        self._media[videoName] = makeFragmentedMp4(b"avc1", videoSize)
+        self._media[audioName] = makeFragmentedMp4(b"mp4a", audioSize)
+        self._durations[videoName] = mediaSeconds(videoSize)
+        self._durations[audioName] = mediaSeconds(audioSize)
+        self._pages[cid] = (videoName, audioName)
+
+    def addEmoji(self, name: str, size: int) -> str:
+        self._media[name] = self._random.randbytes(size)
+
+        return f"{self.baseUrl}/emoji/{name}"
+
+    def _signedUrls(self, name: str) -> list[str]:
+        # 真实的镜像是不同的域名、相同的路径，这里用 mirror 参数区分
+        deadline = int(time.time()) + self.profile.urlTtl
+
+        return [
+            f"{self.baseUrl}/upos/{name}?deadline={deadline}&os=fake&mirror={index}"
+            for index in range(len(self.profile.mirrorFactors))
+        ]
+
+    def _streamInfo(self, name: str) -> dict:
+        # 码率、分片索引这些和真实接口一样跟着每个流走
+        data = self._media[name]
+        initialization, indexRange = indexRanges(data)
+
+        return {
+            "bandwidth": len(data) * 8 // self._durations[name],
+            "segment_base": {"initialization": initialization, "index_range": indexRange},
+            "SegmentBase": {"Initialization": initialization, "indexRange": indexRange},
+        }
+
+    def playurl(self, cid: int) -> dict:
+        videoName, audioName = self._pages[cid]
+        videoUrl, *videoBackups = self._signedUrls(videoName)
+        audioUrl, *audioBackups = self._signedUrls(audioName)
+
+        return {
+            "quality": 80,
+            "format": "flv",
+            "timelength": self._durations[videoName] * 1000,
+            "accept_quality": [80],
+            "dash": {
+                "duration": self._durations[videoName],
+                "video": [
+                    {
+                        "id": 80,
+                        "baseUrl": videoUrl,
+                        "base_url": videoUrl,
+                        "backupUrl": videoBackups,
+                        "backup_url": videoBackups,
+                        **self._streamInfo(videoName),
+                        "mimeType": "video/mp4",
+                        "codecs": "avc1.640032",
+                        "width": 1920,
+                        "height": 1080,
+                        "codecid": 7,
+                    }
+                ],
+                "audio": [
+                    {
+                        "id": 30280,
+                        "baseUrl": audioUrl,
+                        "base_url": audioUrl,
+                        "backupUrl": audioBackups,
+                        "backup_url": audioBackups,
+                        **self._streamInfo(audioName),
+                        "mimeType": "audio/mp4",
+                        "codecs": "mp4a.40.2",
+                        "codecid": 0,
+                    }
+                ],
+                "dolby": {"type": 0, "audio": None},
+                "flac": {"display": False, "audio": None},
+            },
+        }
+
+    async def _handlePlayurl(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(self.profile.latency)
+
+        cid = int(request.query.get("cid", "0"))
+        if cid not in self._pages:
+            return web.json_response({"code": -404, "message": "啥都木有"})
+
+        return web.json_response({"code": 0, "message": "0", "data": self.playurl(cid)})
+
+    def _parseRange(self, header: str, total: int) -> Optional[tuple[int, int]]:
+        # 只支持单个区间，返回 [start, end)
+        if not header.startswith("bytes="):
+            return None
+
+        startText, _, endText = header[6:].partition("-")
+        if not startText:
+            return max(0, total - int(endText)), total
+
+        start = int(startText)
+        end = int(endText) + 1 if endText else total
+
+        return start, min(end, total)
+
+    async def _serve(
+        self, request: web.Request, data: bytes, bandwidth: float
+    ) -> web.StreamResponse:
+        self.requests += 1
+        await asyncio.sleep(self.profile.latency)
+
+        if self._random.random() < self.profile.errorRate:
+            self.faults += 1
+
+            raise self._random.choice(
+                [web.HTTPForbidden, web.HTTPServiceUnavailable, web.HTTPBadGateway]
+            )()
+
+        total = len(data)
+        start, end = 0, total
+        status = 200
+
+        if "Range" in request.headers:
+            parsed = self._parseRange(request.headers["Range"], total)
+            if parsed is None or parsed[0] >= total:
+                raise web.HTTPRequestRangeNotSatisfiable(
+                    headers={"Content-Range": f"bytes */{total}"}
+                )
+
+            start, end = parsed
+            status = 206
+
+        resp = web.StreamResponse(status=status)
+        resp.content_length = end - start
+        resp.content_type = "application/octet-stream"
+        resp.headers["Accept-Ranges"] = "bytes"
+        if status == 206:
+            resp.headers["Content-Range"] = f"bytes {start}-{end - 1}/{total}"
+
+        await resp.prepare(request)
+
+        # 决定这次响应要不要传到一半就断开
+        resetAt = None
+        if end - start > 1 and self._random.random() < self.profile.resetRate:
+            resetAt = self._random.randrange(start, end)
+
+        view = memoryview(data)
+        cursor = start
+        while cursor < end:
+            chunkEnd = min(cursor + SEND_CHUNK_SIZE, end)
+
+            if resetAt is not None and chunkEnd > resetAt:
+                await resp.write(view[cursor:resetAt])
+                self.bytesSent += resetAt - cursor
+                self.faults += 1
+
+                request.transport.abort()
+
+                return resp
+
+            await resp.write(view[cursor:chunkEnd])
+            self.bytesSent += chunkEnd - cursor
+
+            if bandwidth > 0:
+                await asyncio.sleep((chunkEnd - cursor) / bandwidth)
+
+            cursor = chunkEnd
+
+        await resp.write_eof()
+
+        return resp
+
+    async def _handleMedia(self, request: web.Request) -> web.StreamResponse:
+        name = request.match_info["name"]
+        if name not in self._media:
+            raise web.HTTPNotFound()
+
+        deadline = request.query.get("deadline", "")
+        if not deadline.isdigit() or int(deadline) < time.time():
+            raise web.HTTPForbidden()
+
+        factors = self.profile.mirrorFactors
+        mirror = int(request.query.get("mirror", "0"))
+        factor = factors[mirror] if mirror < len(factors) else 1.0
+
+        return await self._serve(
+            request, self._media[name], self.profile.bandwidth * factor
+        )
+
+    async def _handleEmoji(self, request: web.Request) -> web.StreamResponse:
+        name = request.match_info["name"]
+        if name not in self._media:
+            raise web.HTTPNotFound()
+
+        return await self._serve(request, self._media[name], self.profile.bandwidth)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_get("/x/player/wbi/playurl", self._handlePlayurl)
+        app.router.add_get("/upos/{name}", self._handleMedia)
+        app.router.add_get("/emoji/{name}", self._handleEmoji)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+
+        # port 传 0 时由系统分配，从监听的 socket 上取回实际端口
+        port = site._server.sockets[0].getsockname()[1]
+        self.baseUrl = f"http://{host}:{port}"
+
+        return self.baseUrl
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def _serveForever(args: argparse.Namespace):
+    profile = cdnProfile(
+        bandwidth=args.bandwidth * 1024,
+        latency=args.latency / 1000,
+        errorRate=args.error_rate,
+        resetRate=args.reset_rate,
+    )
+    cdn = fakeCdn(profile)
+    baseUrl = await cdn.start(args.host, args.port)
+
+    for cid in range(1, args.pages + 1):
+        cdn.addPage(cid, args.video_mb * 1024 * 1024, args.audio_mb * 1024 * 1024)
+
+    print(f"假 CDN 已启动：{baseUrl}")
+    print(f"示例：{baseUrl}/x/player/wbi/playurl?cid=1")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await cdn.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地假 b站 CDN")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--bandwidth", type=int, default=0, help="单连接限速 KB/s，0 不限")
+    parser.add_argument("--latency", type=float, default=0, help="响应延迟 ms")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--reset-rate", type=float, default=0)
+    parser.add_argument("--pages", type=int, default=1)
+    parser.add_argument("--video-mb", type=int, default=32)
+    parser.add_argument("--audio-mb", type=int, default=4)
+
+    try:
+        asyncio.run(_serveForever(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,220 @@
+"""
+下载链路的端到端基准测试：在本地假 CDN 上跑视频和表情包下载，
+输出吞吐、耗时和内存峰值，改动下载代码前后各跑一次对比即可。
+
+    uv run benchmarks/run_bench.py
+    uv run benchmarks/run_bench.py --profile flaky --scenario multi --repeat 3
+"""
+
+import argparse, asyncio, pathlib, statistics, sys, tempfile, time, tracemalloc
+from dataclasses import dataclass
+from typing import Optional
+import aiohttp
+
+try:
+    import resource
+except ImportError:
+    # windows 上没有 resource，只报告 tracemalloc 统计的 Python 堆峰值
+    resource = None
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "src"))
+
+import fake_cdn
+from utils import config_loader as conf
+from core import video_handler, emoji_handler
+from core.rate_limiter import bwLimiter
+
+MB = 1024 * 1024
+
+
+@dataclass
+class scenario:
+    name: str
+    # 每个分P的 (视频字节数, 音频字节数)
+    pages: list[tuple[int, int]]
+    emojiCount: int = 0
+    emojiSize: int = 0
+    # 只下载第一P里这段时间（秒），吞吐按实际传输的字节算
+    clip: Optional[tuple[float, float]] = None
+
+
+SCENARIOS = {
+    "single": scenario("单P视频", [(64 * MB, 8 * MB)]),
+    "multi": scenario("多P视频", [(16 * MB, 2 * MB)] * 6),
+    "emoji": scenario("表情包", [], emojiCount=80, emojiSize=48 * 1024),
+    "clip": scenario("片段", [(64 * MB, 8 * MB)], clip=(4.0, 10.0)),
+}
+
+
+@dataclass
+class benchResult:
+    name: str
+    seconds: float
+    totalBytes: int
+    heapPeak: int
+    requests: int
+    faults: int
+    # 重试后仍然失败的分P / 表情数
+    failed: int
+
+    def throughput(self) -> float:
+        return self.totalBytes / MB / self.seconds if self.seconds > 0 else 0.0
+
+
+def _isolateConfig():
+    # 只改内存里的配置，不写回 user.toml：关掉本地仓库免得第二轮直接命中，也不限速
+    conf.userConf.saveDownloadContentStore(False)
+    bwLimiter.setLimits(0, 0)
+
+
+async def _fetchPlayurl(cdn: fake_cdn.fakeCdn, cid: int) -> dict:
+    # 走一遍 HTTP 接口，和真实下载一样先拿地址再下载
+    async with aiohttp.ClientSession() as session:
+        async with session.get(
+            f"{cdn.baseUrl}/x/player/wbi/playurl", params={"cid": str(cid)}
+        ) as resp:
+            return (await resp.json())["data"]
+
+
+async def _runVideos(
+    cdn: fake_cdn.fakeCdn, cids: list[int], folder: pathlib.Path
+) -> int:
+    # 走和真实下载一样的分P流水线，只是地址从假接口取
+    async def resolve(pageIndex: int, fresh: bool) -> tuple[dict, int]:
+        return await _fetchPlayurl(cdn, cids[pageIndex]), cids[pageIndex]
+
+    results = await video_handler.pagePipeline("bench", resolve).run(
+        [(pageIndex, folder / str(cid)) for pageIndex, cid in enumerate(cids)]
+    )
+
+    failed = 0
+    for pageIndex, error in sorted(results.items()):
+        if error is not None:
+            print(f"分P {cids[pageIndex]} 下载失败：{error}")
+            failed += 1
+
+    return failed
+
+
+async def _runClip(
+    cdn: fake_cdn.fakeCdn, cid: int, clip: tuple[float, float], folder: pathlib.Path
+) -> int:
+    try:
+        await video_handler.transferClip(
+            await _fetchPlayurl(cdn, cid), folder / str(cid), *clip
+        )
+    except Exception as e:
+        print(f"片段下载失败：{e}")
+
+        return 1
+
+    return 0
+
+
+async def _runEmoji(urls: list[tuple[str, str]], folder: pathlib.Path) -> int:
+    await emoji_handler.download_all_images(urls, folder)
+
+    return sum(1 for _, name in urls if not (folder / name).exists())
+
+
+async def runScenario(
+    scene: scenario, profile: fake_cdn.cdnProfile, workDir: pathlib.Path
+) -> benchResult:
+    cdn = fake_cdn.fakeCdn(profile)
+    await cdn.start()
+
+    try:
+        cids = list(range(1, len(scene.pages) + 1))
+        for cid, (videoSize, audioSize) in zip(cids, scene.pages):
+            cdn.addPage(cid, videoSize, audioSize)
+
+        emojiUrls = [
+            (cdn.addEmoji(f"{i}.png", scene.emojiSize), f"{i}.png")
+            for i in range(scene.emojiCount)
+        ]
+
+        totalBytes = sum(v + a for v, a in scene.pages) + scene.emojiCount * scene.emojiSize
+
+        # 服务端的数据在计时前就生成好，峰值主要反映下载过程本身
+        tracemalloc.reset_peak()
+        begin = time.perf_counter()
+
+        failed = 0
+        if scene.clip:
+            failed += await _runClip(cdn, cids[0], scene.clip, workDir / "clip")
+            # 片段只拉了一小部分，按服务端实际发出的字节算吞吐
+            totalBytes = cdn.bytesSent
+        elif cids:
+            failed += await _runVideos(cdn, cids, workDir / "videos")
+        if emojiUrls:
+            failed += await _runEmoji(emojiUrls, workDir / "emoji")
+
+        seconds = time.perf_counter() - begin
+        _, heapPeak = tracemalloc.get_traced_memory()
+
+        return benchResult(
+            scene.name, seconds, totalBytes, heapPeak, cdn.requests, cdn.faults, failed
+        )
+    finally:
+        await cdn.stop()
+
+
+def _report(results: dict[str, list[benchResult]]):
+    print()
+    print(
+        f"{'场景':<10}{'MB/s':>10}{'耗时(s)':>10}{'堆峰值(MB)':>12}"
+        f"{'请求数':>8}{'注入故障':>8}{'失败':>6}"
+    )
+
+    for runs in results.values():
+        seconds = statistics.median(r.seconds for r in runs)
+        throughput = statistics.median(r.throughput() for r in runs)
+        heapPeak = max(r.heapPeak for r in runs)
+
+        print(
+            f"{runs[0].name:<10}{throughput:>10.1f}{seconds:>10.2f}"
+            f"{heapPeak / MB:>12.1f}{runs[-1].requests:>8}{runs[-1].faults:>8}"
+            f"{sum(r.failed for r in runs):>6}"
+        )
+
+    if resource is not None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # linux 上是 KB，macOS 上是字节
+        scale = 1 if sys.platform == "darwin" else 1024
+        print(f"\n进程 RSS 峰值（含假 CDN 的数据）：{maxrss * scale / MB:.1f} MB")
+
+
+async def main(args: argparse.Namespace):
+    _isolateConfig()
+
+    profile = fake_cdn.PROFILES[args.profile]
+    names = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    results: dict[str, list[benchResult]] = {}
+
+    tracemalloc.start()
+
+    for name in names:
+        for attempt in range(args.repeat):
+            # 每轮都用新的目录，避免命中“已下载”和断点续传
+            with tempfile.TemporaryDirectory(prefix="bili-bench-") as workDir:
+                result = await runScenario(
+                    SCENARIOS[name], profile, pathlib.Path(workDir)
+                )
+
+            results.setdefault(name, []).append(result)
+            print(
+                f"[{result.name} 第{attempt + 1}轮] {result.throughput():.1f} MB/s，"
+                f"{result.seconds:.2f}s"
+            )
+
+    tracemalloc.stop()
+    _report(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="下载链路基准测试")
+    parser.add_argument("--profile", choices=list(fake_cdn.PROFILES), default="clean")
+    parser.add_argument("--scenario", choices=["all", *SCENARIOS], default="all")
+    parser.add_argument("--repeat", type=int, default=1)
+
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,344 @@
+import asyncio, contextlib, json, math, os, pathlib, shutil, time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Optional
+import bilibili_api as bapi
+
+from core import bili_cache, video_handler, stream_policy
+
+SOURCE_FAVORITE = "favorite"
+# 合集
+SOURCE_SEASON = "season"
+# 系列（旧版的视频列表）
+SOURCE_SERIES = "series"
+SOURCE_UPLOADER = "uploader"
+SOURCES = (SOURCE_FAVORITE, SOURCE_SEASON, SOURCE_SERIES, SOURCE_UPLOADER)
+
+# 各个列表接口每页的条数
+FAVORITE_PAGE_SIZE = 20
+UPLOADER_PAGE_SIZE = 30
+SERIES_PAGE_SIZE = 100
+# 同时请求的列表页数
+LIST_CONCURRENCY = 3
+# 同时在下载的视频数，每个视频内部还有自己的分P流水线，实际连接数由调度器统一控制
+VIDEO_WORKERS = 2
+# 列好的视频最多积压多少个等着下载，列表翻得太快时在这里等
+QUEUE_DEPTH = 50
+
+INDEX_NAME = "archive_index.json"
+
+
+@dataclass
+class archiveEntry:
+    bvid: str
+    title: str
+    # 由列表接口里视频变化时会跟着变的字段拼成，不同接口能给的字段不一样
+    fingerprint: str
+
+
+async def _listPages(
+    fetch: Callable[[int], Awaitable[tuple[list[archiveEntry], int]]],
+    pageSize: int,
+) -> AsyncIterator[list[archiveEntry]]:
+    # fetch(页码) 返回 (这一页的条目, 总条数)；先拿第一页知道总数，剩下的页并发请求，谁先到先产出
+    first, total = await fetch(1)
+    yield first
+
+    limit = asyncio.Semaphore(LIST_CONCURRENCY)
+
+    async def fetchOne(pn: int) -> list[archiveEntry]:
+        async with limit:
+            return (await fetch(pn))[0]
+
+    tasks = [
+        asyncio.create_task(fetchOne(pn))
+        for pn in range(2, math.ceil(total / pageSize) + 1)
+    ]
+
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _favoriteLister(mediaId: int, credential: bapi.Credential):
+    async def fetch(pn: int) -> tuple[list[archiveEntry], int]:
+        data = await bapi.favorite_list.get_video_favorite_list_content(
+            mediaId, page=pn, credential=credential
+        )
+
+        entries = [
+            archiveEntry(
+                media["bvid"],
+                media.get("title", ""),
+                f"{media.get('page', 1)}:{media.get('pubtime', 0)}:{media.get('duration', 0)}",
+            )
+            for media in data.get("medias") or []
+            # attr 不为 0 的是已失效的视频
+            if media.get("bvid") and media.get("attr", 0) == 0
+        ]
+
+        return entries, data["info"]["media_count"]
+
+    return fetch
+
+
+def _uploaderLister(mid: int, credential: bapi.Credential):
+    user = bapi.user.User(mid, credential=credential)
+
+    async def fetch(pn: int) -> tuple[list[archiveEntry], int]:
+        data = await user.get_videos(pn=pn, ps=UPLOADER_PAGE_SIZE)
+
+        entries = [
+            archiveEntry(
+                video["bvid"],
+                video.get("title", ""),
+                f"{video.get('created', 0)}:{video.get('length', '')}",
+            )
+            for video in (data.get("list") or {}).get("vlist") or []
+        ]
+
+        return entries, data["page"]["count"]
+
+    return fetch
+
+
+def _seriesLister(seriesId: int, season: bool, credential: bapi.Credential):
+    seriesType = (
+        bapi.channel_series.ChannelSeriesType.SEASON
+        if season
+        else bapi.channel_series.ChannelSeriesType.SERIES
+    )
+    series = bapi.channel_series.ChannelSeries(
+        type_=seriesType, id_=seriesId, credential=credential
+    )
+
+    async def fetch(pn: int) -> tuple[list[archiveEntry], int]:
+        data = await series.get_videos(pn=pn, ps=SERIES_PAGE_SIZE)
+
+        entries = [
+            archiveEntry(
+                video["bvid"],
+                video.get("title", ""),
+                f"{video.get('pubdate', 0)}:{video.get('duration', 0)}",
+            )
+            for video in data.get("archives") or []
+        ]
+
+        return entries, data["page"]["total"]
+
+    return fetch
+
+
+def listSource(source: str, sourceId: int) -> AsyncIterator[list[archiveEntry]]:
+    credential = video_handler.getCredential()
+
+    if source == SOURCE_FAVORITE:
+        return _listPages(_favoriteLister(sourceId, credential), FAVORITE_PAGE_SIZE)
+    if source == SOURCE_UPLOADER:
+        return _listPages(_uploaderLister(sourceId, credential), UPLOADER_PAGE_SIZE)
+    if source in (SOURCE_SEASON, SOURCE_SERIES):
+        return _listPages(
+            _seriesLister(sourceId, source == SOURCE_SEASON, credential),
+            SERIES_PAGE_SIZE,
+        )
+
+    raise ValueError(f"不支持的来源：{source}")
+
+
+class archiveIndex:
+    """
+    归档目录里的索引：记录每个视频归档时的指纹，再次同步时指纹没变且上次下完了的直接跳过。
+    放在归档目录里，目录搬到别处也能接着增量同步
+    """
+
+    def __init__(self, folder: pathlib.Path):
+        self._path = folder / INDEX_NAME
+
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+
+        # bvid -> {"title", "fingerprint", "archivedAt", "pages": {分P序号: cid}}
+        self._videos: dict[str, dict] = data.get("videos", {})
+        # 来源 -> {"lastSync", "count"}
+        self._sources: dict[str, dict] = data.get("sources", {})
+        self._dirty = False
+
+    def isCurrent(self, entry: archiveEntry) -> bool:
+        record = self._videos.get(entry.bvid)
+
+        return record is not None and record.get("fingerprint") == entry.fingerprint
+
+    def stalePages(self, bvid: str, cids: dict[str, int]) -> list[str]:
+        # 上次归档过、但这次 cid 变了或已经不存在的分P；旧记录没有分P信息时全部算过期
+        record = self._videos.get(bvid)
+        if record is None:
+            return []
+
+        old = record.get("pages")
+        if old is None:
+            return list(cids)
+
+        return [pageIndex for pageIndex, cid in old.items() if cids.get(pageIndex) != cid]
+
+    def markDone(self, entry: archiveEntry, cids: dict[str, int]):
+        self._videos[entry.bvid] = {
+            "title": entry.title,
+            "fingerprint": entry.fingerprint,
+            "archivedAt": int(time.time()),
+            "pages": cids,
+        }
+        self._dirty = True
+
+    def markSynced(self, sourceKey: str, count: int):
+        self._sources[sourceKey] = {"lastSync": int(time.time()), "count": count}
+        self._dirty = True
+
+    def flush(self):
+        if not self._dirty:
+            return
+
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+
+        tmpPath = self._path.with_suffix(".tmp")
+        with open(tmpPath, "w", encoding="utf-8") as f:
+            json.dump(
+                {"videos": self._videos, "sources": self._sources},
+                f,
+                ensure_ascii=False,
+                indent=1,
+            )
+
+        os.replace(tmpPath, self._path)
+        self._dirty = False
+
+
+@dataclass
+class syncReport:
+    listed: int = 0
+    skipped: int = 0
+    downloaded: int = 0
+    failed: list[str] = field(default_factory=list)
+    # 列表是否已经翻完
+    listingDone: bool = False
+
+
+class archiveSync:
+    """
+    批量归档：一边并发翻列表，一边把新的或有变化的视频送进下载，
+    列表没翻完下载就已经开始了。每个视频下完立刻记进索引，中途退出下次接着来
+    """
+
+    def __init__(
+        self,
+        source: str,
+        sourceId: int,
+        folder: pathlib.Path,
+        policy: Optional[stream_policy.streamPolicy] = None,
+        danmaku: bool = False,
+        onUpdate: Optional[Callable[[syncReport], None]] = None,
+    ):
+        self._source = source
+        self._sourceId = sourceId
+        self._folder = folder
+        self._policy = policy or stream_policy.streamPolicy.fromConfig()
+        self._danmaku = danmaku
+        self._onUpdate = onUpdate
+
+        self._index = archiveIndex(folder)
+        self.report = syncReport()
+
+    def _notify(self):
+        if self._onUpdate:
+            self._onUpdate(self.report)
+
+    async def run(self) -> syncReport:
+        self._folder.mkdir(parents=True, exist_ok=True)
+
+        queue: asyncio.Queue[Optional[archiveEntry]] = asyncio.Queue(QUEUE_DEPTH)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(VIDEO_WORKERS)]
+        seen: set[str] = set()
+
+        try:
+            async with contextlib.aclosing(
+                listSource(self._source, self._sourceId)
+            ) as listing:
+                async for entries in listing:
+                    for entry in entries:
+                        # 翻页期间列表有增删时，同一个视频可能在相邻两页各出现一次
+                        if entry.bvid in seen:
+                            continue
+
+                        seen.add(entry.bvid)
+                        self.report.listed += 1
+
+                        if self._index.isCurrent(entry):
+                            self.report.skipped += 1
+                            continue
+
+                        await queue.put(entry)
+
+                    self._notify()
+
+            self.report.listingDone = True
+            self._notify()
+
+            for _ in workers:
+                await queue.put(None)
+
+            await asyncio.gather(*workers)
+
+            self._index.markSynced(f"{self._source}:{self._sourceId}", len(seen))
+        finally:
+            for task in workers:
+                task.cancel()
+
+            await asyncio.gather(*workers, return_exceptions=True)
+            self._index.flush()
+
+        return self.report
+
+    async def _worker(self, queue: asyncio.Queue[Optional[archiveEntry]]):
+        while (entry := await queue.get()) is not None:
+            try:
+                await self._archiveOne(entry)
+            except Exception as e:
+                print(f"{entry.bvid} 归档失败：{e}")
+                self.report.failed.append(entry.bvid)
+            else:
+                self.report.downloaded += 1
+
+            self._notify()
+
+    async def _archiveOne(self, entry: archiveEntry):
+        vido = video_handler.getVideo(entry.bvid)
+        folder = self._folder / entry.bvid
+
+        # 指纹变了说明视频有改动，分P列表要取最新的，不能用缓存
+        pages = await bili_cache.metaCache.getPages(vido, fresh=True)
+        cids = {str(pageIndex): page["cid"] for pageIndex, page in enumerate(pages)}
+
+        # 换了内容、重新上传或调了顺序的分P，旧成品还在的话流水线会当成已完成跳过，先删掉
+        for pageIndex in self._index.stalePages(entry.bvid, cids):
+            await asyncio.to_thread(shutil.rmtree, folder / pageIndex, ignore_errors=True)
+
+        results = await video_handler.downloadVideosV2(vido, folder, self._policy)
+
+        failed = [pageIndex for pageIndex, error in results.items() if error]
+        if failed:
+            raise IOError(f"分P {failed} 下载失败")
+
+        if self._danmaku:
+            exports = await video_handler.downloadVideoAss(vido, folder)
+            if not all(export.ok() for export in exports):
+                raise IOError("弹幕导出不完整")
+
+        # 全部下完才记进索引，失败的下次同步会重试
+        self._index.markDone(entry, cids)
+        self._index.flush()
@@ -0,0 +1,186 @@
+import asyncio, json, os, pathlib, time, urllib.parse
+from typing import Optional
+import bilibili_api as bapi
+
+from utils import config_loader as conf
+from core.single_flight import singleFlight
+
+# 视频信息、分P列表在磁盘上的保留时长（秒）
+META_TTL = 24 * 3600
+# 磁盘缓存最多保留的视频数
+META_MAX_ENTRIES = 500
+# 信息有变化后攒这么久（秒）再写盘，连着打开好几个视频只写一次
+META_DUMP_DELAY = 2.0
+# 下载地址在 deadline 之前提前这么久视为过期，留出下载启动的时间
+PLAYURL_SAFETY = 120
+# 地址里找不到 deadline 时的保守有效期
+PLAYURL_DEFAULT_TTL = 600
+
+
+def playurlDeadline(downloadData: dict) -> float:
+    # 下载地址的查询参数里带有 deadline（unix 时间戳），取所有地址里最早的那个
+    data = downloadData.get("video_info", downloadData)
+    urls = []
+
+    dash = data.get("dash") or {}
+    for stream in (dash.get("video") or []) + (dash.get("audio") or []):
+        urls.append(stream.get("base_url") or stream.get("baseUrl") or "")
+        urls += stream.get("backup_url") or stream.get("backupUrl") or []
+
+    for durl in data.get("durl") or []:
+        urls.append(durl.get("url", ""))
+        urls += durl.get("backup_url") or []
+
+    deadlines = []
+    for url in urls:
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+        if query.get("deadline", [""])[0].isdigit():
+            deadlines.append(int(query["deadline"][0]))
+
+    if not deadlines:
+        return time.time() + PLAYURL_DEFAULT_TTL
+
+    return min(deadlines) - PLAYURL_SAFETY
+
+
+def _writeJson(path: pathlib.Path, data: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmpPath = path.with_suffix(".tmp")
+    with open(tmpPath, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+    os.replace(tmpPath, path)
+
+
+def _reportDump(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"视频信息缓存写盘失败：{task.exception()}")
+
+
+class biliCache:
+    """
+    视频信息 / 分P列表 / 下载地址的缓存。
+    信息和分P列表落盘，下载地址只放内存，并按地址里自带的 deadline 过期
+    """
+
+    def __init__(self):
+        self._metaPath = conf.userConf.getProjectPath() / "cache" / "video_meta.json"
+        self._meta: Optional[dict[str, dict]] = None
+        self._dumpHandle: Optional[asyncio.TimerHandle] = None
+        self._dumpTask: Optional[asyncio.Task] = None
+
+        # key -> (过期时间, 下载信息)
+        self._playurls: dict[str, tuple[float, dict]] = {}
+        # 同一个 key 的并发请求共享一次网络调用
+        self._flights = singleFlight()
+
+    def _loadMeta(self) -> dict[str, dict]:
+        if self._meta is None:
+            try:
+                with open(self._metaPath, "r", encoding="utf-8") as f:
+                    self._meta = json.load(f)
+            except (OSError, ValueError):
+                self._meta = {}
+
+        return self._meta
+
+    def _dumpMeta(self):
+        # 只记一笔，过一会儿再统一写盘
+        if self._dumpHandle is None:
+            self._dumpHandle = asyncio.get_running_loop().call_later(
+                META_DUMP_DELAY, self._startDump
+            )
+
+    def _startDump(self):
+        self._dumpHandle = None
+
+        if self._dumpTask is not None and not self._dumpTask.done():
+            # 上一次还没写完，晚点再来，不同时写同一个文件
+            self._dumpMeta()
+
+            return
+
+        meta = self._loadMeta()
+
+        # 只保留最近用过的那些
+        if len(meta) > META_MAX_ENTRIES:
+            newest = sorted(meta.items(), key=lambda kv: kv[1]["time"])
+            self._meta = meta = dict(newest[-META_MAX_ENTRIES:])
+
+        # 浅拷贝一份给线程序列化，事件循环这边接着改也不会冲突
+        snapshot = {bvid: dict(entry) for bvid, entry in meta.items()}
+        self._dumpTask = asyncio.ensure_future(
+            asyncio.to_thread(_writeJson, self._metaPath, snapshot)
+        )
+        self._dumpTask.add_done_callback(_reportDump)
+
+    def _freshMeta(self, bvid: str) -> Optional[dict]:
+        entry = self._loadMeta().get(bvid)
+        if entry is None or time.time() - entry["time"] > META_TTL:
+            return None
+
+        return entry
+
+    async def getInfo(self, vido: bapi.video.Video, fresh: bool = False) -> dict:
+        bvid = vido.get_bvid()
+
+        entry = None if fresh else self._freshMeta(bvid)
+        if entry and "info" in entry:
+            return entry["info"]
+
+        async def fetch():
+            info = await vido.get_info()
+
+            self._loadMeta()[bvid] = {
+                "time": time.time(),
+                "info": info,
+                "pages": info.get("pages", []),
+            }
+            self._dumpMeta()
+
+            return info
+
+        return await self._flights.do(f"info:{bvid}", fetch)
+
+    async def getPages(self, vido: bapi.video.Video, fresh: bool = False) -> list[dict]:
+        bvid = vido.get_bvid()
+
+        entry = None if fresh else self._freshMeta(bvid)
+        if entry and entry.get("pages"):
+            return entry["pages"]
+
+        # 视频信息里本来就带着分P列表，一次请求把两样都缓存下来
+        info = await self.getInfo(vido, fresh=True)
+        if info.get("pages"):
+            return info["pages"]
+
+        pages = await vido.get_pages()
+        self._loadMeta()[bvid]["pages"] = pages
+        self._dumpMeta()
+
+        return pages
+
+    async def getDownloadUrl(
+        self, vido: bapi.video.Video, pageIndex: int, fresh: bool = False
+    ) -> dict:
+        # 接口一次返回所有清晰度的流，选哪一路由 stream_policy 决定，所以按 cid 缓存就够了
+        pages = await self.getPages(vido)
+        cid = pages[pageIndex]["cid"]
+        key = f"{vido.get_bvid()}:{cid}"
+
+        cached = self._playurls.get(key)
+        if not fresh and cached and cached[0] > time.time():
+            return cached[1]
+
+        async def fetch():
+            # 直接带上 cid，省掉库内部再查一次分P的请求
+            data = await vido.get_download_url(cid=cid)
+            self._playurls[key] = (playurlDeadline(data), data)
+
+            return data
+
+        return await self._flights.do(f"playurl:{key}", fetch)
+
+
+metaCache = biliCache()
@@ -0,0 +1,237 @@
+import asyncio, contextlib, hashlib, json, os, pathlib, shutil, time, urllib.parse
+from typing import BinaryIO, Optional
+
+from utils import config_loader as conf
+
+# 只剩仓库自己还引用着的对象（用户已经删掉了自己那份）最多占用的字节数，超出时按最近使用时间清理
+ORPHAN_MAX_BYTES = 512 * 1024 * 1024
+# 索引最多保留的条目数
+INDEX_MAX_ENTRIES = 20000
+
+
+class hashingWriter:
+    """
+    包一层文件对象，写入的同时计算 sha256，写完就知道内容摘要，不用再读一遍
+    """
+
+    def __init__(self, file: BinaryIO):
+        self._file = file
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data) -> int:
+        self._hash.update(data)
+        self.size += len(data)
+
+        return self._file.write(data)
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+def emojiKey(url: str) -> str:
+    # 表情图片的地址路径本身就是内容的标识，查询参数只是缩放之类的处理
+    path = urllib.parse.urlparse(url).path
+
+    return "emoji:" + hashlib.sha256(path.encode()).hexdigest()
+
+
+def _link(src: pathlib.Path, dest: pathlib.Path):
+    # 只做硬链接，链接不了（跨盘、文件系统不支持）时抛出 OSError
+    tmpPath = dest.with_name(dest.name + ".link")
+    tmpPath.unlink(missing_ok=True)
+
+    os.link(src, tmpPath)
+    os.replace(tmpPath, dest)
+
+
+def _collectOrphans(root: pathlib.Path, lastUsed: dict[str, float], limit: int) -> set[str]:
+    """
+    在线程里运行：链接数为 1 的对象只有仓库自己在用，占的是实打实的空间。
+    这些对象的总量超出 limit 时按最近使用时间删掉旧的，返回被删掉的摘要
+    """
+    orphans = []
+    for path in root.glob("*/*"):
+        if path.name.endswith(".link"):
+            continue
+
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+
+        if stat.st_nlink == 1:
+            orphans.append((lastUsed.get(path.name, 0), stat.st_size, path))
+
+    removed = set()
+    total = sum(size for _, size, _ in orphans)
+    for _, size, path in sorted(orphans):
+        if total <= limit:
+            break
+
+        path.unlink(missing_ok=True)
+        removed.add(path.name)
+        total -= size
+
+    return removed
+
+
+def _linkOrCopy(src: pathlib.Path, dest: pathlib.Path):
+    # 优先硬链接，不占额外空间；跨盘或文件系统不支持时退回复制
+    # （shutil 在 Linux 上会走 copy_file_range，btrfs/xfs 等会直接做成 reflink）
+    tmpPath = dest.with_name(dest.name + ".link")
+    tmpPath.unlink(missing_ok=True)
+
+    try:
+        os.link(src, tmpPath)
+    except OSError:
+        shutil.copyfile(src, tmpPath)
+
+    os.replace(tmpPath, dest)
+
+
+class contentStore:
+    """
+    按内容寻址的本地仓库：对象以 sha256 命名存放，索引记录"流的身份 -> 摘要"。
+    同一个视频流或表情再次下载时直接链接到目标目录，不再走网络。
+    对象和成品是硬链接，原地修改成品会连带修改仓库里的对象。
+    只收录能硬链接的文件，不额外占空间；用户删掉自己那份后只剩仓库引用的对象按总量上限清理
+    """
+
+    def __init__(self):
+        cachePath = conf.userConf.getProjectPath() / "cache"
+        self._objectRoot = cachePath / "objects"
+        self._indexPath = cachePath / "content_index.json"
+
+        # 身份 -> {"sha256", "size", "time"}
+        self._index: Optional[dict[str, dict]] = None
+        self._dirty = False
+        self._collectTask: Optional[asyncio.Task] = None
+
+    def enabled(self) -> bool:
+        return conf.userConf.getDownloadContentStore()
+
+    def _loadIndex(self) -> dict[str, dict]:
+        if self._index is None:
+            try:
+                with open(self._indexPath, "r", encoding="utf-8") as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+
+        return self._index
+
+    def flush(self):
+        if not self._dirty:
+            return
+
+        self._indexPath.parent.mkdir(parents=True, exist_ok=True)
+
+        tmpPath = self._indexPath.with_suffix(".tmp")
+        with open(tmpPath, "w", encoding="utf-8") as f:
+            json.dump(self._loadIndex(), f, ensure_ascii=False)
+
+        os.replace(tmpPath, self._indexPath)
+        self._dirty = False
+
+    def _objectPath(self, digest: str) -> pathlib.Path:
+        return self._objectRoot / digest[:2] / digest
+
+    def find(self, key: str) -> Optional[pathlib.Path]:
+        entry = self._loadIndex().get(key)
+        if entry is None:
+            return None
+
+        objectPath = self._objectPath(entry["sha256"])
+
+        # 摘要在写入时已经校验过，这里只核对大小，发现对象丢失或被截断就作废
+        try:
+            if objectPath.stat().st_size == entry["size"]:
+                return objectPath
+        except OSError:
+            pass
+
+        del self._loadIndex()[key]
+        self._dirty = True
+
+        return None
+
+    async def materialize(self, key: str, dest: pathlib.Path) -> bool:
+        # 仓库里有这份内容时链接到 dest 并返回 True
+        if not self.enabled():
+            return False
+
+        objectPath = self.find(key)
+        if objectPath is None:
+            return False
+
+        try:
+            await asyncio.to_thread(_linkOrCopy, objectPath, dest)
+        except OSError as e:
+            print(f"从本地仓库取出失败，改为重新下载：{e}")
+
+            return False
+
+        self._loadIndex()[key]["time"] = time.time()
+        self._dirty = True
+
+        return True
+
+    async def ingest(self, key: str, path: pathlib.Path, digest: str, size: int):
+        # digest/size 来自写入时的流式计算，和落盘结果对不上说明文件不完整，不收录
+        if not self.enabled():
+            return
+
+        try:
+            if path.stat().st_size != size:
+                print(f"文件大小与写入记录不一致，不收录：{path}")
+
+                return
+
+            objectPath = self._objectPath(digest)
+            if not objectPath.exists():
+                objectPath.parent.mkdir(parents=True, exist_ok=True)
+                # 复制一份会让每个视频占两倍空间，链接不了就不收录
+                await asyncio.to_thread(_link, path, objectPath)
+        except OSError as e:
+            print(f"无法硬链接到本地仓库（可能不在同一个盘），不收录：{e}")
+
+            with contextlib.suppress(OSError):
+                self._objectPath(digest).with_name(digest + ".link").unlink()
+
+            return
+
+        self._loadIndex()[key] = {"sha256": digest, "size": size, "time": time.time()}
+        self._dirty = True
+
+        # 每次启动后第一次收录时顺便在后台清理一次
+        if self._collectTask is None:
+            self._collectTask = asyncio.ensure_future(self.collect())
+
+    async def collect(self):
+        index = self._loadIndex()
+
+        lastUsed: dict[str, float] = {}
+        for entry in index.values():
+            lastUsed[entry["sha256"]] = max(lastUsed.get(entry["sha256"], 0), entry["time"])
+
+        try:
+            removed = await asyncio.to_thread(
+                _collectOrphans, self._objectRoot, lastUsed, ORPHAN_MAX_BYTES
+            )
+        except OSError as e:
+            print(f"清理本地仓库失败：{e}")
+
+            return
+
+        # 删掉指向已清理对象的条目，条目太多时只留最近用过的
+        entries = sorted(
+            (item for item in index.items() if item[1]["sha256"] not in removed),
+            key=lambda item: item[1]["time"],
+        )
+        self._index = dict(entries[-INDEX_MAX_ENTRIES:])
+        self._dirty = True
+        self.flush()
+
+
+objStore = contentStore()
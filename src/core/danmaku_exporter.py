@@ -0,0 +1,216 @@
+import asyncio, math, os, pathlib
+from dataclasses import dataclass, field
+from typing import Optional
+import aiohttp
+import bilibili_api as bapi
+from bilibili_api.exceptions import NetworkException
+
+from core import bili_cache, danmaku_layout
+from core.danmaku_layout import (
+    danmakuItem,
+    ASS_HEADER,
+    SCROLL_MODES,
+    MODE_TOP,
+    MODE_BOTTOM,
+)
+from core.download_scheduler import downScheduler, PRIORITY_HIGH
+
+# b站弹幕按 6 分钟一段分片下发
+SEGMENT_SECONDS = 360
+# 整个导出任务里同时在途的分段请求数
+FETCH_CONCURRENCY = 6
+# 同时在写的分P数
+PAGE_CONCURRENCY = 3
+# 单个分P内最多提前拉取的分段数，写入仍按时间顺序进行
+SEGMENT_WINDOW = 3
+# 单个分段的重试次数与退避基数（秒）
+SEGMENT_RETRIES = 4
+SEGMENT_RETRY_BACKOFF = 1.0
+# 值得重试的 HTTP 状态：风控、限流和服务端错误
+RETRY_STATUS = {412, 429, 500, 502, 503, 504}
+
+# 高级弹幕、代码弹幕、BAS 弹幕没法用普通字幕表示，直接跳过
+EXPORT_MODES = SCROLL_MODES | {MODE_TOP, MODE_BOTTOM}
+
+
+@dataclass
+class pageExport:
+    pageIndex: int
+    path: pathlib.Path
+    segments: int = 0
+    failedSegments: list[int] = field(default_factory=list)
+    count: int = 0
+    error: Optional[BaseException] = None
+
+    def ok(self) -> bool:
+        return self.error is None and not self.failedSegments
+
+
+def _enumValue(value) -> int:
+    return int(getattr(value, "value", value))
+
+
+def toItem(dm: bapi.Danmaku) -> Optional[danmakuItem]:
+    mode = _enumValue(dm.mode)
+    if mode not in EXPORT_MODES:
+        return None
+
+    color = dm.color
+    if isinstance(color, str):
+        color = int(color or "ffffff", 16)
+
+    return danmakuItem(
+        float(dm.dm_time), mode, _enumValue(dm.font_size), int(color), dm.text
+    )
+
+
+class assWriter:
+    # 边收边写，先写 .part，全部写完再改名
+    def __init__(self, path: pathlib.Path):
+        self._path = path
+        self._partPath = path.with_name(path.name + ".part")
+        self._file = None
+
+    def __enter__(self):
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self._partPath, "w", encoding="utf-8-sig")
+        self._file.write(ASS_HEADER)
+
+        return self
+
+    def write(self, lines: list[str]):
+        self._file.writelines(lines)
+
+    def __exit__(self, excType, exc, tb):
+        self._file.close()
+
+        if excType is None:
+            os.replace(self._partPath, self._path)
+        else:
+            self._partPath.unlink(missing_ok=True)
+
+
+def _isTransient(e: Exception) -> bool:
+    if isinstance(e, NetworkException):
+        return e.status in RETRY_STATUS
+
+    return isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+async def _fetchSegment(
+    vido: bapi.video.Video, cid: int, seg: int, limit: asyncio.Semaphore
+) -> Optional[list[danmakuItem]]:
+    # 网络抖动重试耗尽返回 None，由调用方记为失败分段，不影响其他分段；
+    # 弹幕已关闭、参数或响应有误这类重试也没用的错误直接抛出，整P记为失败
+    for attempt in range(SEGMENT_RETRIES):
+        try:
+            async with limit:
+                danmakus = await vido.get_danmakus(cid=cid, from_seg=seg, to_seg=seg)
+
+            items = [item for dm in danmakus if (item := toItem(dm)) is not None]
+            items.sort(key=lambda item: item.time)
+
+            return items
+        except Exception as e:
+            if not _isTransient(e):
+                raise
+
+            if attempt == SEGMENT_RETRIES - 1:
+                print(f"弹幕分段 cid={cid} #{seg} 获取失败：{e}")
+
+                return None
+
+            await asyncio.sleep(SEGMENT_RETRY_BACKOFF * 2**attempt)
+
+
+async def exportPage(
+    vido: bapi.video.Video,
+    pageIndex: int,
+    page: dict,
+    out: pathlib.Path,
+    limit: asyncio.Semaphore,
+) -> pageExport:
+    result = pageExport(pageIndex, out)
+    result.segments = max(1, math.ceil(page.get("duration", 0) / SEGMENT_SECONDS))
+
+    # 装了 numpy 时用批量排版
+    layout = danmaku_layout.newLayout()
+    segments = iter(range(result.segments))
+    inflight: list[tuple[int, asyncio.Task]] = []
+
+    try:
+        with assWriter(out) as writer:
+            while True:
+                # 预取后面几段，写入严格按分段顺序，内存里只压着一个窗口
+                for seg in segments:
+                    task = asyncio.create_task(
+                        _fetchSegment(vido, page["cid"], seg, limit)
+                    )
+                    inflight.append((seg, task))
+                    if len(inflight) >= SEGMENT_WINDOW:
+                        break
+
+                if not inflight:
+                    break
+
+                seg, task = inflight.pop(0)
+                items = await task
+
+                if items is None:
+                    result.failedSegments.append(seg)
+
+                    continue
+
+                writer.write(layout.place(items))
+                result.count += len(items)
+    except Exception as e:
+        result.error = e
+    finally:
+        for _, task in inflight:
+            task.cancel()
+
+        await asyncio.gather(*(task for _, task in inflight), return_exceptions=True)
+
+    return result
+
+
+async def exportVideo(vido: bapi.video.Video, folder: pathlib.Path) -> list[pageExport]:
+    """
+    导出所有分P的弹幕为 ASS，和视频放在同一个目录下、同名，播放器会自动加载。
+    所有分P共享一个并发上限，单个分段失败会重试，最终结果逐P返回
+    """
+    pages = await bili_cache.metaCache.getPages(vido)
+    limit = asyncio.Semaphore(FETCH_CONCURRENCY)
+    pageLimit = asyncio.Semaphore(PAGE_CONCURRENCY)
+
+    async def exportOne(pageIndex: int, page: dict) -> pageExport:
+        async with pageLimit:
+            out = folder / str(pageIndex) / "video.ass"
+
+            return await exportPage(vido, pageIndex, page, out, limit)
+
+    results = await asyncio.gather(
+        *(exportOne(pageIndex, page) for pageIndex, page in enumerate(pages))
+    )
+
+    for result in results:
+        if result.error is not None:
+            print(f"第{result.pageIndex}P弹幕导出失败：{result.error}")
+        elif result.failedSegments:
+            print(
+                f"第{result.pageIndex}P弹幕导出不完整，缺少分段 {result.failedSegments}，"
+                f"共 {result.count} 条：{result.path}"
+            )
+        else:
+            print(f"第{result.pageIndex}P弹幕已导出 {result.count} 条：{result.path}")
+
+    return results
+
+
+def submitExport(vido: bapi.video.Video, folder: pathlib.Path):
+    # 弹幕数据量小，整个视频作为一个高优先级任务，只占调度器的一个名额
+    return downScheduler.submit(
+        lambda: exportVideo(vido, folder),
+        f"{vido.get_bvid()} 弹幕",
+        PRIORITY_HIGH,
+    )
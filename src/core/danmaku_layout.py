@@ -0,0 +1,366 @@
+import functools, math, unicodedata
+from dataclasses import dataclass
+from typing import Iterable
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy 是可选依赖，没装时退回逐条计算的排版
+    np = None
+
+# 画布与样式
+PLAY_RES_X = 1920
+PLAY_RES_Y = 1080
+FONT_NAME = "Microsoft YaHei"
+# b站的字号（18/25/36）换算到 1080p 画布上的倍率
+FONT_SCALE = 1.6
+NORMAL_FONT_SIZE = 25
+LINE_SPACING = 1.2
+# 没有字体度量，半角字符按全角字宽的这个比例估算
+NARROW_WIDTH = 0.55
+# 滚动弹幕横穿屏幕的时长、顶部/底部弹幕的停留时长（秒）
+SCROLL_SECONDS = 10.0
+FIXED_SECONDS = 5.0
+
+MODE_SCROLL = 1
+MODE_BOTTOM = 4
+MODE_TOP = 5
+MODE_REVERSE = 6
+SCROLL_MODES = {1, 2, 3, MODE_REVERSE}
+
+# 批量转义时拼接文本用的分隔符
+_JOIN_SEP = "\x00"
+
+
+@dataclass
+class danmakuItem:
+    time: float
+    mode: int
+    size: int
+    color: int
+    text: str
+
+
+@functools.cache
+def _wideTable() -> bytes:
+    # 基本平面每个码位是否是全角，两种排版共用，保证估出来的宽度完全一致
+    return bytes(
+        unicodedata.east_asian_width(chr(cp)) in "WF" for cp in range(0x10000)
+    )
+
+
+def _isWide(cp: int) -> int:
+    if cp < 0x10000:
+        return _wideTable()[cp]
+
+    return int(unicodedata.east_asian_width(chr(cp)) in "WF")
+
+
+def textWidth(text: str, fontSize: float) -> float:
+    wide = sum(_isWide(cp) for cp in map(ord, text))
+
+    return (wide + (len(text) - wide) * NARROW_WIDTH) * fontSize
+
+
+def scrollAdvance(width: float) -> float:
+    # 滚动弹幕从右边缘出现到尾巴完全进入屏幕所需的时间，
+    # 也是后一条（宽度为 width）从出现到追上屏幕左边缘前需要让出的时间
+    return SCROLL_SECONDS * width / (PLAY_RES_X + width)
+
+
+def assTime(seconds: float) -> str:
+    return _assCentis(max(0, int(round(seconds * 100))))
+
+
+# 批量格式化时间戳用的查表："MM:SS" 和两位数
+_CLOCK = [f"{minute:02d}:{second:02d}" for minute in range(60) for second in range(60)]
+_DIGITS = [f"{value:02d}" for value in range(100)]
+
+
+def _assCentis(centis: int) -> str:
+    hours, minutes = centis // 360000, centis // 6000 % 60
+
+    return f"{hours}:{minutes:02d}:{centis // 100 % 60:02d}.{centis % 100:02d}"
+
+
+def assText(text: str) -> str:
+    # 花括号和反斜杠在 ASS 里是控制字符，换成全角
+    return (
+        text.replace("\\", "＼")
+        .replace("{", "｛")
+        .replace("}", "｝")
+        .replace("\r", "")
+        .replace("\n", "\\N")
+    )
+
+
+def assColor(color: int) -> str:
+    # ASS 的颜色是 BGR 顺序
+    r, g, b = color >> 16 & 0xFF, color >> 8 & 0xFF, color & 0xFF
+
+    return f"&H{b:02X}{g:02X}{r:02X}&"
+
+
+def _styleOverrides(size: int, fontSize: float, color: int) -> str:
+    overrides = ""
+
+    if size != NORMAL_FONT_SIZE:
+        overrides += f"\\fs{fontSize:.0f}"
+    if color != 0xFFFFFF:
+        overrides += f"\\c{assColor(color)}"
+
+    return overrides
+
+
+def _dialogue(start: str, end: str, overrides: str, text: str) -> str:
+    return f"Dialogue: 0,{start},{end},Danmaku,,0,0,0,,{{{overrides}}}{text}\n"
+
+
+ASS_HEADER = f"""[Script Info]
+ScriptType: v4.00+
+PlayResX: {PLAY_RES_X}
+PlayResY: {PLAY_RES_Y}
+WrapStyle: 2
+ScaledBorderAndShadow: yes
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Danmaku,{FONT_NAME},{NORMAL_FONT_SIZE * FONT_SCALE:.0f},&H33FFFFFF,&H33FFFFFF,&H33000000,&H33000000,0,0,0,0,100,100,0,0,1,1.5,0,7,0,0,0,1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+
+class danmakuLayout:
+    """
+    逐条分配弹幕轨道：滚动弹幕要求前一条已经完全进入屏幕、且后一条追不上前一条，
+    顶部/底部弹幕要求同一轨道上前一条已经消失。没有空轨道时放到最早空出来的那条。
+    轨道状态跨分段保留，所以可以一段一段地喂进来
+    """
+
+    def __init__(self):
+        self._laneHeight = NORMAL_FONT_SIZE * FONT_SCALE * LINE_SPACING
+        laneCount = max(1, int(PLAY_RES_Y // self._laneHeight))
+
+        # 滚动轨道记录 (出现时间, 让出时间)，固定轨道记录消失时间
+        self._scrollLanes: list[tuple[float, float]] = [(-math.inf, 0.0)] * laneCount
+        self._topLanes: list[float] = [-math.inf] * laneCount
+        self._bottomLanes: list[float] = [-math.inf] * laneCount
+
+    def _scrollLane(self, start: float, advance: float) -> int:
+        best, bestWait = 0, math.inf
+
+        for lane, (prevStart, prevAdvance) in enumerate(self._scrollLanes):
+            # 前一条尾巴进入屏幕，且新的这条不会追尾
+            wait = prevStart + max(prevAdvance, advance) - start
+
+            if wait <= 0:
+                return lane
+
+            if wait < bestWait:
+                best, bestWait = lane, wait
+
+        return best
+
+    def _fixedLane(self, lanes: list[float], start: float) -> int:
+        for lane, freeAt in enumerate(lanes):
+            if freeAt <= start:
+                return lane
+
+        return min(range(len(lanes)), key=lanes.__getitem__)
+
+    def _scrollEvent(
+        self, start: float, advance: float, width: float, mode: int
+    ) -> tuple[float, str]:
+        lane = self._scrollLane(start, advance)
+        self._scrollLanes[lane] = (start, advance)
+        y = lane * self._laneHeight
+
+        # 逆向弹幕从左往右
+        if mode == MODE_REVERSE:
+            move = f"\\move({-width:.0f},{y:.0f},{PLAY_RES_X},{y:.0f})"
+        else:
+            move = f"\\move({PLAY_RES_X},{y:.0f},{-width:.0f},{y:.0f})"
+
+        return start + SCROLL_SECONDS, f"\\an7{move}"
+
+    def _fixedEvent(self, start: float, mode: int) -> tuple[float, str]:
+        lanes = self._topLanes if mode == MODE_TOP else self._bottomLanes
+        lane = self._fixedLane(lanes, start)
+        end = start + FIXED_SECONDS
+        lanes[lane] = end
+
+        if mode == MODE_TOP:
+            return end, f"\\an8\\pos({PLAY_RES_X // 2},{lane * self._laneHeight:.0f})"
+
+        y = PLAY_RES_Y - lane * self._laneHeight
+
+        return end, f"\\an2\\pos({PLAY_RES_X // 2},{y:.0f})"
+
+    def place(self, items: Iterable[danmakuItem]) -> list[str]:
+        # items 需要按时间排好序，返回 ASS 的 Dialogue 行
+        lines = []
+
+        for item in items:
+            fontSize = item.size * FONT_SCALE
+
+            if item.mode in SCROLL_MODES:
+                width = textWidth(item.text, fontSize)
+                end, position = self._scrollEvent(
+                    item.time, scrollAdvance(width), width, item.mode
+                )
+            else:
+                end, position = self._fixedEvent(item.time, item.mode)
+
+            lines.append(
+                _dialogue(
+                    assTime(item.time),
+                    assTime(end),
+                    position + _styleOverrides(item.size, fontSize, item.color),
+                    assText(item.text),
+                )
+            )
+
+        return lines
+
+
+class vectorLayout(danmakuLayout):
+    """
+    numpy 批量版本：宽度、出现/消失时间、时间戳、转义都按整段数组一次算完，
+    只有轨道分配（后一条依赖前一条的结果）还是顺序扫描，但用的是预先算好的数值。
+    输出和 danmakuLayout 逐字节一致
+    """
+
+    def _widths(self, texts: list[str], fontSizes: "np.ndarray") -> "np.ndarray":
+        lengths = np.fromiter(map(len, texts), np.int64, len(texts))
+        codepoints = np.frombuffer(
+            "".join(texts).encode("utf-32-le", "surrogatepass"), dtype=np.uint32
+        )
+
+        bmp = codepoints < 0x10000
+        wide = np.zeros(len(codepoints), dtype=np.int64)
+        wide[bmp] = np.frombuffer(_wideTable(), dtype=np.uint8)[codepoints[bmp]]
+        if not bmp.all():
+            wide[~bmp] = [_isWide(int(cp)) for cp in codepoints[~bmp]]
+
+        # 用前缀和一次求出每条弹幕里的全角字符数
+        ends = np.cumsum(lengths)
+        prefix = np.concatenate(([0], np.cumsum(wide)))
+        wideCount = prefix[ends] - prefix[ends - lengths]
+
+        return (wideCount + (lengths - wideCount) * NARROW_WIDTH) * fontSizes
+
+    def _escapeAll(self, texts: list[str]) -> list[str]:
+        # 拼成一个大字符串统一替换，再按分隔符拆回去
+        joined = _JOIN_SEP.join(texts)
+        if joined.count(_JOIN_SEP) != len(texts) - 1:
+            return [assText(text) for text in texts]
+
+        return assText(joined).split(_JOIN_SEP)
+
+    def _timestamps(self, seconds: "np.ndarray") -> list[str]:
+        centis = np.maximum(np.round(seconds * 100), 0).astype(np.int64)
+
+        # 查表拼接，和 _assCentis 的格式完全一样
+        return [
+            f"{hours}:{_CLOCK[minuteSecond]}.{_DIGITS[rest]}"
+            for hours, minuteSecond, rest in zip(
+                (centis // 360000).tolist(),
+                (centis // 100 % 3600).tolist(),
+                (centis % 100).tolist(),
+            )
+        ]
+
+    def place(self, items: Iterable[danmakuItem]) -> list[str]:
+        items = list(items)
+        count = len(items)
+        if count == 0:
+            return []
+
+        times = np.fromiter((item.time for item in items), np.float64, count)
+        modes = np.fromiter((item.mode for item in items), np.int64, count)
+        sizes = np.fromiter((item.size for item in items), np.int64, count)
+        texts = [item.text for item in items]
+
+        fontSizes = sizes * FONT_SCALE
+        widths = self._widths(texts, fontSizes)
+        advances = SCROLL_SECONDS * widths / (PLAY_RES_X + widths)
+        isScroll = np.isin(modes, list(SCROLL_MODES))
+        ends = times + np.where(isScroll, SCROLL_SECONDS, FIXED_SECONDS)
+
+        starts = self._timestamps(times)
+        stops = self._timestamps(ends)
+        escaped = self._escapeAll(texts)
+
+        # 轨道分配只能顺序做，热循环里只用局部变量和普通比较，不走方法调用
+        laneCount = len(self._scrollLanes)
+        laneY = [f"{lane * self._laneHeight:.0f}" for lane in range(laneCount)]
+        bottomY = [
+            f"{PLAY_RES_Y - lane * self._laneHeight:.0f}" for lane in range(laneCount)
+        ]
+        laneStarts = [start for start, _ in self._scrollLanes]
+        laneAdvances = [advance for _, advance in self._scrollLanes]
+        styles: dict[tuple[int, int], str] = {}
+
+        lines = []
+        for item, time, scroll, advance, width, fontSize, start, stop, text in zip(
+            items,
+            times.tolist(),
+            isScroll.tolist(),
+            advances.tolist(),
+            widths.tolist(),
+            fontSizes.tolist(),
+            starts,
+            stops,
+            escaped,
+        ):
+            mode = item.mode
+
+            if scroll:
+                best, bestWait = 0, math.inf
+                for lane in range(laneCount):
+                    prevAdvance = laneAdvances[lane]
+                    wait = (
+                        laneStarts[lane]
+                        + (prevAdvance if prevAdvance > advance else advance)
+                        - time
+                    )
+                    if wait <= 0:
+                        best = lane
+                        break
+                    if wait < bestWait:
+                        best, bestWait = lane, wait
+
+                laneStarts[best] = time
+                laneAdvances[best] = advance
+                y = laneY[best]
+
+                if mode == MODE_REVERSE:
+                    position = f"\\an7\\move({-width:.0f},{y},{PLAY_RES_X},{y})"
+                else:
+                    position = f"\\an7\\move({PLAY_RES_X},{y},{-width:.0f},{y})"
+            else:
+                lanes = self._topLanes if mode == MODE_TOP else self._bottomLanes
+                lane = self._fixedLane(lanes, time)
+                lanes[lane] = time + FIXED_SECONDS
+
+                if mode == MODE_TOP:
+                    position = f"\\an8\\pos({PLAY_RES_X // 2},{laneY[lane]})"
+                else:
+                    position = f"\\an2\\pos({PLAY_RES_X // 2},{bottomY[lane]})"
+
+            key = (item.size, item.color)
+            style = styles.get(key)
+            if style is None:
+                style = styles[key] = _styleOverrides(item.size, fontSize, item.color)
+
+            lines.append(_dialogue(start, stop, position + style, text))
+
+        self._scrollLanes = list(zip(laneStarts, laneAdvances))
+
+        return lines
+
+
+def newLayout() -> danmakuLayout:
+    return vectorLayout() if np is not None else danmakuLayout()
@@ -0,0 +1,93 @@
+import os, pathlib
+from typing import Optional
+
+from core import range_downloader, mp4_remux
+
+
+class clipError(Exception):
+    pass
+
+
+def _parseRange(text: str) -> tuple[int, int]:
+    # dash 里写的是 "起点-终点"，终点包含在内
+    first, last = str(text).split("-", 1)
+
+    return int(first), int(last) + 1
+
+
+def indexRanges(entry: dict) -> tuple[tuple[int, int], tuple[int, int]]:
+    # 返回 (初始化段, sidx) 的字节区间，终点不含
+    base = entry.get("segment_base") or entry.get("SegmentBase") or {}
+    init = base.get("initialization") or base.get("Initialization")
+    index = base.get("index_range") or base.get("indexRange")
+
+    if not init or not index:
+        raise clipError("这个流没有分片索引，没法只下载一段")
+
+    return _parseRange(init), _parseRange(index)
+
+
+def pickRefs(
+    refs: list[mp4_remux.sidxRef], start: float, end: float
+) -> list[mp4_remux.sidxRef]:
+    # 分片是连续的，取和 [start, end) 有交集的那一串；视频分片从关键帧开始，首尾会略宽一点
+    chosen = [ref for ref in refs if ref.end > start and ref.start < end]
+    if not chosen:
+        raise clipError(f"时间范围 {start:.0f}-{end:.0f} 秒超出了视频长度")
+
+    return chosen
+
+
+async def _collect(url: str, mirrors: list[str], byteRange: tuple[int, int]) -> bytes:
+    buffer = bytearray()
+    async for chunk in range_downloader.streamInOrder(
+        url, mirrors=mirrors, byteRange=byteRange
+    ):
+        buffer += chunk
+
+    return bytes(buffer)
+
+
+async def downloadClip(
+    url: str,
+    entry: dict,
+    start: float,
+    end: float,
+    out: str,
+    mirrors: Optional[list[str]] = None,
+) -> tuple[float, float]:
+    """
+    只下载一个流在 [start, end) 秒之间的分片：先用一个小的 Range 请求取回初始化段和 sidx，
+    按索引算出字节区间，再把初始化段和这一串分片拼成一个可以直接混流的 m4s。
+    返回实际覆盖的时间范围（按分片边界取整）
+    """
+    mirrors = mirrors or []
+    init, index = indexRanges(entry)
+
+    head = await _collect(url, mirrors, (0, index[1]))
+    try:
+        refs = mp4_remux.parseSidx(head)
+    except mp4_remux.remuxError as e:
+        raise clipError(f"分片索引解析失败：{e}") from e
+
+    chosen = pickRefs(refs, start, end)
+    partPath = pathlib.Path(f"{out}.part")
+
+    try:
+        with open(partPath, "wb") as file:
+            file.write(head[init[0] : init[1]])
+
+            async for chunk in range_downloader.streamInOrder(
+                url,
+                mirrors=mirrors,
+                byteRange=(chosen[0].byteStart, chosen[-1].byteEnd),
+            ):
+                file.write(chunk)
+    except BaseException:
+        partPath.unlink(missing_ok=True)
+
+        raise
+
+    os.replace(partPath, out)
+
+    return chosen[0].start, chosen[-1].end
@@ -0,0 +1,292 @@
+import asyncio, contextvars, json, sqlite3, time
+from typing import Optional
+
+from utils import config_loader as conf
+
+# 写入先攒着，最多隔这么久（秒）或攒够这么多条提交一次
+FLUSH_INTERVAL = 1.0
+FLUSH_BATCH = 500
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+# 用户或归档同步主动取消的任务，不再自动恢复
+JOB_CANCELLED = "cancelled"
+# 启动时需要接着下的状态：还没开始的，以及上次退出时正在下的
+UNFINISHED = (JOB_PENDING, JOB_RUNNING)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    bvid TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    options TEXT NOT NULL DEFAULT '{}',
+    state TEXT NOT NULL,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    UNIQUE (bvid, folder)
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, updated);
+
+CREATE TABLE IF NOT EXISTS pages (
+    job_id INTEGER NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+    page_index INTEGER NOT NULL,
+    cid INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL,
+    attempt INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    mode TEXT,
+    output TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (job_id, page_index)
+);
+CREATE INDEX IF NOT EXISTS pages_state ON pages (state);
+
+CREATE TABLE IF NOT EXISTS streams (
+    out TEXT PRIMARY KEY,
+    job_id INTEGER,
+    page_index INTEGER,
+    stream TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL,
+    ranges TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS streams_page ON streams (job_id, page_index);
+"""
+
+# 当前协程在下载哪个任务的哪一P，和进度一样靠上下文传递，下载代码不用层层传参
+_currentPage: contextvars.ContextVar[Optional[tuple[int, int]]] = (
+    contextvars.ContextVar("currentJournalPage", default=None)
+)
+
+
+def bindPage(jobId: int, pageIndex: int):
+    _currentPage.set((jobId, pageIndex))
+
+
+class downloadJournal:
+    """
+    下载任务的持久化记录：任务 / 分P / 流 / 已落盘的字节区间。
+    WAL 模式加批量提交，进度更新很频繁也不会拖慢下载；意外退出最多丢最后一个提交周期，
+    而文件本身的续传以旁路清单为准，丢掉的那一点只会让启动后多核对一次
+    """
+
+    def __init__(self):
+        self._path = conf.userConf.getProjectPath() / "cache" / "download_journal.db"
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending = 0
+        self._flushHandle: Optional[asyncio.TimerHandle] = None
+        # 程序正在退出：这之后被取消的任务是被退出打断的，保持进行中
+        self._shuttingDown = False
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+
+            self._conn = sqlite3.connect(self._path, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # WAL 下 NORMAL 只在检查点时同步，掉电最多丢最近的事务，库本身不会坏
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._conn.executescript(_SCHEMA)
+
+            # 旧版本建的库没有记录成品文件名的列
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(pages)")}
+            for column in ("mode", "output"):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE pages ADD COLUMN {column} TEXT")
+
+        return self._conn
+
+    def _write(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        # 事务在第一次写入时才开，空闲时不占着读快照，WAL 能正常做检查点
+        db = self._db()
+        if not db.in_transaction:
+            db.execute("BEGIN")
+
+        cursor = db.execute(sql, params)
+        self._pending += 1
+
+        if self._pending >= FLUSH_BATCH:
+            self.commit()
+        elif self._flushHandle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # 不在事件循环里（比如退出时），直接提交
+                self.commit()
+            else:
+                self._flushHandle = loop.call_later(FLUSH_INTERVAL, self.commit)
+
+        return cursor
+
+    def commit(self):
+        if self._flushHandle is not None:
+            self._flushHandle.cancel()
+            self._flushHandle = None
+
+        if self._conn is not None and self._conn.in_transaction:
+            self._conn.execute("COMMIT")
+
+        self._pending = 0
+
+    def beginShutdown(self):
+        self._shuttingDown = True
+
+    def close(self):
+        self.commit()
+
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # 任务
+
+    def openJob(self, bvid: str, folder: str, options: dict) -> int:
+        # 同一个视频下到同一个目录算同一个任务，重复提交时复用并重新标记为进行中
+        now = time.time()
+        row = self._db().execute(
+            "SELECT id FROM jobs WHERE bvid = ? AND folder = ?", (bvid, folder)
+        ).fetchone()
+
+        if row is not None:
+            self._write(
+                "UPDATE jobs SET state = ?, options = ?, error = NULL, updated = ? WHERE id = ?",
+                (JOB_RUNNING, json.dumps(options), now, row[0]),
+            )
+
+            return row[0]
+
+        cursor = self._write(
+            "INSERT INTO jobs (bvid, folder, options, state, created, updated)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (bvid, folder, json.dumps(options), JOB_RUNNING, now, now),
+        )
+
+        return cursor.lastrowid
+
+    def finishJob(self, jobId: int, error: Optional[str] = None):
+        self._write(
+            "UPDATE jobs SET state = ?, error = ?, updated = ? WHERE id = ?",
+            (JOB_FAILED if error else JOB_DONE, error, time.time(), jobId),
+        )
+
+    def cancelJob(self, jobId: int):
+        if self._shuttingDown:
+            return
+
+        self._write(
+            "UPDATE jobs SET state = ?, updated = ? WHERE id = ?",
+            (JOB_CANCELLED, time.time(), jobId),
+        )
+
+    def findJob(self, bvid: str, folder: str) -> Optional[int]:
+        row = self._db().execute(
+            "SELECT id FROM jobs WHERE bvid = ? AND folder = ?", (bvid, folder)
+        ).fetchone()
+
+        return row[0] if row else None
+
+    def unfinishedJobs(self, limit: int = -1) -> list[dict]:
+        rows = self._db().execute(
+            "SELECT id, bvid, folder, options FROM jobs WHERE state IN (?, ?)"
+            " ORDER BY updated LIMIT ?",
+            (*UNFINISHED, limit),
+        ).fetchall()
+
+        return [
+            {"id": jobId, "bvid": bvid, "folder": folder, "options": json.loads(options)}
+            for jobId, bvid, folder, options in rows
+        ]
+
+    def jobsByState(self, state: str, limit: int = 100, offset: int = 0) -> list[dict]:
+        rows = self._db().execute(
+            "SELECT id, bvid, folder, error, updated FROM jobs WHERE state = ?"
+            " ORDER BY updated DESC LIMIT ? OFFSET ?",
+            (state, limit, offset),
+        ).fetchall()
+
+        return [
+            {"id": jobId, "bvid": bvid, "folder": folder, "error": error, "updated": updated}
+            for jobId, bvid, folder, error, updated in rows
+        ]
+
+    def counts(self) -> dict[str, int]:
+        # 走 jobs_state 索引，几万个任务也只是扫一遍索引
+        return dict(
+            self._db().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        )
+
+    # 分P
+
+    def updatePage(
+        self,
+        jobId: int,
+        pageIndex: int,
+        state: str,
+        cid: int = 0,
+        attempt: int = 0,
+        error: Optional[str] = None,
+        mode: Optional[str] = None,
+        output: Optional[str] = None,
+    ):
+        # mode / output 是下完时用的选流模式和实际的成品文件名，没给时保留原来的
+        self._write(
+            "INSERT INTO pages"
+            " (job_id, page_index, cid, state, attempt, error, mode, output, updated)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (job_id, page_index) DO UPDATE SET"
+            " cid = MAX(cid, excluded.cid), state = excluded.state,"
+            " attempt = excluded.attempt, error = excluded.error,"
+            " mode = COALESCE(excluded.mode, mode), output = COALESCE(excluded.output, output),"
+            " updated = excluded.updated",
+            (jobId, pageIndex, cid, state, attempt, error, mode, output, time.time()),
+        )
+
+    def pageOutput(self, jobId: int, pageIndex: int, mode: str) -> Optional[str]:
+        # 同一个选流模式下这一P上次实际写出的文件名
+        row = self._db().execute(
+            "SELECT output FROM pages WHERE job_id = ? AND page_index = ? AND mode = ?",
+            (jobId, pageIndex, mode),
+        ).fetchone()
+
+        return row[0] if row else None
+
+    def failedPages(self, jobId: int) -> list[tuple[int, str]]:
+        return self._db().execute(
+            "SELECT page_index, error FROM pages WHERE job_id = ? AND state = ?"
+            " ORDER BY page_index",
+            (jobId, JOB_FAILED),
+        ).fetchall()
+
+    # 流和字节区间
+
+    def saveRanges(
+        self, out: str, stream: str, total: int, ranges: list[tuple[int, int]]
+    ):
+        jobId, pageIndex = _currentPage.get() or (None, None)
+        done = sum(end - start for start, end in ranges)
+
+        self._write(
+            "INSERT OR REPLACE INTO streams"
+            " (out, job_id, page_index, stream, total, done, ranges, updated)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (out, jobId, pageIndex, stream, total, done, json.dumps(ranges), time.time()),
+        )
+
+    def loadRanges(self, out: str, stream: str, total: int) -> list[tuple[int, int]]:
+        row = self._db().execute(
+            "SELECT ranges FROM streams WHERE out = ? AND stream = ? AND total = ?",
+            (out, stream, total),
+        ).fetchone()
+
+        return [tuple(r) for r in json.loads(row[0])] if row else []
+
+    def dropStream(self, out: str):
+        self._write("DELETE FROM streams WHERE out = ?", (out,))
+
+
+dlJournal = downloadJournal()
@@ -0,0 +1,224 @@
+import asyncio, contextlib, contextvars, time
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+# 进度合并推送的间隔（秒），再多的数据块也只按这个频率通知界面
+REPORT_INTERVAL = 0.25
+# 瞬时速度的平滑系数，越大越跟手
+SPEED_SMOOTHING = 0.3
+
+# 已登记但还在等调度器的名额
+STATE_QUEUED = "queued"
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+FINAL_STATES = (STATE_DONE, STATE_FAILED)
+
+
+@dataclass
+class progressSnapshot:
+    key: str
+    group: str
+    name: str
+    state: str
+    doneBytes: int
+    totalBytes: int
+    # 字节/秒
+    speed: float
+    avgSpeed: float
+    # 秒，未知时为 -1
+    eta: float
+    elapsed: float
+    # 每条连接的瞬时速度
+    connections: dict[str, float] = field(default_factory=dict)
+    # 各阶段（接口、CDN 传输、混流）累计耗时
+    phases: dict[str, float] = field(default_factory=dict)
+
+
+class progressTracker:
+    def __init__(self, key: str, group: str, name: str, queued: bool = False):
+        self.key = key
+        self.group = group
+        self.name = name
+        self.state = STATE_QUEUED if queued else STATE_RUNNING
+
+        self._start = time.monotonic()
+        self._total = 0
+        self._done = 0
+        self._resumed = 0
+        self._speed = 0.0
+
+        self._lastTick = self._start
+        self._lastDone = 0
+        self._connBytes: dict[str, int] = {}
+        self._lastConnBytes: dict[str, int] = {}
+        self._phases: dict[str, float] = {}
+        self._dirty = True
+
+    def restart(self):
+        # 重试时各个流会重新上报总量和续传量，先清零避免重复累计
+        self._total = 0
+        self._done = 0
+        self._resumed = 0
+        self._lastDone = 0
+        self._connBytes.clear()
+        self._lastConnBytes.clear()
+        self._dirty = True
+
+    def begin(self):
+        # 排队结束开始传输，平均速度和耗时从这里算起
+        if self.state != STATE_QUEUED:
+            return
+
+        self.state = STATE_RUNNING
+        self._start = self._lastTick = time.monotonic()
+        self._dirty = True
+
+    def requeue(self):
+        self.state = STATE_QUEUED
+        self._dirty = True
+
+    def addTotal(self, nbytes: int):
+        self._total += nbytes
+        self._dirty = True
+
+    def addResumed(self, nbytes: int):
+        # 断点续传前就已经有的数据，算进度但不算速度
+        self._done += nbytes
+        self._resumed += nbytes
+        self._lastDone += nbytes
+        self._dirty = True
+
+    def addBytes(self, nbytes: int, conn: str = "0"):
+        self._done += nbytes
+        self._connBytes[conn] = self._connBytes.get(conn, 0) + nbytes
+        self._dirty = True
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        begin = time.monotonic()
+
+        try:
+            yield
+        finally:
+            self._phases[name] = self._phases.get(name, 0.0) + time.monotonic() - begin
+            self._dirty = True
+
+    def finish(self, state: str = STATE_DONE):
+        self.state = state
+        self._dirty = True
+
+    def snapshot(self, advance: bool = True) -> progressSnapshot:
+        # advance 为 False 时只读不推进测速窗口，供外部随时拉取而不打乱定时推送
+        now = time.monotonic()
+        interval = max(now - self._lastTick, 1e-6)
+
+        instant = (self._done - self._lastDone) / interval
+        speed = self._speed + SPEED_SMOOTHING * (instant - self._speed)
+
+        connections = {
+            conn: (nbytes - self._lastConnBytes.get(conn, 0)) / interval
+            for conn, nbytes in self._connBytes.items()
+        }
+
+        if advance:
+            self._speed = speed
+            self._lastTick = now
+            self._lastDone = self._done
+            self._lastConnBytes = dict(self._connBytes)
+            self._dirty = False
+
+        elapsed = now - self._start
+        remaining = self._total - self._done
+        eta = remaining / speed if speed > 0 and remaining > 0 else -1
+
+        return progressSnapshot(
+            key=self.key,
+            group=self.group,
+            name=self.name,
+            state=self.state,
+            doneBytes=self._done,
+            totalBytes=self._total,
+            speed=speed,
+            avgSpeed=(self._done - self._resumed) / max(elapsed, 1e-6),
+            eta=eta,
+            elapsed=elapsed,
+            connections=connections,
+            phases=dict(self._phases),
+        )
+
+
+class progressHub:
+    """
+    汇总所有下载任务的进度，按固定频率把有变化的任务合并成一批推给订阅者，
+    也可以随时调用 snapshots() 主动拉取
+    """
+
+    def __init__(self, interval: float = REPORT_INTERVAL):
+        self._interval = interval
+        self._trackers: dict[str, progressTracker] = {}
+        self._listeners: list[Callable[[list[progressSnapshot]], None]] = []
+        self._loop: Optional[asyncio.Task] = None
+
+    def track(
+        self, key: str, group: str, name: str, queued: bool = False
+    ) -> progressTracker:
+        tracker = progressTracker(key, group, name, queued)
+        self._trackers[key] = tracker
+
+        if self._loop is None or self._loop.done():
+            self._loop = asyncio.ensure_future(self._report())
+
+        return tracker
+
+    def subscribe(self, listener: Callable[[list[progressSnapshot]], None]):
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[[list[progressSnapshot]], None]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def snapshots(self) -> list[progressSnapshot]:
+        return [tracker.snapshot(advance=False) for tracker in self._trackers.values()]
+
+    async def _report(self):
+        while self._trackers:
+            await asyncio.sleep(self._interval)
+
+            batch = [
+                tracker.snapshot()
+                for tracker in self._trackers.values()
+                if tracker._dirty or tracker.state == STATE_RUNNING
+            ]
+
+            # 结束的任务推送完最后一次状态后就不再跟踪，排队中的只在状态变化时推送
+            for snap in batch:
+                if snap.state in FINAL_STATES:
+                    self._trackers.pop(snap.key, None)
+
+            if not batch:
+                continue
+
+            for listener in list(self._listeners):
+                try:
+                    listener(batch)
+                except Exception as e:
+                    print(f"进度回调出错：{e}")
+
+
+# 当前协程所属的进度，下载代码不需要层层传参就能上报
+_currentTracker: contextvars.ContextVar[Optional[progressTracker]] = (
+    contextvars.ContextVar("currentProgressTracker", default=None)
+)
+
+
+def current() -> progressTracker:
+    # 不在任何任务里时返回一个不登记的临时对象，调用方不用判空
+    return _currentTracker.get() or progressTracker("", "", "")
+
+
+def bind(tracker: progressTracker):
+    _currentTracker.set(tracker)
+
+
+progHub = progressHub()
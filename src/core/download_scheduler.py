@@ -0,0 +1,262 @@
+import asyncio, contextlib, contextvars, heapq, itertools, urllib.parse
+from typing import Any, Awaitable, Callable, Optional
+
+from utils import config_loader as conf
+
+# 数字越小越先调度
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+# 当前协程所属的任务，下载代码借此在每个数据块之间响应暂停
+_currentJob: contextvars.ContextVar[Optional["downloadJob"]] = contextvars.ContextVar(
+    "currentDownloadJob", default=None
+)
+# 当前协程占着的主机名额，暂停时在 checkpoint 里让出来
+_heldSlots: contextvars.ContextVar[tuple["hostLease", ...]] = contextvars.ContextVar(
+    "heldHostSlots", default=()
+)
+
+
+class hostLease:
+    def __init__(self, host: str):
+        self.host = host
+        # 名额现在是否算在这个主机的连接数里
+        self.held = False
+
+
+class downloadJob:
+    def __init__(
+        self,
+        jobId: int,
+        name: str,
+        priority: int,
+        coroFactory: Callable[[], Awaitable[Any]],
+    ):
+        self.jobId = jobId
+        self.name = name
+        self.priority = priority
+        self.state = JOB_QUEUED
+
+        self._coroFactory = coroFactory
+        self._task: Optional[asyncio.Task] = None
+        self._future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._resumed = asyncio.Event()
+        self._resumed.set()
+
+    def isPaused(self) -> bool:
+        return not self._resumed.is_set()
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    def cancel(self):
+        if self._future.done():
+            return
+
+        if self._task:
+            self._task.cancel()
+        else:
+            self.state = JOB_CANCELLED
+            self._future.cancel()
+
+    async def wait(self) -> Any:
+        return await asyncio.shield(self._future)
+
+    def done(self) -> bool:
+        return self._future.done()
+
+
+class downloadScheduler:
+    """
+    全局下载调度器：所有下载入口都往这里提交任务，
+    由它统一控制同时运行的任务数、同一主机的并发连接数以及优先级
+    """
+
+    def __init__(self):
+        self._maxJobs = conf.userConf.getDownloadMaxJobs()
+        self._maxPerHost = conf.userConf.getDownloadMaxPerHost()
+
+        self._queue: list[tuple[int, int, downloadJob]] = []
+        self._seq = itertools.count()
+        self._running: set[downloadJob] = set()
+        self._hostActive: dict[str, int] = {}
+        self._paused = False
+        # 全局暂停时下载循环在这里等，resume() 置位
+        self._unpaused = asyncio.Event()
+        self._unpaused.set()
+        # 发出去的通知任务；事件循环只弱引用任务，不留着的话可能还没运行就被回收
+        self._notifies: set[asyncio.Task] = set()
+
+        self._wakeup: Optional[asyncio.Condition] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def _ensureDispatcher(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Condition()
+
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def _notify(self):
+        async with self._wakeup:
+            self._wakeup.notify_all()
+
+    def _poke(self):
+        if self._wakeup is not None:
+            task = asyncio.ensure_future(self._notify())
+            self._notifies.add(task)
+            task.add_done_callback(self._notifies.discard)
+
+    def submit(
+        self,
+        coroFactory: Callable[[], Awaitable[Any]],
+        name: str = "",
+        priority: int = PRIORITY_NORMAL,
+    ) -> downloadJob:
+        self._ensureDispatcher()
+
+        job = downloadJob(next(self._seq), name, priority, coroFactory)
+        heapq.heappush(self._queue, (priority, job.jobId, job))
+
+        self._poke()
+
+        return job
+
+    def setLimits(self, maxJobs: int, maxPerHost: int):
+        self._maxJobs = max(1, maxJobs)
+        self._maxPerHost = max(1, maxPerHost)
+
+        self._poke()
+
+    def pause(self):
+        self._paused = True
+        self._unpaused.clear()
+
+    def resume(self):
+        self._paused = False
+        self._unpaused.set()
+
+        self._poke()
+
+    def isPaused(self) -> bool:
+        return self._paused
+
+    def cancelAll(self):
+        for _, _, job in list(self._queue):
+            job.cancel()
+
+        for job in list(self._running):
+            job.cancel()
+
+    def jobs(self) -> list[downloadJob]:
+        queued = [job for _, _, job in sorted(self._queue) if not job.done()]
+
+        return sorted(self._running, key=lambda job: job.jobId) + queued
+
+    def _canStart(self) -> bool:
+        return (
+            not self._paused
+            and bool(self._queue)
+            and len(self._running) < self._maxJobs
+        )
+
+    async def _dispatch(self):
+        while True:
+            async with self._wakeup:
+                await self._wakeup.wait_for(self._canStart)
+
+            _, _, job = heapq.heappop(self._queue)
+
+            # 排队期间被取消的任务直接丢弃
+            if job.done():
+                continue
+
+            self._running.add(job)
+            job.state = JOB_RUNNING
+            job._task = asyncio.create_task(self._runJob(job))
+
+    async def _runJob(self, job: downloadJob):
+        _currentJob.set(job)
+
+        try:
+            result = await job._coroFactory()
+        except asyncio.CancelledError:
+            job.state = JOB_CANCELLED
+            job._future.cancel()
+        except Exception as e:
+            job.state = JOB_FAILED
+            job._future.set_exception(e)
+        else:
+            job.state = JOB_DONE
+            job._future.set_result(result)
+        finally:
+            self._running.discard(job)
+            self._poke()
+
+    async def checkpoint(self):
+        # 下载循环在数据块之间调用，全局暂停或所属任务暂停时在这里等待
+        job = _currentJob.get()
+        if not self._paused and (job is None or not job.isPaused()):
+            return
+
+        # 暂停期间把主机名额让出来，同一 CDN 上没暂停的任务不会被饿住；恢复后再排队拿回来
+        leases = [lease for lease in _heldSlots.get() if lease.held]
+        for lease in leases:
+            self._releaseHost(lease)
+
+        while self._paused:
+            await self._unpaused.wait()
+
+        if job is not None:
+            await job._resumed.wait()
+
+        for lease in leases:
+            await self._acquireHost(lease)
+
+    async def _acquireHost(self, lease: hostLease):
+        async with self._wakeup:
+            await self._wakeup.wait_for(
+                lambda: self._hostActive.get(lease.host, 0) < self._maxPerHost
+            )
+            self._hostActive[lease.host] = self._hostActive.get(lease.host, 0) + 1
+            lease.held = True
+
+    def _releaseHost(self, lease: hostLease):
+        lease.held = False
+        self._hostActive[lease.host] -= 1
+        self._poke()
+
+    @contextlib.asynccontextmanager
+    async def hostSlot(self, url: str):
+        # 同一主机的并发连接数上限，避免把单个 CDN 节点打到限流
+        self._ensureDispatcher()
+
+        lease = hostLease(urllib.parse.urlparse(url).hostname or "")
+        await self._acquireHost(lease)
+        token = _heldSlots.set(_heldSlots.get() + (lease,))
+
+        try:
+            yield
+        finally:
+            _heldSlots.reset(token)
+            # 暂停时被取消的话名额已经让出去了，不再重复归还
+            if lease.held:
+                self._releaseHost(lease)
+
+
+async def runAll(jobs: list[downloadJob]) -> list[Any]:
+    # 等待一组任务全部结束，返回结果或异常，不因单个失败而中断其他任务
+    return await asyncio.gather(*(job.wait() for job in jobs), return_exceptions=True)
+
+
+downScheduler = downloadScheduler()
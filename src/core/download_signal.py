@@ -0,0 +1,12 @@
+from PySide6.QtCore import QObject, Signal
+from core import download_progress
+
+
+class downloadSignals(QObject):
+    # list[download_progress.progressSnapshot]，已按固定频率合并过
+    progressUpdated = Signal(list)
+
+
+dlEmitter = downloadSignals()
+
+download_progress.progHub.subscribe(dlEmitter.progressUpdated.emit)
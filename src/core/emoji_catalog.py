@@ -0,0 +1,149 @@
+import asyncio, gzip, hashlib, json, os, time
+from typing import Callable, Optional
+from bilibili_api import emoji, Credential
+
+from utils import config_loader as conf
+
+# 表情包目录在本地的有效期（秒），过期后先照常用旧的，同时在后台刷新
+CATALOG_TTL = 24 * 3600
+# 后台刷新失败后隔这么久（秒）再试，不在每次搜索时都去撞
+REFRESH_RETRY = 600
+# 每个表情包只留搜索和展示用得到的字段，整个目录压缩后只有几百 KB
+PACKAGE_FIELDS = ("id", "text", "url", "type")
+
+
+def compactPackage(pkg: dict) -> dict:
+    entry = {name: pkg[name] for name in PACKAGE_FIELDS if name in pkg}
+    # 包里每个表情的名字，按表情名搜包时用
+    entry["emotes"] = [emote.get("text", "") for emote in pkg.get("emote") or []]
+
+    return entry
+
+
+def _digest(packages: list[dict]) -> str:
+    return hashlib.sha256(
+        json.dumps(packages, ensure_ascii=False, sort_keys=True).encode()
+    ).hexdigest()
+
+
+class emojiCatalog:
+    """
+    全部表情包的目录：压缩后存在 cache 里，第一次用到时才读进内存。
+    超过有效期时先返回旧目录再在后台刷新，刷新结果没变只更新时间戳不重写文件，
+    有变化时把新增 / 删除的包 id 通知给订阅者
+    """
+
+    def __init__(self):
+        self._path = conf.userConf.getProjectPath() / "cache" / "emoji_catalog.json.gz"
+        self._packages: Optional[list[dict]] = None
+        self._digest = ""
+        # 上次从接口确认目录的时间，就是缓存文件的修改时间
+        self._fetchedAt = 0.0
+        self._retryAt = 0.0
+
+        self._refreshTask: Optional[asyncio.Task] = None
+        self._listeners: list[Callable[[set[int], set[int]], None]] = []
+
+    def subscribe(self, listener: Callable[[set[int], set[int]], None]):
+        # listener(新增的包 id, 删除的包 id)，内容有变化的包两边都会出现
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[[set[int], set[int]], None]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def stale(self) -> bool:
+        return time.time() - self._fetchedAt > CATALOG_TTL
+
+    def _load(self):
+        try:
+            with gzip.open(self._path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+
+            fetchedAt = os.stat(self._path).st_mtime
+        except (OSError, ValueError):
+            return
+
+        self._packages = data.get("packages", [])
+        self._digest = data.get("digest", "")
+        self._fetchedAt = fetchedAt
+
+    def _dump(self, packages: list[dict], digest: str):
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+
+        tmpPath = self._path.with_suffix(".tmp")
+        with gzip.open(tmpPath, "wt", encoding="utf-8", compresslevel=6) as f:
+            json.dump(
+                {"digest": digest, "packages": packages},
+                f,
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+
+        os.replace(tmpPath, self._path)
+
+    async def packages(self) -> list[dict]:
+        if self._packages is None:
+            await asyncio.to_thread(self._load)
+
+        if self._packages is None:
+            # 本地没有目录，只能等这一次
+            await self.refresh()
+        elif self.stale() and time.time() >= self._retryAt:
+            self.refreshInBackground()
+
+        return self._packages or []
+
+    def refreshInBackground(self):
+        if self._refreshTask is None or self._refreshTask.done():
+            self._refreshTask = asyncio.ensure_future(self._fetch())
+            self._refreshTask.add_done_callback(self._reportRefresh)
+
+    def _reportRefresh(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            self._retryAt = time.time() + REFRESH_RETRY
+            print(f"表情包目录刷新失败，继续使用本地目录：{task.exception()}")
+
+    async def refresh(self) -> bool:
+        # 返回目录是否有变化；后台已经在刷新时直接等它
+        if self._refreshTask is None or self._refreshTask.done():
+            self._refreshTask = asyncio.ensure_future(self._fetch())
+
+        return await asyncio.shield(self._refreshTask)
+
+    async def _fetch(self) -> bool:
+        credential = Credential(
+            sessdata=conf.userConf.getSessData(),
+            bili_jct=conf.userConf.getBiliJct(),
+        )
+        data = await emoji.get_all_emoji(credential=credential)
+
+        packages = [compactPackage(pkg) for pkg in data.get("all_packages") or []]
+        digest = _digest(packages)
+
+        if digest == self._digest and self._path.exists():
+            # 没有变化，只刷新有效期
+            os.utime(self._path)
+            self._fetchedAt = time.time()
+
+            return False
+
+        old = {pkg["id"]: pkg for pkg in self._packages or []}
+        new = {pkg["id"]: pkg for pkg in packages}
+        changed = {pkgId for pkgId in old.keys() & new.keys() if old[pkgId] != new[pkgId]}
+
+        await asyncio.to_thread(self._dump, packages, digest)
+        self._packages, self._digest = packages, digest
+        self._fetchedAt = time.time()
+
+        added, removed = (new.keys() - old.keys()) | changed, (old.keys() - new.keys()) | changed
+        for listener in list(self._listeners):
+            try:
+                listener(added, removed)
+            except Exception as e:
+                print(f"表情包目录回调出错：{e}")
+
+        return True
+
+
+emoCatalog = emojiCatalog()
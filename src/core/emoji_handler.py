@@ -1,54 +1,212 @@
 import aiohttp
 import asyncio
+import os
 import pathlib
 import urllib.parse
-from bilibili_api import emoji, Credential
-import aiofiles
+from dataclasses import dataclass
+from bilibili_api import emoji
 
-from utils import config_loader
+from core.download_scheduler import downScheduler
+from core.rate_limiter import bwLimiter, CLASS_IMAGE
+from core.content_store import objStore, emojiKey, hashingWriter
+from core.emoji_catalog import emoCatalog
+from core import emoji_search
 
+# 一个表情包同时在下载的图片数，再多就容易被 b站 412 限流
+EMOJI_WORKERS = 6
+# 每次从响应里读取的块大小，大的动图也不会整个压在内存里
+CHUNK_SIZE = 64 * 1024
+# 单张图片的重试次数与退避基数、上限（秒）
+EMOJI_RETRIES = 4
+EMOJI_RETRY_BACKOFF = 1.0
+EMOJI_RETRY_BACKOFF_MAX = 20.0
+# 这些状态码是限流或服务端临时出错，值得重试；其余的（404 等）直接算失败
+RETRY_STATUS = {412, 429, 500, 502, 503, 504}
 
-async def download_one(
-    session: aiohttp.ClientSession, url: str, filename: str, saveFolder: pathlib.Path
-) -> bool:
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36 Edg/116.0.1938.54",
-        "Referer": url,
-    }
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36 Edg/116.0.1938.54",
+}
 
+
+@dataclass
+class emojiResult:
+    url: str
+    filename: str
+    ok: bool = False
+    # 从本地仓库链接过来，没有走网络
+    cached: bool = False
+    size: int = 0
+    attempts: int = 0
+    # 最后一次失败的状态码，网络错误时为 0
+    status: int = 0
+    error: str = ""
+
+
+class retryableError(Exception):
+    def __init__(self, message: str, status: int = 0, delay: float = 0):
+        super().__init__(message)
+        self.status = status
+        # 服务器给了 Retry-After 时按它等
+        self.delay = delay
+
+
+def _retryAfter(response: aiohttp.ClientResponse) -> float:
     try:
-        async with session.get(url, headers=headers) as response:
-            if response.status == 200:
-                # 使用aiofiles异步写入文件
-                async with aiofiles.open(saveFolder / filename, "wb") as f:
-                    await f.write(await response.read())
-
-                print(f"✅ 图片已保存：{filename}")
-                return True
-            else:
-                print(f"⚠️ 下载失败，状态码：{response.status} - {url}")
-                return False
-    except Exception as e:
-        print(f"❌ 下载错误：{e} - {url}")
-        return False
+        return float(response.headers.get("Retry-After", 0))
+    except ValueError:
+        return 0
+
+
+class packDownloader:
+    """
+    一个表情包的下载：固定数量的协程从队列里领图片，响应体按块写进 .part 再改名。
+    限流或服务端出错时退避重试；遇到 412 时所有协程一起暂停，而不是各自继续撞限流
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, saveFolder: pathlib.Path):
+        self._session = session
+        self._saveFolder = saveFolder
+        # 全体暂停到这个时间点（事件循环时间）
+        self._cooldownUntil = 0.0
+
+    async def run(self, url_list: list[tuple[str, str]]) -> list[emojiResult]:
+        results = [emojiResult(url, filename) for url, filename in url_list]
+
+        queue: asyncio.Queue[emojiResult] = asyncio.Queue()
+        for result in results:
+            queue.put_nowait(result)
+
+        workers = [
+            asyncio.create_task(self._worker(queue))
+            for _ in range(min(EMOJI_WORKERS, len(results)))
+        ]
+
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        return results
+
+    async def _worker(self, queue: asyncio.Queue[emojiResult]):
+        while not queue.empty():
+            await self.download_one(queue.get_nowait())
+
+    async def _waitCooldown(self):
+        loop = asyncio.get_running_loop()
+        while (delay := self._cooldownUntil - loop.time()) > 0:
+            await asyncio.sleep(delay)
+
+    async def download_one(self, result: emojiResult) -> emojiResult:
+        # 以前下过的表情直接从本地仓库链接过来
+        if await objStore.materialize(emojiKey(result.url), self._saveFolder / result.filename):
+            result.ok = result.cached = True
+            print(f"✅ 图片已存在于本地仓库：{result.filename}")
+
+            return result
+
+        for attempt in range(EMOJI_RETRIES):
+            await self._waitCooldown()
+            await downScheduler.checkpoint()
+            result.attempts = attempt + 1
+
+            try:
+                result.size = await self._fetch(result)
+            except retryableError as e:
+                result.status, result.error = e.status, str(e)
+
+                delay = max(
+                    e.delay,
+                    min(EMOJI_RETRY_BACKOFF * 2**attempt, EMOJI_RETRY_BACKOFF_MAX),
+                )
+                if e.status == 412:
+                    loop = asyncio.get_running_loop()
+                    self._cooldownUntil = max(self._cooldownUntil, loop.time() + delay)
+
+                if attempt < EMOJI_RETRIES - 1:
+                    await asyncio.sleep(delay)
+
+                continue
+            except Exception as e:
+                # 404 之类的永久错误、磁盘错误等，重试也没用；只算这一张失败，不影响整包
+                result.status = getattr(e, "status", 0)
+                result.error = str(e)
+
+                break
+
+            result.ok = True
+            result.error = ""
+            print(f"✅ 图片已保存：{result.filename}")
+
+            return result
+
+        print(f"❌ 下载失败：{result.error} - {result.url}")
+
+        return result
+
+    async def _fetch(self, result: emojiResult) -> int:
+        path = self._saveFolder / result.filename
+        partPath = path.with_name(path.name + ".part")
+
+        try:
+            async with (
+                downScheduler.hostSlot(result.url),
+                self._session.get(result.url, headers={**HEADERS, "Referer": result.url}) as response,
+            ):
+                if response.status in RETRY_STATUS:
+                    raise retryableError(
+                        f"状态码 {response.status}", response.status, _retryAfter(response)
+                    )
+
+                response.raise_for_status()
+
+                with open(partPath, "wb") as file:
+                    writer = hashingWriter(file)
+
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        await bwLimiter.acquire(CLASS_IMAGE, len(chunk))
+                        writer.write(chunk)
+        except aiohttp.ClientResponseError:
+            # raise_for_status 抛出的 404 之类，由调用方记为永久失败
+            partPath.unlink(missing_ok=True)
+
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # 连接被重置、DNS 解析失败、读超时等都当作暂时的
+            partPath.unlink(missing_ok=True)
+
+            raise retryableError(f"网络错误：{e!r}") from e
+        except BaseException:
+            partPath.unlink(missing_ok=True)
+
+            raise
+
+        os.replace(partPath, path)
+        await objStore.ingest(emojiKey(result.url), path, writer.hexdigest(), writer.size)
+
+        return writer.size
 
 
 async def download_all_images(
     url_list: list[tuple[str, str]], saveFolder: pathlib.Path
-) -> None:
+) -> list[emojiResult]:
     saveFolder.mkdir(parents=True, exist_ok=True)
 
-    async with aiohttp.ClientSession() as session:
-        tasks = [
-            download_one(session, url, filename, saveFolder)
-            for url, filename in url_list
-        ]
-
-        await asyncio.gather(*tasks)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        try:
+            return await packDownloader(session, saveFolder).run(url_list)
+        finally:
+            # 整包下载完（或中途取消）再统一写一次索引
+            objStore.flush()
 
 
-async def downloadPkg(pkgId: int, savePath: pathlib.Path):
+async def downloadPkg(pkgId: int, savePath: pathlib.Path) -> list[emojiResult]:
     url_list = []
+    usedNames: set[str] = set()
 
     detail = await emoji.get_emoji_detail(pkgId)
 
@@ -67,36 +225,43 @@ async def downloadPkg(pkgId: int, savePath: pathlib.Path):
             c for c in emj["text"] if c.isalnum() or c in (" ", "-", "_")
         ).rstrip()
         filename = f"{safe_text}{suffix}"
+        # 同名的表情并发写同一个文件会互相覆盖，加序号区分
+        index = 1
+        while filename.lower() in usedNames:
+            index += 1
+            filename = f"{safe_text}_{index}{suffix}"
+        usedNames.add(filename.lower())
 
         url_list.append((clean_url, filename))
 
     print(f"📥 共找到 {len(url_list)} 个表情")
 
-    # 批量下载所有图片
-    if url_list:
-        await download_all_images(url_list, savePath)
-        print("🎉 所有下载任务完成！")
-    else:
+    if not url_list:
         print("⚠️ 没有找到可下载的表情链接")
 
+        return []
 
-async def getAllEmojiPackages():
-    credi = Credential(
-        sessdata=config_loader.userConf.getSessData(),
-        bili_jct=config_loader.userConf.getBiliJct(),
-    )
+    # 批量下载所有图片，整包作为一个任务排进全局下载队列
+    results = await downScheduler.submit(
+        lambda: download_all_images(url_list, savePath), f"表情包 {pkgId}"
+    ).wait()
+
+    failed = [result for result in results if not result.ok]
+    if failed:
+        print(f"⚠️ {len(failed)} / {len(results)} 个表情下载失败")
+    else:
+        print("🎉 所有下载任务完成！")
 
-    return await emoji.get_all_emoji(credential=credi)
+    return results
 
 
-async def searchMatchEmoji(emojiPackages: dict, emojiName: str):
-    def search():
-        matchList = []
+async def getAllEmojiPackages():
+    # 本地目录第一次用到时才读进来，过期了在后台刷新，不用每次都拉全量
+    return {"all_packages": await emoCatalog.packages()}
 
-        for pkg in emojiPackages["all_packages"]:
-            if emojiName.lower() in pkg["text"].lower():
-                matchList.append(pkg)
 
-        return matchList
+async def searchMatchEmoji(emojiPackages: dict, emojiName: str, limit: int = 0):
+    # 索引跟着目录走，目录没刷新时不会重建
+    index = await emoji_search.indexFor(emojiPackages["all_packages"])
 
-    return await asyncio.to_thread(search)
+    return index.search(emojiName, limit)
@@ -0,0 +1,199 @@
+import asyncio, unicodedata
+from collections import Counter
+from typing import Optional
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:
+    # pypinyin 是可选依赖，没装时只按原文搜索
+    lazy_pinyin = None
+
+# 名字的几种可搜索形式，数字越小排名越靠前
+FORM_NAME = 0
+FORM_PINYIN = 1
+FORM_INITIALS = 2
+# 包里某个表情的名字，比如搜"doge"能找到带 [tv_doge] 的包
+FORM_EMOTE = 3
+
+# 命中位置的档次：完全相同 / 前缀 / 包含
+MATCH_EXACT = 0
+MATCH_PREFIX = 1
+MATCH_INSIDE = 2
+
+# 精确命中少于这么多条时补上模糊匹配的结果
+FUZZY_MIN_HITS = 20
+# 查询里至少有这个比例的二元组出现在名字里，才算模糊命中
+FUZZY_THRESHOLD = 0.5
+
+
+def normalize(text: str) -> str:
+    # 全角转半角、忽略大小写和空白
+    return "".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+def bigrams(text: str) -> set[str]:
+    return {text[i : i + 2] for i in range(len(text) - 1)}
+
+
+def _hasHan(text: str) -> bool:
+    return any("一" <= ch <= "鿿" for ch in text)
+
+
+def searchForms(name: str, emotes: list[str] = ()) -> list[tuple[int, str]]:
+    forms = [(FORM_NAME, normalize(name))]
+
+    if lazy_pinyin is not None and _hasHan(name):
+        forms.append((FORM_PINYIN, normalize("".join(lazy_pinyin(name)))))
+        forms.append(
+            (FORM_INITIALS, normalize("".join(lazy_pinyin(name, style=Style.FIRST_LETTER))))
+        )
+
+    # 表情名带着方括号，比如 "[tv_doge]"
+    forms += [(FORM_EMOTE, normalize(emote.strip("[]"))) for emote in emotes]
+
+    return [(kind, text) for kind, text in forms if text]
+
+
+class emojiSearchIndex:
+    """
+    表情包名字的倒排索引：原名、拼音全拼、拼音首字母、包里各个表情的名字都按单字和二元组建索引。
+    查询时先用二元组的倒排表求交集得到候选，再核对子串并按命中档次排序；
+    精确结果不够时按二元组覆盖率补上模糊结果，打错一两个字也能搜到。
+    连续输入时新查询是上一次的延伸，直接在上一次的结果里过滤
+    """
+
+    def __init__(self, packages: list[dict]):
+        self.source = packages
+        self._packages = packages
+        self._forms: list[list[tuple[int, str]]] = []
+        # 单字 / 二元组 -> 包的下标（升序）
+        self._chars: dict[str, list[int]] = {}
+        self._grams: dict[str, list[int]] = {}
+
+        for index, pkg in enumerate(packages):
+            forms = searchForms(pkg.get("text", ""), pkg.get("emotes") or [])
+            self._forms.append(forms)
+
+            chars, grams = set(), set()
+            for _, text in forms:
+                chars.update(text)
+                grams |= bigrams(text)
+
+            for ch in chars:
+                self._chars.setdefault(ch, []).append(index)
+            for gram in grams:
+                self._grams.setdefault(gram, []).append(index)
+
+        # 上一次查询和它的精确命中，供连续输入时复用
+        self._lastQuery = ""
+        self._lastHits: list[int] = []
+
+    def _candidates(self, query: str) -> list[int]:
+        if self._lastQuery and query.startswith(self._lastQuery):
+            # 包含新查询的名字一定也包含上一次的查询
+            return self._lastHits
+
+        if len(query) == 1:
+            return self._chars.get(query, [])
+
+        postings = sorted(
+            (self._grams.get(gram, []) for gram in bigrams(query)), key=len
+        )
+        if not postings[0]:
+            return []
+
+        result = set(postings[0])
+        for posting in postings[1:]:
+            result.intersection_update(posting)
+            if not result:
+                break
+
+        return sorted(result)
+
+    def _rank(self, index: int, query: str) -> Optional[tuple]:
+        # 取这个包所有形式里最好的命中，没命中返回 None
+        best = None
+        for kind, text in self._forms[index]:
+            pos = text.find(query)
+            if pos < 0:
+                continue
+
+            if text == query:
+                match = MATCH_EXACT
+            elif pos == 0:
+                match = MATCH_PREFIX
+            else:
+                match = MATCH_INSIDE
+
+            key = (kind > FORM_NAME, match, kind, pos, len(text), index)
+            if best is None or key < best:
+                best = key
+
+        return best
+
+    def _fuzzy(self, query: str, exclude: set[int], limit: int) -> list[int]:
+        grams = bigrams(query)
+        if not grams:
+            return []
+
+        # 每个包覆盖了查询里多少个二元组
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._grams.get(gram, []))
+
+        need = len(grams) * FUZZY_THRESHOLD
+        scored = [
+            (-count, len(self._forms[index][0][1]), index)
+            for index, count in shared.items()
+            if count >= need and index not in exclude
+        ]
+        scored.sort()
+
+        return [index for _, _, index in scored[:limit]]
+
+    def search(self, query: str, limit: int = 0) -> list[dict]:
+        query = normalize(query)
+        if not query:
+            return []
+
+        ranked = []
+        hits = []
+        for index in self._candidates(query):
+            key = self._rank(index, query)
+            if key is not None:
+                ranked.append(key)
+                hits.append(index)
+
+        self._lastQuery, self._lastHits = query, hits
+
+        ranked.sort()
+        order = [key[-1] for key in ranked]
+
+        if len(order) < FUZZY_MIN_HITS:
+            order += self._fuzzy(query, set(hits), FUZZY_MIN_HITS - len(order))
+
+        if limit:
+            order = order[:limit]
+
+        return [self._packages[index] for index in order]
+
+
+_index: Optional[emojiSearchIndex] = None
+_building: Optional[asyncio.Lock] = None
+
+
+async def indexFor(packages: list[dict]) -> emojiSearchIndex:
+    # 目录对象没变就复用索引；目录刷新后换了新列表才在线程里重建
+    global _index, _building
+
+    if _index is not None and _index.source is packages:
+        return _index
+
+    if _building is None:
+        _building = asyncio.Lock()
+
+    async with _building:
+        if _index is None or _index.source is not packages:
+            _index = await asyncio.to_thread(emojiSearchIndex, packages)
+
+    return _index
@@ -0,0 +1,183 @@
+import asyncio, collections, hashlib, os, pathlib
+from typing import Optional
+import aiohttp
+from PySide6.QtCore import Qt
+from PySide6.QtGui import QImage
+
+from utils import config_loader as conf
+from core.download_scheduler import downScheduler
+from core.single_flight import singleFlight
+from core.rate_limiter import bwLimiter, CLASS_IMAGE
+
+# 同时在下载的图片数
+IMAGE_FETCHES = 6
+# 内存里解码好的图片最多占用的字节数
+MEMORY_MAX_BYTES = 64 * 1024 * 1024
+# 磁盘缓存的上限，超出时按最近使用时间清理
+DISK_MAX_BYTES = 256 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36 Edg/116.0.1938.54",
+}
+
+
+def _decode(data: bytes, size: Optional[tuple[int, int]]) -> QImage:
+    # 在线程里运行：QImage 不依赖 GUI 线程，解码和缩放都不会卡界面
+    image = QImage.fromData(data)
+    if not image.isNull() and size is not None:
+        image = image.scaled(*size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+    return image
+
+
+def _trimDisk(root: pathlib.Path, limit: int):
+    files = []
+    for path in root.rglob("*"):
+        if path.is_file():
+            stat = path.stat()
+            files.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= limit:
+            break
+
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+class imagePipeline:
+    """
+    封面、表情缩略图等小图片的统一加载：共用一个会话、限制并发，
+    原始数据按地址存进磁盘缓存，解码缩放在线程里做成 QImage，
+    解码结果放进按字节数限制的内存 LRU，同一张图再次显示不走网络也不重新解码
+    """
+
+    def __init__(self):
+        self._root = conf.userConf.getProjectPath() / "cache" / "images"
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._limit: Optional[asyncio.Semaphore] = None
+
+        # (地址, 尺寸) -> 解码好的图片
+        self._memory: collections.OrderedDict[tuple, QImage] = collections.OrderedDict()
+        self._memoryBytes = 0
+        # 同一个地址 / 同一张图的并发请求共享一次下载和解码
+        self._flights = singleFlight()
+        self._trimTask: Optional[asyncio.Task] = None
+
+    def _diskPath(self, url: str) -> pathlib.Path:
+        digest = hashlib.sha256(url.encode()).hexdigest()
+
+        return self._root / digest[:2] / digest
+
+    def cached(self, url: str, size: Optional[tuple[int, int]] = None) -> Optional[QImage]:
+        # 只查内存，给绘制代码同步调用
+        key = (url, size)
+        image = self._memory.get(key)
+        if image is not None:
+            self._memory.move_to_end(key)
+
+        return image
+
+    def _remember(self, key: tuple, image: QImage):
+        self._memory[key] = image
+        self._memoryBytes += image.sizeInBytes()
+
+        while self._memoryBytes > MEMORY_MAX_BYTES and len(self._memory) > 1:
+            _, old = self._memory.popitem(last=False)
+            self._memoryBytes -= old.sizeInBytes()
+
+    async def data(self, url: str) -> bytes:
+        # 原始图片数据，先查磁盘缓存
+        return await self._flights.do(("data", url), lambda: self._loadData(url))
+
+    async def _loadData(self, url: str) -> bytes:
+        path = self._diskPath(url)
+
+        try:
+            return await asyncio.to_thread(self._readDisk, path)
+        except OSError:
+            pass
+
+        if self._session is None or self._session.closed:
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30)
+            self._session = aiohttp.ClientSession(headers=HEADERS, timeout=timeout)
+            self._limit = asyncio.Semaphore(IMAGE_FETCHES)
+
+        body = bytearray()
+        async with (
+            self._limit,
+            downScheduler.hostSlot(url),
+            self._session.get(url, headers={"Referer": url}) as response,
+        ):
+            response.raise_for_status()
+
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                await bwLimiter.acquire(CLASS_IMAGE, len(chunk))
+                body += chunk
+
+        data = bytes(body)
+        await asyncio.to_thread(self._writeDisk, path, data)
+
+        # 每次启动后第一次写入时顺便在后台清理一次
+        if self._trimTask is None:
+            self._trimTask = asyncio.ensure_future(
+                asyncio.to_thread(_trimDisk, self._root, DISK_MAX_BYTES)
+            )
+
+        return data
+
+    def _readDisk(self, path: pathlib.Path) -> bytes:
+        data = path.read_bytes()
+        # 修改时间当作最近使用时间，清理时留下常用的
+        os.utime(path)
+
+        return data
+
+    def _writeDisk(self, path: pathlib.Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        tmpPath = path.with_name(path.name + ".tmp")
+        tmpPath.write_bytes(data)
+        os.replace(tmpPath, path)
+
+    async def image(
+        self, url: str, size: Optional[tuple[int, int]] = None
+    ) -> Optional[QImage]:
+        # 按最大宽高等比缩放后的图片；下载或解码失败时返回 None
+        if not url:
+            return None
+
+        image = self.cached(url, size)
+        if image is not None:
+            return image
+
+        try:
+            return await self._flights.do(
+                ("image", url, size), lambda: self._loadImage(url, size)
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            print(f"图片加载失败：{e} - {url}")
+
+            return None
+
+    async def _loadImage(self, url: str, size: Optional[tuple[int, int]]) -> Optional[QImage]:
+        data = await self.data(url)
+        image = await asyncio.to_thread(_decode, data, size)
+        if image.isNull():
+            print(f"图片解码失败：{url}")
+
+            return None
+
+        self._remember((url, size), image)
+
+        return image
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+imgPipe = imagePipeline()
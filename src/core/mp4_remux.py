@@ -0,0 +1,461 @@
+import asyncio, contextlib, os, struct, threading
+from dataclasses import dataclass, field
+from typing import BinaryIO, Iterator, Optional
+
+from core.content_store import hashingWriter
+
+# 能直接搬运的编码，其他的（杜比、无损等）交给 ffmpeg
+SUPPORTED_CODECS = {b"avc1", b"avc3", b"hev1", b"hvc1", b"av01", b"mp4a"}
+# 拷贝 mdat 时每次读写的大小
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# tfhd 的 base-data-offset-present 标志，带它的分片用的是绝对偏移
+TFHD_BASE_DATA_OFFSET = 0x000001
+
+
+class remuxError(Exception):
+    pass
+
+
+class remuxCancelled(Exception):
+    # 调用方已经取消，线程里的混流在下一个检查点停下
+    pass
+
+
+def _checkCancelled(cancelled: Optional[threading.Event]):
+    if cancelled is not None and cancelled.is_set():
+        raise remuxCancelled("混流已取消")
+
+
+def _box(boxType: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), boxType) + payload
+
+
+def _children(data, start: int, end: int) -> Iterator[tuple[bytes, int, int, int]]:
+    # 依次产出 (类型, box 起点, 内容起点, box 终点)
+    pos = start
+    while pos + 8 <= end:
+        size, boxType = struct.unpack_from(">I4s", data, pos)
+        headerSize = 8
+
+        if size == 1:
+            size = struct.unpack_from(">Q", data, pos + 8)[0]
+            headerSize = 16
+        elif size == 0:
+            size = end - pos
+
+        if size < headerSize or pos + size > end:
+            raise remuxError(f"{boxType!r} box 长度异常")
+
+        yield boxType, pos, pos + headerSize, pos + size
+        pos += size
+
+
+def _find(data, start: int, end: int, path: list[bytes]) -> Optional[tuple[int, int]]:
+    # 按路径逐层查找，返回目标 box 的 (内容起点, box 终点)
+    for boxType, _, payloadStart, boxEnd in _children(data, start, end):
+        if boxType != path[0]:
+            continue
+
+        if len(path) == 1:
+            return payloadStart, boxEnd
+
+        return _find(data, payloadStart, boxEnd, path[1:])
+
+    return None
+
+
+def _readHeader(file: BinaryIO) -> Optional[tuple[bytes, int, int]]:
+    head = file.read(8)
+    if not head:
+        return None
+
+    if len(head) < 8:
+        raise remuxError("box 头不完整")
+
+    size, boxType = struct.unpack(">I4s", head)
+    headerSize = 8
+
+    if size == 1:
+        size = struct.unpack(">Q", file.read(8))[0]
+        headerSize = 16
+    elif size == 0:
+        cursor = file.tell()
+        size = file.seek(0, os.SEEK_END) - cursor + headerSize
+        file.seek(cursor)
+
+    if size < headerSize:
+        raise remuxError(f"{boxType!r} box 长度异常")
+
+    return boxType, size, headerSize
+
+
+@dataclass
+class _fragment:
+    moof: bytearray
+    mdatStart: int
+    mdatSize: int
+    decodeTime: float
+
+
+@dataclass
+class _inputTrack:
+    file: BinaryIO
+    ftyp: bytes = b""
+    mvhd: bytes = b""
+    trak: bytearray = field(default_factory=bytearray)
+    trex: bytearray = field(default_factory=bytearray)
+    mehd: bytes = b""
+    extras: list[bytes] = field(default_factory=list)
+    timescale: int = 1
+    codec: bytes = b""
+    fragmentStart: int = 0
+
+
+def _openTrack(file: BinaryIO) -> _inputTrack:
+    track = _inputTrack(file)
+
+    # 只读到 moov 为止，后面的分片在合并时再按需读取
+    while header := _readHeader(file):
+        boxType, size, headerSize = header
+        boxStart = file.tell() - headerSize
+
+        if boxType == b"ftyp":
+            file.seek(boxStart)
+            track.ftyp = file.read(size)
+        elif boxType == b"moov":
+            file.seek(boxStart)
+            _parseMoov(track, file.read(size))
+            track.fragmentStart = boxStart + size
+
+            return track
+        else:
+            file.seek(boxStart + size)
+
+    raise remuxError("没有找到 moov")
+
+
+def _parseMoov(track: _inputTrack, moov: bytes):
+    _, _, payloadStart, moovEnd = next(_children(moov, 0, len(moov)))
+    traks = []
+
+    for boxType, boxStart, innerStart, boxEnd in _children(moov, payloadStart, moovEnd):
+        if boxType == b"mvhd":
+            track.mvhd = moov[boxStart:boxEnd]
+        elif boxType == b"trak":
+            traks.append(bytearray(moov[boxStart:boxEnd]))
+        elif boxType == b"mvex":
+            for childType, childStart, _, childEnd in _children(moov, innerStart, boxEnd):
+                if childType == b"trex":
+                    track.trex = bytearray(moov[childStart:childEnd])
+                elif childType == b"mehd":
+                    track.mehd = moov[childStart:childEnd]
+        else:
+            track.extras.append(moov[boxStart:boxEnd])
+
+    if len(traks) != 1 or not track.trex or not track.mvhd:
+        raise remuxError("只支持单轨道的分片 MP4")
+
+    track.trak = traks[0]
+    trakEnd = len(track.trak)
+
+    mdhd = _find(track.trak, 8, trakEnd, [b"mdia", b"mdhd"])
+    stsd = _find(track.trak, 8, trakEnd, [b"mdia", b"minf", b"stbl", b"stsd"])
+    if mdhd is None or stsd is None:
+        raise remuxError("轨道缺少 mdhd 或 stsd")
+
+    # mdhd: version(1) flags(3) 之后 v1 是两个 64 位时间，v0 是两个 32 位时间
+    version = track.trak[mdhd[0]]
+    timescaleAt = mdhd[0] + (20 if version == 1 else 12)
+    track.timescale = struct.unpack_from(">I", track.trak, timescaleAt)[0] or 1
+
+    # stsd: version/flags(4) entry_count(4) 之后是第一个样本描述
+    track.codec = bytes(track.trak[stsd[0] + 12 : stsd[0] + 16])
+
+
+def _setTrackId(data: bytearray, path: list[bytes], start: int, trackId: int):
+    found = _find(data, start, len(data), path)
+    if found is None:
+        raise remuxError(f"缺少 {path[-1]!r}")
+
+    payloadStart = found[0]
+    # tkhd 的 track_ID 前面还有创建/修改时间，tfhd/trex 紧跟在 version/flags 后面
+    if path[-1] == b"tkhd":
+        payloadStart += 20 if data[payloadStart] == 1 else 12
+    else:
+        payloadStart += 4
+
+    struct.pack_into(">I", data, payloadStart, trackId)
+
+
+def _mergedMoov(tracks: list[_inputTrack]) -> bytes:
+    mvhd = bytearray(tracks[0].mvhd)
+    # mvhd 最后 4 字节是 next_track_ID
+    struct.pack_into(">I", mvhd, len(mvhd) - 4, len(tracks) + 1)
+
+    traks = b""
+    trexs = b""
+    for trackId, track in enumerate(tracks, start=1):
+        trak = bytearray(track.trak)
+        _setTrackId(trak, [b"tkhd"], 8, trackId)
+        traks += trak
+
+        trex = bytearray(track.trex)
+        _setTrackId(trex, [b"trex"], 0, trackId)
+        trexs += trex
+
+    mvex = _box(b"mvex", tracks[0].mehd + trexs)
+
+    return _box(b"moov", bytes(mvhd) + traks + mvex + b"".join(tracks[0].extras))
+
+
+def _fragments(track: _inputTrack) -> Iterator[_fragment]:
+    file = track.file
+    file.seek(track.fragmentStart)
+
+    while header := _readHeader(file):
+        boxType, size, headerSize = header
+        boxStart = file.tell() - headerSize
+
+        # sidx/styp 等索引信息引用的是原文件偏移，合并后直接丢掉
+        if boxType != b"moof":
+            file.seek(boxStart + size)
+            continue
+
+        file.seek(boxStart)
+        moof = bytearray(file.read(size))
+
+        mdatHeader = _readHeader(file)
+        if mdatHeader is None or mdatHeader[0] != b"mdat":
+            raise remuxError("moof 后面没有紧跟 mdat")
+
+        mdatStart = file.tell() - mdatHeader[2]
+
+        yield _fragment(moof, mdatStart, mdatHeader[1], _decodeTime(moof, track))
+
+        file.seek(mdatStart + mdatHeader[1])
+
+
+def _decodeTime(moof: bytearray, track: _inputTrack) -> float:
+    trafs = [c for c in _children(moof, 8, len(moof)) if c[0] == b"traf"]
+    if len(trafs) != 1:
+        raise remuxError("只支持每个 moof 一个 traf")
+
+    tfhd = _find(moof, 8, len(moof), [b"traf", b"tfhd"])
+    if tfhd is None:
+        raise remuxError("traf 缺少 tfhd")
+
+    flags = int.from_bytes(moof[tfhd[0] + 1 : tfhd[0] + 4], "big")
+    if flags & TFHD_BASE_DATA_OFFSET:
+        raise remuxError("不支持带绝对偏移的分片")
+
+    tfdt = _find(moof, 8, len(moof), [b"traf", b"tfdt"])
+    if tfdt is None:
+        raise remuxError("traf 缺少 tfdt")
+
+    if moof[tfdt[0]] == 1:
+        baseTime = struct.unpack_from(">Q", moof, tfdt[0] + 4)[0]
+    else:
+        baseTime = struct.unpack_from(">I", moof, tfdt[0] + 4)[0]
+
+    return baseTime / track.timescale
+
+
+def _shiftDecodeTime(moof: bytearray, offset: int):
+    # 片段下载时把各轨道的时间整体往前挪，让成品从 0 开始
+    tfdt = _find(moof, 8, len(moof), [b"traf", b"tfdt"])
+
+    if moof[tfdt[0]] == 1:
+        baseTime = struct.unpack_from(">Q", moof, tfdt[0] + 4)[0]
+        struct.pack_into(">Q", moof, tfdt[0] + 4, max(0, baseTime - offset))
+    else:
+        baseTime = struct.unpack_from(">I", moof, tfdt[0] + 4)[0]
+        struct.pack_into(">I", moof, tfdt[0] + 4, max(0, baseTime - offset))
+
+
+def _clearDuration(mvhd: bytes) -> bytes:
+    # mvhd: version/flags(4) 之后 v1 是两个 64 位时间 + timescale，v0 是两个 32 位时间 + timescale
+    mvhd = bytearray(mvhd)
+    if mvhd[8] == 1:
+        struct.pack_into(">Q", mvhd, 8 + 24, 0)
+    else:
+        struct.pack_into(">I", mvhd, 8 + 16, 0)
+
+    return bytes(mvhd)
+
+
+@dataclass
+class sidxRef:
+    # 秒
+    start: float
+    end: float
+    # 在原文件里的字节区间，终点不含
+    byteStart: int
+    byteEnd: int
+
+
+def parseSidx(data: bytes) -> list[sidxRef]:
+    """
+    从文件开头到 sidx 结束的这段数据里解析分片索引，
+    得到每个分片的时间范围和字节范围
+    """
+    for boxType, _, payloadStart, boxEnd in _children(data, 0, len(data)):
+        if boxType == b"sidx":
+            break
+    else:
+        raise remuxError("没有找到 sidx")
+
+    version = data[payloadStart]
+    # version/flags(4) reference_ID(4) timescale(4)
+    timescale = struct.unpack_from(">I", data, payloadStart + 8)[0] or 1
+    pos = payloadStart + 12
+
+    if version == 1:
+        earliest, firstOffset = struct.unpack_from(">QQ", data, pos)
+        pos += 16
+    else:
+        earliest, firstOffset = struct.unpack_from(">II", data, pos)
+        pos += 8
+
+    # reserved(2) reference_count(2)
+    count = struct.unpack_from(">H", data, pos + 2)[0]
+    pos += 4
+
+    refs = []
+    offset = boxEnd + firstOffset
+    presented = earliest
+
+    for _ in range(count):
+        sizeField, duration, _ = struct.unpack_from(">III", data, pos)
+        pos += 12
+
+        if sizeField >> 31:
+            raise remuxError("不支持多级 sidx")
+
+        size = sizeField & 0x7FFFFFFF
+        refs.append(
+            sidxRef(
+                presented / timescale,
+                (presented + duration) / timescale,
+                offset,
+                offset + size,
+            )
+        )
+        offset += size
+        presented += duration
+
+    return refs
+
+
+def _patchMoof(moof: bytearray, trackId: int, sequence: int):
+    mfhd = _find(moof, 8, len(moof), [b"mfhd"])
+    if mfhd is None:
+        raise remuxError("moof 缺少 mfhd")
+
+    struct.pack_into(">I", moof, mfhd[0] + 4, sequence)
+    _setTrackId(moof, [b"traf", b"tfhd"], 8, trackId)
+
+
+def _copyRange(
+    src: BinaryIO,
+    start: int,
+    size: int,
+    dst: BinaryIO,
+    cancelled: Optional[threading.Event] = None,
+):
+    src.seek(start)
+
+    while size > 0:
+        _checkCancelled(cancelled)
+
+        chunk = src.read(min(COPY_CHUNK_SIZE, size))
+        if not chunk:
+            raise remuxError("mdat 数据不完整")
+
+        dst.write(chunk)
+        size -= len(chunk)
+
+
+def remuxFiles(
+    inputs: list[str],
+    out: str,
+    rebase: bool = False,
+    cancelled: Optional[threading.Event] = None,
+) -> tuple[str, int]:
+    """
+    把若干个单轨道的分片 MP4（b站 DASH 的 m4s）合并成一个分片 MP4。
+    只搬运 box，不解码；分片按解码时间交错写出，内存里同时只有每路的一个 moof。
+    rebase 时（只下载了中间一段）把所有轨道按最早的分片对齐到 0，并去掉原视频的总时长。
+    cancelled 被置位后在下一块数据前停下，删掉 .part，不会再改名成成品。
+    返回写出内容的 (sha256, 字节数)，边写边算
+    """
+    with contextlib.ExitStack() as stack:
+        files = [stack.enter_context(open(path, "rb")) for path in inputs]
+        tracks = [_openTrack(file) for file in files]
+
+        for track in tracks:
+            if track.codec not in SUPPORTED_CODECS:
+                raise remuxError(f"不支持的编码：{track.codec!r}")
+
+        fragmentIters = [_fragments(track) for track in tracks]
+        heads = [next(it, None) for it in fragmentIters]
+        sequence = 1
+
+        # 各轨道统一减去同一个时刻，音画的相对位置不变
+        offsets = [0] * len(tracks)
+        if rebase and any(heads):
+            base = min(head.decodeTime for head in heads if head)
+            offsets = [round(base * track.timescale) for track in tracks]
+
+            for track in tracks:
+                track.mvhd = _clearDuration(track.mvhd)
+                track.mehd = b""
+
+        try:
+            with open(f"{out}.part", "wb") as partFile:
+                dst = hashingWriter(partFile)
+                dst.write(tracks[0].ftyp)
+                dst.write(_mergedMoov(tracks))
+
+                while any(heads):
+                    index = min(
+                        (i for i, head in enumerate(heads) if head),
+                        key=lambda i: heads[i].decodeTime,
+                    )
+                    head = heads[index]
+
+                    if offsets[index]:
+                        _shiftDecodeTime(head.moof, offsets[index])
+                    _patchMoof(head.moof, index + 1, sequence)
+                    sequence += 1
+
+                    dst.write(head.moof)
+                    _copyRange(files[index], head.mdatStart, head.mdatSize, dst, cancelled)
+
+                    heads[index] = next(fragmentIters[index], None)
+
+            _checkCancelled(cancelled)
+        except remuxCancelled:
+            with contextlib.suppress(OSError):
+                os.remove(f"{out}.part")
+
+            raise
+
+    os.replace(f"{out}.part", out)
+
+    return dst.hexdigest(), dst.size
+
+
+async def remux(inputs: list[str], out: str, rebase: bool = False) -> tuple[str, int]:
+    # 取消 to_thread 停不下线程，靠这个标志让它自己停
+    cancelled = threading.Event()
+
+    try:
+        return await asyncio.to_thread(remuxFiles, inputs, out, rebase, cancelled)
+    except BaseException:
+        cancelled.set()
+
+        with contextlib.suppress(OSError):
+            os.remove(f"{out}.part")
+
+        raise
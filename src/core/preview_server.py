@@ -0,0 +1,273 @@
+import asyncio, os, re
+from dataclasses import dataclass, field
+from typing import Optional
+from xml.sax.saxutils import quoteattr
+from aiohttp import web
+
+from utils import config_loader as conf
+from core import range_downloader, stream_policy, dash_clip
+
+HOST = "127.0.0.1"
+# 每次最多读出来发给播放器的字节数
+SEND_CHUNK = 256 * 1024
+# 等数据落盘时每隔这么久（秒）重新检查一次，下载器结束或失败时不会一直挂着
+WAIT_STEP = 1.0
+# 请求的数据这么久都没有进展时放弃这次请求，播放器会自己重试
+STALL_TIMEOUT = 60.0
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+@dataclass
+class previewPage:
+    folder: str
+    # 地址里的文件名 -> 正在下载的临时文件
+    files: dict[str, str]
+    # dash 清单，没有分片索引的流给不出来时为空
+    manifest: str = ""
+    clients: set = field(default_factory=set)
+
+
+def _mediaType(entry: dict) -> str:
+    return entry.get("mime_type") or entry.get("mimeType") or (
+        "video/mp4" if entry.get("height") else "audio/mp4"
+    )
+
+
+def buildManifest(choice: stream_policy.streamChoice, duration: float, names: list[str]) -> str:
+    # 单文件 dash 清单：每一路流是一个带 sidx 的完整 m4s，播放器按 SegmentBase 自己发 Range 请求
+    sets = []
+    for entry, name in zip(choice.entries, names):
+        init, index = dash_clip.indexRanges(entry)
+
+        attrs = f' id={quoteattr(name)} bandwidth="{int(entry.get("bandwidth", 0))}"'
+        if entry.get("codecs"):
+            attrs += f" codecs={quoteattr(entry['codecs'])}"
+        if entry.get("height"):
+            attrs += f' width="{entry.get("width", 0)}" height="{entry["height"]}"'
+
+        sets.append(
+            f"  <AdaptationSet mimeType={quoteattr(_mediaType(entry))}>\n"
+            f"   <Representation{attrs}>\n"
+            f"    <BaseURL>{name}</BaseURL>\n"
+            f'    <SegmentBase indexRange="{index[0]}-{index[1] - 1}">\n'
+            f'     <Initialization range="{init[0]}-{init[1] - 1}"/>\n'
+            f"    </SegmentBase>\n"
+            f"   </Representation>\n"
+            f"  </AdaptationSet>\n"
+        )
+
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static"'
+        ' profiles="urn:mpeg:dash:profile:isoff-on-demand:2011"'
+        f' minBufferTime="PT1.5S" mediaPresentationDuration="PT{duration:.3f}S">\n'
+        " <Period>\n" + "".join(sets) + " </Period>\n"
+        "</MPD>\n"
+    )
+
+
+def _parseRange(header: str, total: int) -> Optional[tuple[int, int]]:
+    # 只支持单个区间；返回 [start, end)，区间不合法时返回 None
+    match = _RANGE.fullmatch(header.strip())
+    if match is None:
+        return None
+
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last) + 1, total) if last else total
+    elif last:
+        start, end = max(0, total - int(last)), total
+    else:
+        return None
+
+    if start >= end:
+        return None
+
+    return start, end
+
+
+class previewServer:
+    """
+    边下边看：在本机开一个 HTTP 服务，把正在下载的临时流按 Range 请求吐给播放器。
+    播放器要的位置还没下到时，让分段下载器先去下那一段，开播和拖动都只需要等几秒，
+    其余部分照常在后台下完。分P混流完成后临时文件会被删掉，预览随之结束
+    """
+
+    def __init__(self):
+        self._runner: Optional[web.AppRunner] = None
+        self._port = 0
+        self._starting: Optional[asyncio.Lock] = None
+        # 进度里的键（"bvid-分P"）-> 预览的分P
+        self._pages: dict[str, previewPage] = {}
+
+    def enabled(self) -> bool:
+        return conf.userConf.getDownloadPreview()
+
+    async def _ensureStarted(self):
+        if self._starting is None:
+            self._starting = asyncio.Lock()
+
+        async with self._starting:
+            if self._runner is not None:
+                return
+
+            app = web.Application()
+            app.router.add_get("/{page}/{name}", self._handle)
+
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            site = web.TCPSite(runner, HOST, conf.userConf.getDownloadPreviewPort())
+            await site.start()
+
+            # 配置端口为 0 时由系统分配，从监听地址里取回实际端口
+            self._port = runner.addresses[0][1]
+            self._runner = runner
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+        self._pages.clear()
+
+    def urlFor(self, key: str) -> str:
+        page = self._pages.get(key.replace("/", "-"))
+        if page is None or self._runner is None:
+            return ""
+
+        name = "manifest.mpd" if page.manifest else next(iter(page.files))
+
+        return f"http://{HOST}:{self._port}/{key.replace('/', '-')}/{name}"
+
+    async def publish(
+        self,
+        key: str,
+        folder: str,
+        files: dict[str, str],
+        choice: Optional[stream_policy.streamChoice] = None,
+        duration: float = 0,
+    ) -> str:
+        await self._ensureStarted()
+
+        manifest = ""
+        if choice is not None and len(choice.entries) == len(files):
+            try:
+                manifest = buildManifest(choice, duration, list(files))
+            except dash_clip.clipError:
+                # 没有分片索引，只能单独播每一路流
+                pass
+
+        self._pages[key.replace("/", "-")] = previewPage(folder, files, manifest)
+
+        return self.urlFor(key)
+
+    def unpublish(self, key: str):
+        page = self._pages.pop(key.replace("/", "-"), None)
+        if page is None:
+            return
+
+        # 正在发数据的请求停下来，不然删临时文件时在 Windows 上会失败
+        for task in page.clients:
+            task.cancel()
+
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        page = self._pages.get(request.match_info["page"])
+        if page is None:
+            raise web.HTTPNotFound()
+
+        name = request.match_info["name"]
+        if name == "manifest.mpd" and page.manifest:
+            return web.Response(text=page.manifest, content_type="application/dash+xml")
+
+        path = page.files.get(name)
+        if path is None:
+            raise web.HTTPNotFound()
+
+        downloader = range_downloader.activeDownloader(path)
+        if downloader is None:
+            # 这一路已经下完（或还没开始）：完整的文件直接交给 aiohttp 处理 Range
+            if range_downloader.isComplete(path):
+                return web.FileResponse(path)
+
+            raise web.HTTPServiceUnavailable(headers={"Retry-After": "2"})
+
+        task = asyncio.current_task()
+        page.clients.add(task)
+        try:
+            return await self._serveGrowing(request, downloader, path)
+        finally:
+            page.clients.discard(task)
+
+    async def _serveGrowing(
+        self,
+        request: web.Request,
+        downloader: range_downloader.rangeDownloader,
+        path: str,
+    ) -> web.StreamResponse:
+        # 探测到总大小之前不知道该怎么回 Range
+        await asyncio.wait_for(downloader.ready.wait(), STALL_TIMEOUT)
+        total = downloader.totalBytes()
+
+        header = request.headers.get("Range")
+        if header is None:
+            start, end = 0, total
+            response = web.StreamResponse(status=200)
+        else:
+            span = _parseRange(header, total)
+            if span is None:
+                raise web.HTTPRequestRangeNotSatisfiable(
+                    headers={"Content-Range": f"bytes */{total}"}
+                )
+
+            start, end = span
+            response = web.StreamResponse(status=206)
+            response.headers["Content-Range"] = f"bytes {start}-{end - 1}/{total}"
+
+        response.headers["Accept-Ranges"] = "bytes"
+        response.content_type = "video/mp4" if path.endswith(".m4s") else "video/x-flv"
+        response.content_length = end - start
+        await response.prepare(request)
+
+        with open(path, "rb") as file:
+            pos = start
+            while pos < end:
+                ready = await self._waitFor(downloader, path, pos)
+
+                downloader.flushWrites()
+                file.seek(pos)
+                data = file.read(min(ready, end, pos + SEND_CHUNK) - pos)
+                if not data:
+                    break
+
+                await response.write(data)
+                pos += len(data)
+
+        await response.write_eof()
+
+        return response
+
+    async def _waitFor(
+        self, downloader: range_downloader.rangeDownloader, path: str, pos: int
+    ) -> int:
+        # 等到 pos 处有数据，返回从 pos 开始连续可读的终点
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + STALL_TIMEOUT
+        asked = False
+
+        while (ready := downloader.availableFrom(pos)) <= pos:
+            if downloader.finished or loop.time() > deadline:
+                raise ConnectionAbortedError(f"{os.path.basename(path)} 下载已停止")
+
+            # 只在第一次等的时候调整下载顺序，后续顺序下载的数据由同一条连接接着给
+            if not asked:
+                downloader.prioritize(pos)
+                asked = True
+
+            await downloader.waitAdvance(WAIT_STEP)
+
+        return ready
+
+
+previewSrv = previewServer()
@@ -0,0 +1,951 @@
+import asyncio, contextvars, threading, time, json, os, pathlib, urllib.parse
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+import aiohttp
+import bilibili_api as bapi
+
+from utils import config_loader as conf
+from core.download_scheduler import downScheduler
+from core import download_progress
+from core.rate_limiter import bwLimiter, CLASS_VIDEO
+from core.download_journal import dlJournal
+
+# 每次从响应里读取的块大小
+CHUNK_SIZE = 256 * 1024
+# 有人要某个位置的数据时，离正在下载的连接不到这么远就等它顺序下到，不另起炉灶
+DEMAND_NEAR = 2 * 1024 * 1024
+# 段的最小拆分粒度，剩余量小于它的两倍就不再拆给新连接
+MIN_SPLIT_SIZE = 2 * 1024 * 1024
+# 自动调优的测速周期（秒）
+TUNE_INTERVAL = 1.0
+# 下载途中刷新旁路清单和任务记录的间隔（秒）或新增字节数，先到哪个算哪个
+MANIFEST_SAVE_INTERVAL = 10.0
+MANIFEST_SAVE_BYTES = 64 * 1024 * 1024
+# 新增连接后总吞吐至少要提升这么多，才认为还没跑满带宽
+TUNE_GAIN_RATIO = 1.08
+# 单条连接连续失败的最大重试次数
+MAX_RETRIES = 6
+# 重试退避的基础时长与上限（秒）
+RETRY_BACKOFF = 0.5
+RETRY_BACKOFF_MAX = 15.0
+# 顺序流模式下每个 Range 请求的块大小，内存占用约为 连接数 x 块大小
+STREAM_BLOCK_SIZE = 4 * 1024 * 1024
+# 镜像测速的采样周期（秒），也是请求开始后多久才开始和别的镜像比较
+MIRROR_SAMPLE_INTERVAL = 2.0
+# 当前镜像的速度不到别的镜像的这个比例时，把剩余区间迁走
+MIRROR_SWITCH_RATIO = 0.5
+# 速度样本超过这么久就视为过时，会再派一条连接过去重新测
+MIRROR_REMEASURE = 20.0
+# 镜像出错后暂停使用的基础时长与上限（秒）
+MIRROR_BAN = 5.0
+MIRROR_BAN_MAX = 60.0
+# 镜像单连接速度的平滑系数
+MIRROR_SMOOTHING = 0.3
+
+
+@dataclass
+class rangeSegment:
+    start: int
+    end: int  # 不含
+    cursor: int = -1
+    active: bool = False
+
+    def __post_init__(self):
+        if self.cursor < self.start:
+            self.cursor = self.start
+
+    def remaining(self) -> int:
+        return self.end - self.cursor
+
+
+def newSession() -> aiohttp.ClientSession:
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30)
+
+    return aiohttp.ClientSession(headers=bapi.HEADERS, timeout=timeout)
+
+
+async def probeLength(session: aiohttp.ClientSession, url: str) -> Optional[int]:
+    # 用 0-0 的 Range 请求探测总长度，返回 None 表示服务器不支持分段
+    async with session.get(url, headers={"Range": "bytes=0-0"}) as resp:
+        resp.raise_for_status()
+
+        contentRange = resp.headers.get("Content-Range", "")
+        if resp.status != 206 or "/" not in contentRange:
+            return None
+
+        total = contentRange.rsplit("/", 1)[1]
+        if not total.isdigit():
+            return None
+
+        return int(total)
+
+
+def retryDelay(failures: int) -> float:
+    return min(RETRY_BACKOFF * 2**failures, RETRY_BACKOFF_MAX)
+
+
+def manifestPath(out: str) -> pathlib.Path:
+    return pathlib.Path(f"{out}.part.json")
+
+
+def discardPartial(out: str):
+    pathlib.Path(out).unlink(missing_ok=True)
+    manifestPath(out).unlink(missing_ok=True)
+    dlJournal.dropStream(out)
+
+
+# 正在下载的输出文件 -> 下载器，边下边看时按路径找到它
+_active: dict[str, "rangeDownloader"] = {}
+
+
+def activeDownloader(out: str) -> Optional["rangeDownloader"]:
+    return _active.get(os.path.abspath(out))
+
+
+def isComplete(out: str) -> bool:
+    # 没有在下载的文件是否已经完整：要有清单，清单里的区间覆盖全部且文件大小对得上。
+    # 没有清单的可能是被打断的单连接下载，不能当成完整的
+    try:
+        with open(manifestPath(out), "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        size = os.path.getsize(out)
+    except (OSError, ValueError):
+        return False
+
+    total = data.get("total")
+
+    return size == total and mergeRanges(
+        [tuple(r) for r in data.get("ranges", [])]
+    ) == [(0, total)]
+
+
+def mergeRanges(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    merged: list[tuple[int, int]] = []
+
+    for start, end in sorted(r for r in ranges if r[1] > r[0]):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    return merged
+
+
+@dataclass
+class mirrorStat:
+    url: str
+    # 探测请求的响应时间（秒）
+    latency: float = float("inf")
+    # 探测到的总长度，和起步镜像不一致的镜像不会被使用
+    total: Optional[int] = None
+    # 单连接速度（字节/秒）
+    speed: float = 0.0
+    sampledAt: float = float("-inf")
+    failures: int = 0
+    bannedUntil: float = 0.0
+    # 当前正在使用它的连接数
+    active: int = 0
+
+    def measured(self, now: float) -> bool:
+        return now - self.sampledAt < MIRROR_REMEASURE
+
+
+class mirrorPool:
+    """
+    同一个流的多个镜像（base_url 和 backup_url）。
+    启动时并行探测，先用最先响应的那个，其余镜像各分一条连接去实测；
+    下载中持续记录单连接速度，出错的镜像暂时拉黑，变慢的镜像上的剩余区间迁到更快的镜像
+    """
+
+    def __init__(self, urls: list[str]):
+        self._stats = [mirrorStat(url) for url in dict.fromkeys(u for u in urls if u)]
+        self._total: Optional[int] = None
+        self._probes: list[asyncio.Task] = []
+
+    def primary(self) -> str:
+        return self._stats[0].url
+
+    async def _probeOne(self, session: aiohttp.ClientSession, stat: mirrorStat):
+        begin = time.monotonic()
+
+        try:
+            stat.total = await probeLength(session, stat.url)
+            stat.latency = time.monotonic() - begin
+
+            return stat, None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.fail(stat)
+
+            return stat, e
+
+    async def probe(self, session: aiohttp.ClientSession) -> Optional[int]:
+        # 所有镜像同时探测，第一个成功的决定总长度，没响应完的留在后台继续测延迟
+        self._probes = [
+            asyncio.create_task(self._probeOne(session, stat)) for stat in self._stats
+        ]
+        lastError: Optional[BaseException] = None
+
+        for future in asyncio.as_completed(self._probes):
+            stat, error = await future
+
+            if error is None:
+                self._total = stat.total
+
+                return stat.total
+
+            lastError = error
+
+        raise lastError
+
+    def close(self):
+        for task in self._probes:
+            task.cancel()
+
+    def _usable(self, stat: mirrorStat) -> bool:
+        # 没探测完的镜像先当作可用，真正请求时出错会被拉黑
+        return stat.total in (None, self._total)
+
+    def pick(self) -> mirrorStat:
+        now = time.monotonic()
+        candidates = [stat for stat in self._stats if self._usable(stat)]
+        healthy = [stat for stat in candidates if stat.bannedUntil <= now]
+
+        # 全都被拉黑时用最早解禁的那个
+        if not healthy:
+            return min(candidates or self._stats, key=lambda stat: stat.bannedUntil)
+
+        # 有实测速度的按速度排，没有的按探测延迟排在后面
+        best = max(
+            healthy,
+            key=lambda stat: (1, stat.speed) if stat.measured(now) else (0, -stat.latency),
+        )
+
+        # 最快的镜像已经有连接在跑时，派一条连接去测还没测过（或样本过时）的镜像
+        stale = [
+            stat
+            for stat in healthy
+            if stat is not best and not stat.measured(now) and stat.active == 0
+        ]
+        if stale and best.active > 0:
+            return min(stale, key=lambda stat: stat.latency)
+
+        return best
+
+    def record(self, stat: mirrorStat, speed: float):
+        now = time.monotonic()
+
+        if stat.measured(now):
+            stat.speed += MIRROR_SMOOTHING * (speed - stat.speed)
+        else:
+            stat.speed = speed
+
+        stat.sampledAt = now
+        stat.failures = 0
+
+    def fail(self, stat: mirrorStat):
+        stat.failures += 1
+        stat.speed *= 0.5
+        stat.bannedUntil = time.monotonic() + min(
+            MIRROR_BAN * 2 ** (stat.failures - 1), MIRROR_BAN_MAX
+        )
+
+    def shouldLeave(self, stat: mirrorStat, speed: float) -> bool:
+        # 别的镜像明显更快时，当前连接放下手上的区间，换镜像继续
+        now = time.monotonic()
+
+        leave = any(
+            other.speed * MIRROR_SWITCH_RATIO > speed
+            for other in self._stats
+            if other is not stat
+            and self._usable(other)
+            and other.bannedUntil <= now
+            and other.measured(now)
+        )
+
+        # 要离开时直接按实测值降分，免得重新挑选时平滑后的旧速度又把它选回来
+        if leave:
+            stat.speed = min(stat.speed, speed)
+
+        return leave
+
+
+class rangeManifest:
+    """
+    旁路清单：记录某个输出文件已经落盘的字节区间，用于断点续传。
+    链接里的 deadline 等参数每次都不同，所以只用路径部分来确认是不是同一个流
+    """
+
+    def __init__(self, out: str, url: str):
+        self._path = manifestPath(out)
+        self._out = out
+        self._streamId = urllib.parse.urlparse(url).path
+
+        # 每次保存的序号，以及已经落盘的最新序号
+        self._seq = 0
+        self._written = 0
+        self._lock = threading.Lock()
+
+    def load(self, total: int) -> list[tuple[int, int]]:
+        if not pathlib.Path(self._out).exists():
+            return []
+
+        if os.path.getsize(self._out) != total:
+            return []
+
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            # 旁路清单丢了或写坏了，再看看任务记录里有没有
+            return mergeRanges(dlJournal.loadRanges(self._out, self._streamId, total))
+
+        if data.get("stream") != self._streamId or data.get("total") != total:
+            return []
+
+        return mergeRanges([(int(s), int(e)) for s, e in data.get("ranges", [])])
+
+    def clear(self):
+        self._path.unlink(missing_ok=True)
+
+    def _prepare(self, total: int, ranges: list[tuple[int, int]]) -> tuple[int, dict]:
+        self._seq += 1
+
+        return self._seq, {
+            "stream": self._streamId,
+            "total": total,
+            "ranges": [list(r) for r in mergeRanges(ranges)],
+        }
+
+    def _write(self, seq: int, data: dict, files: list):
+        # 可能在线程里运行：先把各连接的写缓冲刷下去，清单里的区间才真的在盘上
+        for file in files:
+            try:
+                file.flush()
+            except ValueError:
+                # 这条连接刚好结束、文件已经关了，关闭时已经刷过
+                pass
+
+        with self._lock:
+            # 线程里的旧快照晚到时不能覆盖更新的清单
+            if seq <= self._written:
+                return
+
+            # 先写临时文件再替换，避免中途退出留下坏掉的清单
+            tmpPath = self._path.with_suffix(".tmp")
+            with open(tmpPath, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+
+            os.replace(tmpPath, self._path)
+            self._written = seq
+
+    def save(self, total: int, ranges: list[tuple[int, int]], files: list = ()):
+        seq, data = self._prepare(total, ranges)
+        self._write(seq, data, list(files))
+
+        dlJournal.saveRanges(self._out, self._streamId, total, data["ranges"])
+
+    async def saveInBackground(self, total: int, ranges: list[tuple[int, int]], files: list):
+        # 文件读写放到线程里；任务记录的 SQLite 连接只能在事件循环线程里用，批量提交本身很轻
+        seq, data = self._prepare(total, ranges)
+        await asyncio.to_thread(self._write, seq, data, files)
+
+        dlJournal.saveRanges(self._out, self._streamId, total, data["ranges"])
+
+
+class rangeDownloader:
+    """
+    分段并发下载：用多个 HTTP Range 请求同时拉取同一个流，
+    各段按偏移写入预分配好的文件，并根据实测吞吐自动增加连接数。
+    已完成的区间会记到旁路清单里，中断后再次运行只补齐缺失的部分
+    """
+
+    def __init__(
+        self,
+        url: str,
+        out: str,
+        intro: str = "",
+        connections: Optional[int] = None,
+        maxConnections: Optional[int] = None,
+        mirrors: Optional[list[str]] = None,
+    ):
+        self._url = url
+        self._mirrors = mirrorPool([url] + (mirrors or []))
+        self._out = out
+        self._intro = intro
+
+        self._initConns = max(1, connections or conf.userConf.getDownloadConnections())
+        self._maxConns = max(
+            self._initConns,
+            maxConnections or conf.userConf.getDownloadMaxConnections(),
+        )
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._total = 0
+        self._done = 0
+        self._segments: list[rangeSegment] = []
+        self._workers: list[asyncio.Task] = []
+        # 每条连接累计下载的字节数
+        self._connBytes: dict[int, int] = {}
+        # 每条连接当前打开的文件句柄，保存清单前要先刷盘
+        self._connFiles: dict[int, object] = {}
+        # 续传前就已经完成的区间
+        self._resumed: list[tuple[int, int]] = []
+        self._manifest = rangeManifest(out, url)
+        self._progress = download_progress.current()
+        # 下载所属任务的上下文（调度器任务、日志里的分P），边下边看时从 HTTP 处理协程里加连接也要用它
+        self._context: Optional[contextvars.Context] = None
+
+        # 边下边看：最近一次被请求的位置，以及等数据的读者
+        self._demand: Optional[int] = None
+        self._advanced: Optional[asyncio.Event] = None
+        self._single = False
+        self.ready = asyncio.Event()
+        self.finished = False
+
+    def totalBytes(self) -> int:
+        return self._total
+
+    def doneBytes(self) -> int:
+        return self._done
+
+    def availableFrom(self, offset: int) -> int:
+        # 从 offset 开始已经落盘的连续数据的终点，offset 本身还没下到时返回 offset
+        for start, end in mergeRanges(self._completedRanges()):
+            if start <= offset < end:
+                return end
+
+        return offset
+
+    def flushWrites(self):
+        # 各连接的写缓冲刷到文件里，别的句柄才读得到
+        for file in self._connFiles.values():
+            file.flush()
+
+    async def waitAdvance(self, timeout: float):
+        if self._advanced is None:
+            self._advanced = asyncio.Event()
+
+        try:
+            await asyncio.wait_for(self._advanced.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _signalAdvance(self):
+        if self._advanced is not None:
+            self._advanced.set()
+            self._advanced = None
+
+    def prioritize(self, offset: int):
+        """
+        有读者要 offset 处的数据：把它所在的段从这里切开优先下载。
+        没有空余连接时，让离得最远的那条连接先停下来，剩下的部分放回去以后再下
+        """
+        target = next(
+            (seg for seg in self._segments if seg.cursor <= offset < seg.end), None
+        )
+        if target is None:
+            return
+
+        self._demand = offset
+
+        if target.active and offset - target.cursor <= DEMAND_NEAR:
+            return
+
+        if offset > target.cursor:
+            self._segments.append(rangeSegment(offset, target.end))
+            target.end = offset
+
+        if len(self._aliveWorkers()) < self._maxConns:
+            self._spawnWorkers(1)
+
+            return
+
+        victims = [
+            seg
+            for seg in self._segments
+            if seg.active and seg.remaining() > 0 and not seg.cursor <= offset < seg.end
+        ]
+        if not victims:
+            return
+
+        victim = max(victims, key=lambda seg: abs(seg.cursor - offset))
+        self._segments.append(rangeSegment(victim.cursor, victim.end))
+        # 那条连接收到下一块时发现段已经到头，回去重新领取时会先领到被请求的段
+        victim.end = victim.cursor
+
+    async def run(self) -> int:
+        self._context = contextvars.copy_context()
+        key = os.path.abspath(self._out)
+        _active[key] = self
+
+        try:
+            return await self._run()
+        finally:
+            self.finished = True
+            self._signalAdvance()
+            if _active.get(key) is self:
+                del _active[key]
+
+    async def _run(self) -> int:
+        async with newSession() as session:
+            self._session = session
+
+            try:
+                total = await self._mirrors.probe(session)
+
+                # 服务器不支持 Range 时退回单连接
+                if total is None:
+                    return await self._downloadSingle()
+
+                self._total = total
+                self._progress.addTotal(total)
+                self._resumed = self._manifest.load(total)
+
+                if self._resumed:
+                    self._done = sum(end - start for start, end in self._resumed)
+                    self._segments = self._missingSegments()
+                    self._progress.addResumed(self._done)
+                else:
+                    self._preallocate()
+                    self._segments = self._initialSegments()
+
+                self.ready.set()
+
+                try:
+                    await self._runWorkers()
+                finally:
+                    self._saveManifest()
+            finally:
+                self._mirrors.close()
+
+        if self._done != self._total:
+            raise IOError(f"{self._out} 下载不完整 [{self._done} / {self._total}]")
+
+        return self._done
+
+    def _preallocate(self):
+        with open(self._out, "wb") as file:
+            file.truncate(self._total)
+
+    def _initialSegments(self) -> list[rangeSegment]:
+        count = max(1, min(self._initConns, self._total // MIN_SPLIT_SIZE))
+        step = self._total // count
+
+        segments = []
+        for i in range(count):
+            start = i * step
+            end = self._total if i == count - 1 else start + step
+            segments.append(rangeSegment(start, end))
+
+        return segments
+
+    def _missingSegments(self) -> list[rangeSegment]:
+        segments = []
+        cursor = 0
+
+        for start, end in self._resumed + [(self._total, self._total)]:
+            if start > cursor:
+                segments.append(rangeSegment(cursor, start))
+            cursor = max(cursor, end)
+
+        return segments
+
+    def _completedRanges(self) -> list[tuple[int, int]]:
+        if self._single:
+            return [(0, self._done)]
+
+        return self._resumed + [(seg.start, seg.cursor) for seg in self._segments]
+
+    def _saveManifest(self):
+        self._manifest.save(
+            self._total, self._completedRanges(), list(self._connFiles.values())
+        )
+
+    def _nextSegment(self) -> Optional[rangeSegment]:
+        # 先领取没人负责的段，有人在等数据时优先领它后面最近的那段
+        idle = [seg for seg in self._segments if not seg.active and seg.remaining() > 0]
+        if idle:
+            seg = idle[0]
+            if self._demand is not None:
+                demand = self._demand
+                seg = min(idle, key=lambda s: (s.end <= demand, abs(s.cursor - demand)))
+
+            seg.active = True
+            return seg
+
+        # 没有空闲段就从剩余最多的段里对半切一块出来（工作窃取）
+        victim = max(
+            (seg for seg in self._segments if seg.active),
+            key=lambda seg: seg.remaining(),
+            default=None,
+        )
+        if victim is None or victim.remaining() < MIN_SPLIT_SIZE * 2:
+            return None
+
+        mid = victim.cursor + victim.remaining() // 2
+        stolen = rangeSegment(mid, victim.end, active=True)
+        victim.end = mid
+        self._segments.append(stolen)
+
+        return stolen
+
+    def _spawnWorkers(self, count: int):
+        for _ in range(count):
+            connId = len(self._workers)
+            self._connBytes[connId] = 0
+            # 每条连接一份副本，各自占的主机名额等不会串到别的连接上
+            self._workers.append(
+                asyncio.create_task(self._worker(connId), context=self._context.copy())
+            )
+
+    def _aliveWorkers(self) -> list[asyncio.Task]:
+        return [task for task in self._workers if not task.done()]
+
+    async def _runWorkers(self):
+        if not self._segments:
+            return
+
+        self._spawnWorkers(self._initConns)
+        tuner = asyncio.create_task(self._tune())
+
+        try:
+            while alive := self._aliveWorkers():
+                done, _ = await asyncio.wait(
+                    alive, return_when=asyncio.FIRST_EXCEPTION
+                )
+
+                for task in done:
+                    if task.exception():
+                        raise task.exception()
+        finally:
+            tuner.cancel()
+            for task in self._workers:
+                task.cancel()
+
+            await asyncio.gather(tuner, *self._workers, return_exceptions=True)
+
+    async def _worker(self, connId: int):
+        # 每条连接持有独立的文件句柄，定位后顺序写，互不干扰
+        with open(self._out, "r+b") as file:
+            self._connFiles[connId] = file
+            failures = 0
+
+            try:
+                while seg := self._nextSegment():
+                    cursor = seg.cursor
+
+                    try:
+                        await self._fetchSegment(connId, seg, file)
+                    except (aiohttp.ClientError, asyncio.TimeoutError, IOError) as e:
+                        # 有进展就重新计数，只有原地踏步才会耗尽重试次数
+                        failures = 0 if seg.cursor > cursor else failures + 1
+
+                        if failures > MAX_RETRIES:
+                            raise
+
+                        delay = retryDelay(failures)
+                        print(f"{self._intro} - 连接{connId}出错，{delay:.1f}秒后重试：{e}")
+
+                        await asyncio.sleep(delay)
+                    else:
+                        failures = 0
+                    finally:
+                        seg.active = False
+            finally:
+                del self._connFiles[connId]
+
+    async def _fetchSegment(self, connId: int, seg: rangeSegment, file):
+        mirror = self._mirrors.pick()
+        headers = {"Range": f"bytes={seg.cursor}-{seg.end - 1}"}
+        mirror.active += 1
+
+        try:
+            async with (
+                downScheduler.hostSlot(mirror.url),
+                self._session.get(mirror.url, headers=headers) as resp,
+            ):
+                resp.raise_for_status()
+
+                if resp.status != 206:
+                    raise aiohttp.ClientPayloadError(
+                        f"{mirror.url} 不再返回分段内容，状态码：{resp.status}"
+                    )
+
+                file.seek(seg.cursor)
+
+                # 按采样周期统计这条连接在当前镜像上的速度
+                sampleStart = time.monotonic()
+                sampleBytes = 0
+
+                async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                    await downScheduler.checkpoint()
+                    await bwLimiter.acquire(CLASS_VIDEO, len(chunk))
+
+                    # 段可能在下载途中被别的连接切走后半截
+                    room = seg.end - seg.cursor
+                    if room <= 0:
+                        break
+
+                    if len(chunk) > room:
+                        chunk = chunk[:room]
+
+                    # 写盘放到线程里，不卡事件循环（qasync 下就是界面线程）；写完才推进游标，
+                    # 边下边看读到的一定是已经写下去的数据
+                    await asyncio.to_thread(file.write, chunk)
+
+                    # 写的时候段可能被切走一截，那部分由接手的连接负责，这里只算自己的
+                    written = min(len(chunk), max(0, seg.end - seg.cursor))
+                    seg.cursor += written
+                    self._done += written
+                    self._connBytes[connId] += written
+                    self._progress.addBytes(written, f"{self._intro}#{connId}")
+                    self._signalAdvance()
+
+                    if seg.cursor >= seg.end:
+                        break
+
+                    sampleBytes += len(chunk)
+                    elapsed = time.monotonic() - sampleStart
+                    if elapsed < MIRROR_SAMPLE_INTERVAL:
+                        continue
+
+                    speed = sampleBytes / elapsed
+                    self._mirrors.record(mirror, speed)
+                    sampleStart, sampleBytes = time.monotonic(), 0
+
+                    # 剩下的部分留在段里，由 worker 重新领取时换到更快的镜像
+                    if self._mirrors.shouldLeave(mirror, speed):
+                        print(f"{self._intro} - 连接{connId}所在镜像变慢，换镜像继续")
+                        break
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self._mirrors.fail(mirror)
+
+            raise
+        finally:
+            mirror.active -= 1
+
+    def _canGrow(self) -> bool:
+        if len(self._aliveWorkers()) >= self._maxConns:
+            return False
+
+        return any(seg.remaining() >= MIN_SPLIT_SIZE * 2 for seg in self._segments)
+
+    async def _tune(self):
+        lastDone = self._done
+        lastTick = time.monotonic()
+        savedDone, savedAt = self._done, lastTick
+        # 上一个连接数下测得的吞吐
+        baseSpeed = 0.0
+        saturated = False
+
+        while True:
+            await asyncio.sleep(TUNE_INTERVAL)
+
+            now = time.monotonic()
+            speed = (self._done - lastDone) / max(now - lastTick, 1e-6)
+            lastDone, lastTick = self._done, now
+
+            conns = len(self._aliveWorkers())
+
+            # 顺便把进度刷到清单里；隔一阵或攒够一批才写，意外退出时最多重下这一部分
+            if (
+                now - savedAt >= MANIFEST_SAVE_INTERVAL
+                or self._done - savedDone >= MANIFEST_SAVE_BYTES
+            ):
+                savedDone, savedAt = self._done, now
+                await self._manifest.saveInBackground(
+                    self._total, self._completedRanges(), list(self._connFiles.values())
+                )
+
+            if saturated or not self._canGrow():
+                continue
+
+            # 加连接后吞吐不再明显上涨，说明已经跑满带宽，不再继续加
+            if baseSpeed > 0 and speed < baseSpeed * TUNE_GAIN_RATIO:
+                saturated = True
+                continue
+
+            baseSpeed = speed
+            self._spawnWorkers(min(max(1, conns // 2), self._maxConns - conns))
+
+    async def _downloadSingle(self) -> int:
+        url = self._mirrors.pick().url
+
+        async with (
+            downScheduler.hostSlot(url),
+            self._session.get(url) as resp,
+        ):
+            resp.raise_for_status()
+
+            self._total = resp.content_length or 0
+            self._progress.addTotal(self._total)
+            self._single = True
+
+            # 单连接从头重下，之前留下的清单已经对不上了；下完后再写一份，标明文件是完整的
+            self._manifest.clear()
+
+            with open(self._out, "wb") as file:
+                self._connFiles[0] = file
+                self.ready.set()
+
+                try:
+                    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                        await downScheduler.checkpoint()
+                        await bwLimiter.acquire(CLASS_VIDEO, len(chunk))
+                        self._done += await asyncio.to_thread(file.write, chunk)
+                        self._progress.addBytes(len(chunk), f"{self._intro}#0")
+                        self._signalAdvance()
+                finally:
+                    del self._connFiles[0]
+
+        if self._total and self._done != self._total:
+            raise IOError(f"{self._out} 下载不完整 [{self._done} / {self._total}]")
+
+        self._manifest.save(self._done, [(0, self._done)])
+
+        return self._done
+
+
+async def _fetchBlock(
+    session: aiohttp.ClientSession,
+    mirrors: mirrorPool,
+    start: int,
+    end: int,
+    progress: download_progress.progressTracker,
+    conn: str,
+) -> bytes:
+    buffer = bytearray()
+    failures = 0
+
+    while True:
+        # 块不大，中途不换镜像，每次（重新）请求时挑当前最好的
+        mirror = mirrors.pick()
+        headers = {"Range": f"bytes={start + len(buffer)}-{end - 1}"}
+        mirror.active += 1
+
+        try:
+            begin = time.monotonic()
+            received = len(buffer)
+
+            async with (
+                downScheduler.hostSlot(mirror.url),
+                session.get(mirror.url, headers=headers) as resp,
+            ):
+                resp.raise_for_status()
+
+                if resp.status != 206:
+                    raise aiohttp.ClientPayloadError(
+                        f"{mirror.url} 不再返回分段内容，状态码：{resp.status}"
+                    )
+
+                async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                    await downScheduler.checkpoint()
+                    await bwLimiter.acquire(CLASS_VIDEO, len(chunk))
+                    chunk = chunk[: end - start - len(buffer)]
+                    buffer += chunk
+                    progress.addBytes(len(chunk), conn)
+
+            mirrors.record(
+                mirror, (len(buffer) - received) / max(time.monotonic() - begin, 1e-6)
+            )
+
+            if start + len(buffer) >= end:
+                return bytes(buffer)
+
+            raise aiohttp.ClientPayloadError(f"{mirror.url} 分段提前结束")
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            mirrors.fail(mirror)
+
+            failures += 1
+            if failures > MAX_RETRIES:
+                raise
+
+            await asyncio.sleep(retryDelay(failures))
+        finally:
+            mirror.active -= 1
+
+
+async def streamInOrder(
+    url: str,
+    connections: Optional[int] = None,
+    mirrors: Optional[list[str]] = None,
+    byteRange: Optional[tuple[int, int]] = None,
+) -> AsyncIterator[bytes]:
+    """
+    按顺序产出整个流的数据，但底层仍用多个 Range 请求并发预取后面的块，
+    适合直接喂给管道，内存里最多只压着一个窗口的数据。
+    给了 byteRange=(起点, 终点不含) 时只产出这一段
+    """
+    window = max(1, connections or conf.userConf.getDownloadConnections())
+    progress = download_progress.current()
+    streamName = pathlib.PurePosixPath(urllib.parse.urlparse(url).path).name
+    pool = mirrorPool([url] + (mirrors or []))
+
+    async with newSession() as session:
+        try:
+            total = await pool.probe(session)
+        except BaseException:
+            pool.close()
+
+            raise
+
+        if total is None and byteRange is not None:
+            pool.close()
+
+            raise IOError(f"{streamName} 不支持分段请求，没法只下载一部分")
+
+        if total is None:
+            pool.close()
+            url = pool.pick().url
+
+            async with (
+                downScheduler.hostSlot(url),
+                session.get(url) as resp,
+            ):
+                resp.raise_for_status()
+                progress.addTotal(resp.content_length or 0)
+
+                async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                    await downScheduler.checkpoint()
+                    await bwLimiter.acquire(CLASS_VIDEO, len(chunk))
+                    progress.addBytes(len(chunk), f"{streamName}#0")
+                    yield chunk
+
+            return
+
+        first, last = byteRange or (0, total)
+        last = min(last, total)
+        progress.addTotal(max(0, last - first))
+
+        blocks = (
+            (start, min(start + STREAM_BLOCK_SIZE, last))
+            for start in range(first, last, STREAM_BLOCK_SIZE)
+        )
+        inflight: deque[asyncio.Task] = deque()
+
+        try:
+            while True:
+                for start, end in blocks:
+                    # 同一时刻最多 window 个块在途，按槽位统计每条连接的速度
+                    conn = f"{streamName}#{(start - first) // STREAM_BLOCK_SIZE % window}"
+                    inflight.append(
+                        asyncio.create_task(
+                            _fetchBlock(session, pool, start, end, progress, conn)
+                        )
+                    )
+                    if len(inflight) >= window:
+                        break
+
+                if not inflight:
+                    break
+
+                yield await inflight.popleft()
+        finally:
+            pool.close()
+
+            for task in inflight:
+                task.cancel()
+
+            await asyncio.gather(*inflight, return_exceptions=True)
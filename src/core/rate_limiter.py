@@ -0,0 +1,141 @@
+import asyncio, time
+
+from utils import config_loader as conf
+
+# 流量类别，数字越小优先级越高
+CLASS_LIVE = "live"
+CLASS_IMAGE = "image"
+CLASS_VIDEO = "video"
+CLASS_PRIORITY = {CLASS_LIVE: 0, CLASS_IMAGE: 1, CLASS_VIDEO: 2}
+
+# 最近这么多秒内有过直播流量，就认为直播正在进行，给它预留带宽
+LIVE_ACTIVE_WINDOW = 60.0
+# 令牌桶最多攒多少秒的令牌，决定允许的突发量
+BURST_SECONDS = 0.5
+
+
+class tokenBucket:
+    def __init__(self, rate: float):
+        # rate: 字节/秒，0 表示不限速
+        self._rate = rate
+        self._tokens = rate * BURST_SECONDS
+        self._stamp = time.monotonic()
+
+    def setRate(self, rate: float):
+        self._refill()
+        self._rate = rate
+        self._tokens = min(self._tokens, self._capacity())
+
+    def rate(self) -> float:
+        return self._rate
+
+    def _capacity(self) -> float:
+        return self._rate * BURST_SECONDS
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self._capacity(), self._tokens + (now - self._stamp) * self._rate
+        )
+        self._stamp = now
+
+    def take(self, nbytes: int) -> float:
+        # 扣除令牌（允许欠账），返回需要等待多久才能把欠账补上
+        if self._rate <= 0:
+            return 0.0
+
+        self._refill()
+        self._tokens -= nbytes
+
+        return 0.0 if self._tokens >= 0 else -self._tokens / self._rate
+
+
+class bandwidthLimiter:
+    """
+    全局带宽限制：视频、表情包、封面下载每读一块数据都要从这里取令牌。
+    直播弹幕和语音合成的流量只记账不限速，直播进行时从总量里给它预留一部分，
+    剩下的再按优先级分给图片和视频
+    """
+
+    def __init__(self):
+        # 配置里的单位是 KB/s
+        self._limit = conf.userConf.getBandwidthLimit() * 1024
+        self._liveReserve = conf.userConf.getBandwidthLiveReserve() * 1024
+        self._lastLive = float("-inf")
+        # 当前的速率是否已经扣掉了直播预留
+        self._reserving = False
+        # 正在运行的直播连接数，弹幕监听开着就一直预留
+        self._liveSessions = 0
+
+        self._buckets = {
+            CLASS_IMAGE: tokenBucket(0),
+            CLASS_VIDEO: tokenBucket(0),
+        }
+        self._applyRates()
+
+    def setLimits(self, limit: int, liveReserve: int):
+        # 单位：字节/秒，设置页修改后立即生效
+        self._limit = max(0, limit)
+        self._liveReserve = max(0, liveReserve)
+
+        self._applyRates()
+
+    def _liveActive(self) -> bool:
+        return (
+            self._liveSessions > 0
+            or time.monotonic() - self._lastLive < LIVE_ACTIVE_WINDOW
+        )
+
+    def liveStarted(self):
+        self._liveSessions += 1
+        self._applyRates()
+
+    def liveStopped(self):
+        self._liveSessions = max(0, self._liveSessions - 1)
+        self._applyRates()
+
+    def _applyRates(self):
+        available = self._limit
+        self._reserving = self._liveActive()
+
+        if available > 0 and self._reserving:
+            # 至少给批量下载留一成，避免被饿死
+            available = max(available - self._liveReserve, available // 10)
+
+        # 两个桶的速率相同，但图片的消耗也会记到视频桶上，所以视频只能用图片剩下的
+        self._buckets[CLASS_IMAGE].setRate(available)
+        self._buckets[CLASS_VIDEO].setRate(available)
+
+    def record(self, trafficClass: str, nbytes: int):
+        # 直播类流量不等待，只用来判断直播是否活跃
+        if trafficClass == CLASS_LIVE:
+            self._lastLive = time.monotonic()
+
+            if not self._reserving:
+                self._applyRates()
+
+    async def acquire(self, trafficClass: str, nbytes: int):
+        if trafficClass == CLASS_LIVE:
+            self.record(trafficClass, nbytes)
+
+            return
+
+        if self._limit <= 0:
+            return
+
+        # 直播结束后把预留的带宽还回来
+        if self._reserving and not self._liveActive():
+            self._applyRates()
+
+        delay = self._buckets[trafficClass].take(nbytes)
+
+        # 优先级高的类别消耗的令牌也要从低优先级类别里扣掉
+        for otherClass, bucket in self._buckets.items():
+            if CLASS_PRIORITY[otherClass] > CLASS_PRIORITY[trafficClass]:
+                bucket.take(nbytes)
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+bwLimiter = bandwidthLimiter()
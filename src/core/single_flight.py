@@ -0,0 +1,38 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class singleFlight:
+    """
+    同一个 key 的并发请求共享一次调用。调用在自己的任务里跑，每个等待者隔着 shield 等它，
+    某个等待者被取消只影响它自己；所有等待者都走了，调用才跟着取消
+    """
+
+    def __init__(self):
+        # key -> [调用任务, 等待者数]
+        self._flights: dict[Hashable, list] = {}
+
+    async def do(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        flight = self._flights.get(key)
+        if flight is None:
+            task = asyncio.ensure_future(fetch())
+            flight = self._flights[key] = [task, 0]
+            task.add_done_callback(lambda _: self._forget(key, task))
+
+        task = flight[0]
+        flight[1] += 1
+
+        try:
+            return await asyncio.shield(task)
+        finally:
+            flight[1] -= 1
+
+            if flight[1] == 0 and not task.done():
+                # 没人要结果了；先摘掉，之后来的请求重新发起，不会拿到这个被取消的任务
+                self._forget(key, task)
+                task.cancel()
+
+    def _forget(self, key: Hashable, task: asyncio.Future):
+        flight = self._flights.get(key)
+        if flight is not None and flight[0] is task:
+            del self._flights[key]
@@ -0,0 +1,221 @@
+from dataclasses import dataclass, field
+from typing import Optional
+import bilibili_api as bapi
+
+from utils import config_loader as conf
+
+MODE_BEST = "best"
+# 同样的分辨率下挑体积最小的编码
+MODE_SMALLEST = "smallest"
+# 只下音频，跳过视频流
+MODE_AUDIO = "audio"
+MODES = (MODE_BEST, MODE_SMALLEST, MODE_AUDIO)
+
+# dash 数据里 codecid 对应的编码名，配置里 codecs 也用这套写法
+CODEC_NAMES = {7: "avc", 12: "hev", 13: "av01"}
+ALL_CODECS = ("avc", "hev", "av01")
+
+VIDEO_NAME = "video.mp4"
+AUDIO_NAME = "audio.m4a"
+
+
+def playData(downloadData: dict) -> dict:
+    return downloadData.get("video_info", downloadData)
+
+
+def entryUrl(entry: dict) -> str:
+    return entry.get("base_url") or entry.get("baseUrl") or ""
+
+
+def videoEntries(data: dict) -> list[dict]:
+    return list((data.get("dash") or {}).get("video") or [])
+
+
+def audioEntries(data: dict) -> list[dict]:
+    # 普通音轨在前，杜比和无损放在后面
+    dash = data.get("dash") or {}
+    entries = list(dash.get("audio") or [])
+
+    for extra in ("dolby", "flac"):
+        audio = (dash.get(extra) or {}).get("audio")
+        if isinstance(audio, list):
+            entries += audio
+        elif isinstance(audio, dict):
+            entries.append(audio)
+
+    return entries
+
+
+def findEntry(downloadData: dict, url: str) -> Optional[dict]:
+    data = playData(downloadData)
+
+    for entry in videoEntries(data) + audioEntries(data):
+        if entryUrl(entry) == url:
+            return entry
+
+    return None
+
+
+def durationOf(data: dict) -> float:
+    dash = data.get("dash") or {}
+    if dash.get("duration"):
+        return float(dash["duration"])
+
+    # timelength 的单位是毫秒
+    return data.get("timelength", 0) / 1000
+
+
+def entryBytes(entry: Optional[dict], duration: float) -> int:
+    # bandwidth 是平均码率（bit/s），估出来和实际大小一般差不到一成
+    if entry is None:
+        return 0
+
+    return int(entry.get("bandwidth", 0) * duration / 8)
+
+
+@dataclass
+class streamChoice:
+    # [视频, 音频]，没有的一路为 None；FLV/MP4 流只有一个元素
+    streams: list
+    estimatedBytes: int
+    flv: bool = False
+    audioOnly: bool = False
+    # 选中的原始 dash 条目，用来显示说明
+    entries: list[dict] = field(default_factory=list)
+
+    def outputName(self) -> str:
+        return AUDIO_NAME if self.audioOnly else VIDEO_NAME
+
+    def describe(self) -> str:
+        if self.flv:
+            return "FLV 音视频流"
+
+        parts = []
+        for entry in self.entries:
+            if entry.get("height"):
+                codec = CODEC_NAMES.get(entry.get("codecid"), "?")
+                parts.append(f"{entry['height']}p {codec}")
+            else:
+                parts.append(f"音频 {entry.get('bandwidth', 0) // 1000}kbps")
+
+        return " + ".join(parts) or "未知流"
+
+
+@dataclass
+class streamPolicy:
+    """
+    按体积挑流：分辨率/码率设上限，同分辨率下可以优先选更小的编码，
+    也可以只下音频。默认和以前一样直接取画质最高的流
+    """
+
+    mode: str = MODE_BEST
+    # 0 表示不限
+    maxHeight: int = 0
+    maxKbps: int = 0
+    codecs: tuple[str, ...] = ALL_CODECS
+
+    @classmethod
+    def fromConfig(cls) -> "streamPolicy":
+        return cls(
+            conf.userConf.getDownloadStreamMode(),
+            conf.userConf.getDownloadMaxHeight(),
+            conf.userConf.getDownloadMaxKbps(),
+            tuple(conf.userConf.getDownloadCodecs()),
+        )
+
+    def outputName(self) -> str:
+        return AUDIO_NAME if self.mode == MODE_AUDIO else VIDEO_NAME
+
+    def _unrestricted(self) -> bool:
+        return (
+            self.mode == MODE_BEST
+            and not self.maxHeight
+            and not self.maxKbps
+            and set(ALL_CODECS) <= set(self.codecs)
+        )
+
+    def _withinCaps(self, entry: dict) -> bool:
+        if self.maxHeight and entry.get("height", 0) > self.maxHeight:
+            return False
+        if self.maxKbps and entry.get("bandwidth", 0) > self.maxKbps * 1000:
+            return False
+
+        return True
+
+    def _pickVideo(self, entries: list[dict]) -> Optional[dict]:
+        allowed = [e for e in entries if CODEC_NAMES.get(e.get("codecid")) in self.codecs]
+        # 允许的编码一个都没有时不挑编码，总比下不了强
+        allowed = allowed or entries
+        if not allowed:
+            return None
+
+        capped = [e for e in allowed if self._withinCaps(e)]
+        if not capped:
+            # 上限定得比最低画质还低，退到最省的那条
+            return min(allowed, key=lambda e: e.get("bandwidth", 0))
+
+        top = max(e["id"] for e in capped)
+        same = [e for e in capped if e["id"] == top]
+
+        if self.mode == MODE_SMALLEST:
+            return min(same, key=lambda e: e.get("bandwidth", 0))
+
+        return max(same, key=lambda e: e.get("bandwidth", 0))
+
+    def _pickAudio(self, entries: list[dict]) -> Optional[dict]:
+        if not entries:
+            return None
+
+        # 只下音频时码率上限对音轨生效
+        if self.mode == MODE_AUDIO and self.maxKbps:
+            capped = [e for e in entries if e.get("bandwidth", 0) <= self.maxKbps * 1000]
+            if not capped:
+                return min(entries, key=lambda e: e.get("bandwidth", 0))
+
+            entries = capped
+
+        return max(entries, key=lambda e: e.get("bandwidth", 0))
+
+    def choose(self, downloadData: dict) -> streamChoice:
+        data = playData(downloadData)
+        detecter = bapi.video.VideoDownloadURLDataDetecter(data=downloadData)
+
+        if detecter.check_flv_mp4_stream():
+            # FLV/MP4 是音视频合在一起的整文件，没得挑，大小接口直接给了
+            size = sum(durl.get("size", 0) for durl in data.get("durl") or [])
+
+            return streamChoice(detecter.detect_best_streams(), size, flv=True)
+
+        duration = durationOf(data)
+        videos, audios = videoEntries(data), audioEntries(data)
+        byUrl = {entryUrl(e): e for e in videos + audios}
+
+        if self._unrestricted():
+            streams = detecter.detect_best_streams()
+            entries = [byUrl.get(s.url) for s in streams if s is not None]
+            entries = [e for e in entries if e is not None]
+
+            return streamChoice(
+                streams, sum(entryBytes(e, duration) for e in entries), entries=entries
+            )
+
+        # 流对象还是交给库来构造，这里只按原始条目决定要哪几路
+        objects = {s.url: s for s in detecter.detect_all()}
+        videos = [e for e in videos if entryUrl(e) in objects]
+        # 自己挑音轨时只用普通 AAC，杜比和无损体积大、也混不进内置混流器
+        audios = [e for e in (data.get("dash") or {}).get("audio") or [] if entryUrl(e) in objects]
+
+        audio = self._pickAudio(audios)
+        audioOnly = self.mode == MODE_AUDIO and audio is not None
+        if self.mode == MODE_AUDIO and audio is None:
+            print("这一P没有音频流，改为下载视频")
+
+        video = None if audioOnly else self._pickVideo(videos)
+        entries = [e for e in (video, audio) if e is not None]
+
+        return streamChoice(
+            [objects[entryUrl(e)] if e else None for e in (video, audio)],
+            sum(entryBytes(e, duration) for e in entries),
+            audioOnly=audioOnly,
+            entries=entries,
+        )
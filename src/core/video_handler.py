@@ -1,108 +1,768 @@
 import asyncio, pathlib, aiohttp, aiofiles, os
+from dataclasses import dataclass, asdict
+from typing import Awaitable, Callable, Optional
 import bilibili_api as bapi
 
 from utils import config_loader as conf
+from utils import ffmpeg_helper
+from core import range_downloader, mp4_remux, bili_cache, download_progress
+from core import danmaku_exporter, stream_policy, dash_clip
+from core.download_scheduler import downScheduler
+from core.content_store import objStore
+from core.download_journal import dlJournal
+from core.preview_server import previewSrv
+from core import download_journal
 
+# 单个分P下载失败后，重新获取地址续传的次数与退避基数（秒）
+PAGE_RETRIES = 3
+PAGE_RETRY_BACKOFF = 2
+# 流水线里同时取地址的协程数
+RESOLVE_WORKERS = 2
+# 同时混流的协程数，混流主要是磁盘读写，多了反而互相抢
+MUX_WORKERS = 1
+# 启动时同时恢复的任务数
+RESUME_JOBS = 2
 
-def getVideo(bvid: str) -> bapi.video.Video:
-    credi = bapi.Credential(
+
+def getCredential() -> bapi.Credential:
+    return bapi.Credential(
         conf.userConf.getSessData(),
         conf.userConf.getBiliJct(),
         conf.userConf.getBuvid3(),
     )
 
-    return bapi.video.Video(bvid=bvid, credential=credi)
+
+def getVideo(bvid: str) -> bapi.video.Video:
+    return bapi.video.Video(bvid=bvid, credential=getCredential())
 
 
 async def getPageCount(vido: bapi.video.Video) -> int:
-    return len(await vido.get_pages())
+    return len(await bili_cache.metaCache.getPages(vido))
 
 
-async def downloadVideoAss(vido: bapi.video.Video, folder: str) -> None:
-    assRootPath = pathlib.Path(folder)
+async def downloadVideoAss(
+    vido: bapi.video.Video, folder: pathlib.Path
+) -> list[danmaku_exporter.pageExport]:
+    # 弹幕写到各分P的目录里，和 video.mp4 同名
+    return await danmaku_exporter.submitExport(vido, folder.resolve()).wait()
 
-    if not assRootPath.exists():
-        assRootPath.mkdir(parents=True, exist_ok=True)
 
-    assTasks = [
-        bapi.ass.make_ass_file_danmakus_protobuf(
-            obj=vido, page=pageIndex, out=f"./{folder}/{pageIndex}.ass"
-        )
-        for pageIndex in range(await getPageCount(vido))
-    ]
+def streamMirrors(downloadData: dict, url: str) -> list[str]:
+    # detecter 只给出主地址，从原始数据里把同一个流的备用镜像找回来
+    entry = stream_policy.findEntry(downloadData, url)
+    if entry is not None:
+        return entry.get("backup_url") or entry.get("backupUrl") or []
 
-    await asyncio.gather(*assTasks, return_exceptions=True)
+    for durl in stream_policy.playData(downloadData).get("durl") or []:
+        if durl.get("url") == url:
+            return durl.get("backup_url") or []
 
+    return []
+
+
+async def download(
+    url: str, out: str, intro: str, mirrors: Optional[list[str]] = None
+):
+    # 多连接分段下载，连接数根据实测吞吐自动调整，备用镜像参与测速和故障切换
+    await range_downloader.rangeDownloader(url, out, intro, mirrors=mirrors).run()
+
+
+def isPageFinished(
+    folderPath: pathlib.Path, name: str = stream_policy.VIDEO_NAME
+) -> bool:
+    # 成品已存在且没有残留的临时流，说明这一P上次已经完整下载并混流
+    if not (folderPath / name).exists():
+        return False
+
+    return not any(
+        (folderPath / name).exists()
+        for name in ("flv_temp.flv", "video_temp.m4s", "audio_temp.m4s")
+    )
+
+
+def pageOutputName(
+    policy: stream_policy.streamPolicy, jobId: Optional[int], pageIndex: int
+) -> str:
+    # 仅音频模式下没有音轨的分P会退回成视频，成品叫什么以上次下完时的记录为准
+    if jobId is not None:
+        recorded = dlJournal.pageOutput(jobId, pageIndex, policy.mode)
+        if recorded:
+            return recorded
+
+    return policy.outputName()
+
+
+def canRemuxInProcess(streams: list) -> bool:
+    # 杜比全景声和无损音轨不是 AAC，内置混流器处理不了
+    audio = streams[1] if len(streams) > 1 else None
+    if audio is None:
+        return True
+
+    return audio.audio_quality not in (
+        bapi.video.AudioQuality.DOLBY,
+        bapi.video.AudioQuality.HI_RES,
+    )
 
-async def download(url: str, out: str, intro: str):
-    dwn_id = await bapi.get_client().download_create(url, bapi.HEADERS)
-    bts = 0
-    tot = bapi.get_client().download_content_length(dwn_id)
-    with open(out, "wb") as file:
-        while True:
-            bts += file.write(await bapi.get_client().download_chunk(dwn_id))
-            print(f"{intro} - {out} [{bts} / {tot}]", end="\r")
-            if bts == tot:
-                break
 
+def streamKey(cid: int, streams: list) -> str:
+    # 同一个分P、同样的画质/编码/音质，下载出来的成品就是同一份内容
+    parts = [f"cid{cid}"]
+    for stream in streams:
+        if stream is None:
+            continue
 
-async def downloadOneVideo(downloadData: dict, folderPath: pathlib.Path) -> None:
+        if hasattr(stream, "video_quality"):
+            parts.append(f"v{stream.video_quality.value}-{stream.video_codecs.value}")
+        else:
+            parts.append(f"a{stream.audio_quality.value}")
+
+    return "video:" + ":".join(parts)
+
+
+async def muxStreams(
+    inputs: list[str], out: str, rebase: bool = False
+) -> Optional[tuple[str, int]]:
+    # 常见的 H.264/HEVC/AV1 + AAC 直接在进程内按 box 合并，遇到不认识的编码再交给 ffmpeg
+    # 内置混流返回写出时算好的 (sha256, 字节数)，ffmpeg 写的文件没有，返回 None
+    try:
+        return await mp4_remux.remux(inputs, out, rebase)
+    except mp4_remux.remuxError as e:
+        if not ffmpeg_helper.isAvailable():
+            raise
+
+        print(f"内置混流不支持，改用ffmpeg：{e}")
+
+    await ffmpeg_helper.remux(inputs, out)
+
+    return None
+
+
+@dataclass
+class muxPlan:
+    # 传输阶段留给混流阶段的东西
+    inputs: list[str]
+    out: str
+    flv: bool = False
+    # 本地仓库里的身份，内置混流写完后按它收录
+    key: Optional[str] = None
+    # 边下边看时发布的预览，混流前撤掉
+    preview: str = ""
+
+
+async def publishPreview(
+    files: dict[str, str],
+    folder: str,
+    choice: stream_policy.streamChoice,
+    downloadData: dict,
+    cid: int,
+) -> str:
+    # 以进度里的键命名预览地址，不在任务里时退回 cid
+    key = download_progress.current().key or str(cid)
+    url = await previewSrv.publish(
+        key,
+        folder,
+        files,
+        None if choice.flv else choice,
+        stream_policy.durationOf(stream_policy.playData(downloadData)),
+    )
+    print(f"边下边看：{url}")
+
+    return key
+
+
+async def transferPage(
+    downloadData: dict,
+    folderPath: pathlib.Path,
+    cid: int = 0,
+    policy: Optional[stream_policy.streamPolicy] = None,
+) -> Optional[muxPlan]:
+    # 把一P的音视频流下载到临时文件，返回待混流的计划；已经直接得到成品时返回 None
     if not folderPath.exists():
         folderPath.mkdir(parents=True, exist_ok=True)
 
+    policy = policy or stream_policy.streamPolicy.fromConfig()
+    choice = policy.choose(downloadData)
+    streams = choice.streams
+    print(f"选择 {choice.describe()}，预计 {choice.estimatedBytes / 1048576:.1f} MB")
+
     folder = str(folderPath)
+    out = f"{folder}/{choice.outputName()}"
+
+    progress = download_progress.current()
 
-    detecter = bapi.video.VideoDownloadURLDataDetecter(data=downloadData)
-    streams = detecter.detect_best_streams()
     # 有 MP4 流 / FLV 流两种可能
-    if detecter.check_flv_mp4_stream():
+    if choice.flv:
+        preview = ""
+        if previewSrv.enabled():
+            preview = await publishPreview(
+                {"video.flv": f"{folder}/flv_temp.flv"}, folder, choice, downloadData, cid
+            )
+
         # FLV 流下载
-        await download(streams[0].url, f"{folder}/flv_temp.flv", "下载 FLV 音视频流")
-        # 转换文件格式
-        os.system(
-            f"{conf.userConf.getFfmpeg()} -i {folder}/flv_temp.flv {folder}/video.mp4"
+        with progress.phase("cdn"):
+            await download(
+                streams[0].url,
+                f"{folder}/flv_temp.flv",
+                "下载 FLV 音视频流",
+                streamMirrors(downloadData, streams[0].url),
+            )
+
+        return muxPlan([f"{folder}/flv_temp.flv"], out, flv=True, preview=preview)
+
+    # 别的目录里下过同一份流时直接链接过来
+    key = streamKey(cid, streams) if cid else None
+    if key and await objStore.materialize(key, pathlib.Path(out)):
+        objStore.flush()
+        print(f"本地已有相同内容，已链接为：{out}")
+
+        return None
+
+    tempPaths = [f"{folder}/video_temp.m4s", f"{folder}/audio_temp.m4s"]
+    intros = ["下载视频流", "下载音频流"]
+    # 没有音轨（或没有画面）的流会是 None，按位置配对后再过滤
+    parts = [
+        (stream.url, tempPath, intro)
+        for stream, tempPath, intro in zip(streams, tempPaths, intros)
+        if stream is not None
+    ]
+    # 上次留下了可续传的临时流时，继续走落盘下载把它补完
+    hasPartial = any(
+        range_downloader.manifestPath(tempPath).exists() for tempPath in tempPaths
+    )
+
+    if (
+        not canRemuxInProcess(streams)
+        and conf.userConf.getDownloadPipeMux()
+        and ffmpeg_helper.isAvailable()
+        and ffmpeg_helper.canPipe()
+        and not hasPartial
+        # 边下边看要从临时文件里读
+        and not previewSrv.enabled()
+    ):
+        # 杜比、无损等特殊编码：边下边通过管道送进 ffmpeg 混流，不落临时文件
+        # 传输和混流在这里是重叠的，耗时都记在传输阶段
+        with progress.phase("cdn"):
+            await ffmpeg_helper.remuxStreams(
+                [
+                    range_downloader.streamInOrder(
+                        url, mirrors=streamMirrors(downloadData, url)
+                    )
+                    for url, _, _ in parts
+                ],
+                out,
+            )
+
+        print(f"已下载为：{out}")
+
+        return None
+
+    preview = ""
+    if previewSrv.enabled():
+        preview = await publishPreview(
+            {os.path.basename(tempPath).replace("_temp", ""): tempPath for _, tempPath, _ in parts},
+            folder,
+            choice,
+            downloadData,
+            cid,
         )
-        # 删除临时文件
-        os.remove(f"{folder}/flv_temp.flv")
+
+    # 音视频流同时下载，任一失败时另一路也会被取消，已下载部分留给续传
+    with progress.phase("cdn"):
+        async with asyncio.TaskGroup() as group:
+            for url, tempPath, intro in parts:
+                group.create_task(
+                    download(url, tempPath, intro, streamMirrors(downloadData, url))
+                )
+
+    return muxPlan(
+        [tempPath for _, tempPath, _ in parts], out, key=key, preview=preview
+    )
+
+
+async def muxPage(plan: muxPlan) -> None:
+    if plan.preview:
+        previewSrv.unpublish(plan.preview)
+
+    if plan.flv:
+        # 转换文件格式
+        await ffmpeg_helper.remux(plan.inputs, plan.out)
     else:
-        # MP4 流下载
-        await download(streams[0].url, f"{folder}/video_temp.m4s", "下载视频流")
-        await download(streams[1].url, f"{folder}/audio_temp.m4s", "下载音频流")
-        # 混流
-        os.system(
-            f"{conf.userConf.getFfmpeg()} -i {folder}/video_temp.m4s -i {folder}/audio_temp.m4s -vcodec copy -acodec copy {folder}/video.mp4"
+        written = await muxStreams(plan.inputs, plan.out)
+
+        if plan.key and written:
+            await objStore.ingest(plan.key, pathlib.Path(plan.out), *written)
+            objStore.flush()
+
+    # 删除临时文件和续传清单
+    for tempPath in plan.inputs:
+        range_downloader.discardPartial(tempPath)
+
+    print(f"已下载为：{plan.out}")
+
+
+async def downloadOneVideo(
+    downloadData: dict,
+    folderPath: pathlib.Path,
+    cid: int = 0,
+    policy: Optional[stream_policy.streamPolicy] = None,
+) -> None:
+    plan = await transferPage(downloadData, folderPath, cid, policy)
+
+    if plan is not None:
+        with download_progress.current().phase("mux"):
+            await muxPage(plan)
+
+
+async def transferClip(
+    downloadData: dict,
+    folderPath: pathlib.Path,
+    start: float,
+    end: float,
+    policy: Optional[stream_policy.streamPolicy] = None,
+) -> str:
+    """
+    只下载一P里 [start, end) 秒的片段：按 DASH 分片索引算出字节区间，
+    音视频各自只拉这一段，混流时把时间对齐到 0。返回成品路径
+    """
+    folderPath.mkdir(parents=True, exist_ok=True)
+
+    policy = policy or stream_policy.streamPolicy.fromConfig()
+    choice = policy.choose(downloadData)
+    if choice.flv:
+        raise dash_clip.clipError("FLV 流没有分片索引，没法只下载一段")
+
+    folder = str(folderPath)
+    suffix = pathlib.PurePath(choice.outputName()).suffix
+    out = f"{folder}/clip_{start:.0f}-{end:.0f}{suffix}"
+    progress = download_progress.current()
+
+    inputs = []
+    with progress.phase("cdn"):
+        async with asyncio.TaskGroup() as group:
+            for stream, name in zip(choice.streams, ["video", "audio"]):
+                if stream is None:
+                    continue
+
+                tempPath = f"{folder}/clip_{name}_temp.m4s"
+                inputs.append(tempPath)
+                group.create_task(
+                    dash_clip.downloadClip(
+                        stream.url,
+                        stream_policy.findEntry(downloadData, stream.url) or {},
+                        start,
+                        end,
+                        tempPath,
+                        streamMirrors(downloadData, stream.url),
+                    )
+                )
+
+    try:
+        with progress.phase("mux"):
+            await muxStreams(inputs, out, rebase=True)
+    finally:
+        for tempPath in inputs:
+            pathlib.Path(tempPath).unlink(missing_ok=True)
+
+    print(f"片段已下载为：{out}")
+
+    return out
+
+
+async def downloadVideoClip(
+    vido: bapi.video.Video,
+    folder: pathlib.Path,
+    pageIndex: int,
+    start: float,
+    end: float,
+    policy: Optional[stream_policy.streamPolicy] = None,
+) -> str:
+    # 片段一般很小，不走多P流水线，直接作为一个调度器任务
+    bvid = vido.get_bvid()
+    downloadData = await bili_cache.metaCache.getDownloadUrl(vido, pageIndex)
+    progress = download_progress.progHub.track(
+        f"{bvid}/{pageIndex}/clip", bvid, f"{bvid} P{pageIndex} 片段"
+    )
+
+    async def clipJob() -> str:
+        download_progress.bind(progress)
+
+        return await transferClip(
+            downloadData, folder / str(pageIndex), start, end, policy
+        )
+
+    try:
+        out = await downScheduler.submit(clipJob, f"{bvid} P{pageIndex} 片段").wait()
+    except BaseException:
+        progress.finish(download_progress.STATE_FAILED)
+
+        raise
+
+    progress.finish()
+
+    return out
+
+
+@dataclass
+class pageTask:
+    pageIndex: int
+    folderPath: pathlib.Path
+    progress: download_progress.progressTracker
+    attempt: int = 0
+    downloadData: Optional[dict] = None
+    cid: int = 0
+    plan: Optional[muxPlan] = None
+
+
+class pagePipeline:
+    """
+    多P下载流水线：取地址 → 传输 → 混流 → 收尾，阶段之间用有界队列衔接。
+    后面几P的地址在前面的P传输时就已经取好，混流在单独的协程里做，不占调度器的传输名额。
+    resolve(分P序号, 是否强制刷新) 返回 (下载信息, cid)
+    """
+
+    def __init__(
+        self,
+        group: str,
+        resolve: Callable[[int, bool], Awaitable[tuple[dict, int]]],
+        policy: Optional[stream_policy.streamPolicy] = None,
+        jobId: Optional[int] = None,
+    ):
+        self._group = group
+        self._resolve = resolve
+        # 任务记录里的编号，没有时不记录（比如基准测试）
+        self._jobId = jobId
+        # 整个任务用同一套选流规则，中途改设置不会让前后几P不一样
+        self._policy = policy or stream_policy.streamPolicy.fromConfig()
+
+        # 队列和传输名额一起限制地址最多提前取多少，取得太早会过期
+        depth = conf.userConf.getDownloadMaxJobs()
+        self._toResolve: asyncio.Queue[pageTask] = asyncio.Queue()
+        self._toTransfer: asyncio.Queue[pageTask] = asyncio.Queue(maxsize=depth)
+        self._toMux: asyncio.Queue[pageTask] = asyncio.Queue(maxsize=depth)
+        self._transferSlots = asyncio.Semaphore(depth)
+        self._transfers: set[asyncio.Task] = set()
+
+        self._pages: list[pageTask] = []
+        self._results: dict[int, Optional[BaseException]] = {}
+        self._unfinished = 0
+        self._allDone = asyncio.Event()
+
+    async def run(
+        self, pages: list[tuple[int, pathlib.Path]]
+    ) -> dict[int, Optional[BaseException]]:
+        # 返回每一P的结果，成功为 None，失败为异常
+        for pageIndex, folderPath in pages:
+            name = pageOutputName(self._policy, self._jobId, pageIndex)
+            if isPageFinished(folderPath, name):
+                print(f"已存在，跳过：{folderPath}/{name}")
+                self._results[pageIndex] = None
+                self._journal(
+                    pageIndex, download_journal.JOB_DONE, mode=self._policy.mode, output=name
+                )
+
+                continue
+
+            self._journal(pageIndex, download_journal.JOB_PENDING)
+
+            progress = download_progress.progHub.track(
+                f"{self._group}/{pageIndex}",
+                self._group,
+                f"{self._group} P{pageIndex}",
+                queued=True,
+            )
+            page = pageTask(pageIndex, folderPath, progress)
+            self._pages.append(page)
+            self._toResolve.put_nowait(page)
+
+        self._unfinished = len(self._pages)
+        if not self._pages:
+            return self._results
+
+        stages = [asyncio.create_task(self._resolver()) for _ in range(RESOLVE_WORKERS)]
+        stages.append(asyncio.create_task(self._dispatcher()))
+        stages += [asyncio.create_task(self._muxer()) for _ in range(MUX_WORKERS)]
+
+        try:
+            await self._allDone.wait()
+        finally:
+            tasks = stages + list(self._transfers)
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+            # 被取消时没走完的P都标记为失败，让界面能看到最终状态
+            for page in self._pages:
+                if page.progress.state not in download_progress.FINAL_STATES:
+                    page.progress.finish(download_progress.STATE_FAILED)
+
+        return self._results
+
+    def _journal(self, pageIndex: int, state: str, **fields):
+        if self._jobId is not None:
+            dlJournal.updatePage(self._jobId, pageIndex, state, **fields)
+
+    def _settle(self, page: pageTask, error: Optional[BaseException] = None):
+        page.progress.finish(
+            download_progress.STATE_FAILED if error else download_progress.STATE_DONE
+        )
+        self._results[page.pageIndex] = error
+
+        if error is not None:
+            # 混流成功时由 muxPage 撤下预览，失败的分P在这里撤
+            previewSrv.unpublish(page.progress.key)
+
+        # 记下实际选中的成品名，下次检查是否已下完时按它找
+        output = None
+        if error is None and page.downloadData is not None:
+            output = self._policy.choose(page.downloadData).outputName()
+
+        self._journal(
+            page.pageIndex,
+            download_journal.JOB_FAILED if error else download_journal.JOB_DONE,
+            cid=page.cid,
+            attempt=page.attempt,
+            error=str(error) if error else None,
+            mode=self._policy.mode if output else None,
+            output=output,
+        )
+
+        self._unfinished -= 1
+        if self._unfinished == 0:
+            self._allDone.set()
+
+    def _retry(self, page: pageTask, error: BaseException):
+        if page.attempt >= PAGE_RETRIES - 1:
+            self._settle(page, error)
+
+            return
+
+        delay = PAGE_RETRY_BACKOFF * 2**page.attempt
+        page.attempt += 1
+        page.progress.requeue()
+        self._journal(
+            page.pageIndex,
+            download_journal.JOB_PENDING,
+            cid=page.cid,
+            attempt=page.attempt,
+            error=str(error),
+        )
+        print(f"第{page.pageIndex}P下载失败，{delay}秒后重新获取地址续传：{error}")
+
+        # 退避期间不占用取地址的协程
+        asyncio.get_running_loop().call_later(delay, self._toResolve.put_nowait, page)
+
+    async def _resolver(self):
+        while True:
+            page = await self._toResolve.get()
+            # 重试时各个流会重新上报总量，先把上一轮的进度清掉
+            page.progress.restart()
+
+            try:
+                # 首次使用缓存里还没过期的地址，重试时强制重新获取，已下载的部分靠清单续传
+                with page.progress.phase("api"):
+                    page.downloadData, page.cid = await self._resolve(
+                        page.pageIndex, page.attempt > 0
+                    )
+            except Exception as e:
+                self._retry(page, e)
+
+                continue
+
+            self._journal(
+                page.pageIndex,
+                download_journal.JOB_RUNNING,
+                cid=page.cid,
+                attempt=page.attempt,
+            )
+            await self._toTransfer.put(page)
+
+    async def _dispatcher(self):
+        while True:
+            await self._transferSlots.acquire()
+            page = await self._toTransfer.get()
+
+            task = asyncio.create_task(self._transferOne(page))
+            self._transfers.add(task)
+            task.add_done_callback(self._transfers.discard)
+
+    async def _transfer(self, page: pageTask) -> Optional[muxPlan]:
+        # 在调度器的任务里运行，进度要在任务自己的上下文里绑定
+        download_progress.bind(page.progress)
+        page.progress.begin()
+        if self._jobId is not None:
+            download_journal.bindPage(self._jobId, page.pageIndex)
+
+        return await transferPage(
+            page.downloadData, page.folderPath, page.cid, self._policy
         )
-        # 删除临时文件
-        os.remove(f"{folder}/video_temp.m4s")
-        os.remove(f"{folder}/audio_temp.m4s")
 
-    print(f"已下载为：{folder}/video.mp4")
+    async def _transferOne(self, page: pageTask):
+        try:
+            job = downScheduler.submit(
+                lambda: self._transfer(page), f"{self._group} P{page.pageIndex}"
+            )
+
+            try:
+                page.plan = await job.wait()
+            except asyncio.CancelledError as e:
+                # 整条流水线被取消时连带取消调度器里的任务，单独被用户取消的只算这一P失败
+                if asyncio.current_task().cancelling():
+                    job.cancel()
+
+                    raise
+
+                self._settle(page, e)
+
+                return
+            except Exception as e:
+                self._retry(page, e)
+
+                return
+
+            if page.plan is None:
+                self._settle(page)
+
+                return
+
+            # 混流跟不上时在这里等着，传输名额也一直占着，背压传回取地址阶段
+            await self._toMux.put(page)
+        finally:
+            self._transferSlots.release()
+
+    async def _muxer(self):
+        while True:
+            page = await self._toMux.get()
+            download_progress.bind(page.progress)
+
+            try:
+                with page.progress.phase("mux"):
+                    await muxPage(page.plan)
+            except Exception as e:
+                # 临时流已经完整，重下一遍也还是混不了，不再重试
+                self._settle(page, e)
+            else:
+                self._settle(page)
+
+
+async def estimateDownload(
+    vido: bapi.video.Video,
+    folder: pathlib.Path,
+    policy: Optional[stream_policy.streamPolicy] = None,
+) -> int:
+    """
+    按选流规则估算还没下完的分P一共要下多少字节。
+    取到的地址会留在缓存里，紧接着开始下载时不用再请求一遍
+    """
+    policy = policy or stream_policy.streamPolicy.fromConfig()
+    pages = await bili_cache.metaCache.getPages(vido)
+    limit = asyncio.Semaphore(RESOLVE_WORKERS)
+
+    jobId = dlJournal.findJob(vido.get_bvid(), str(folder.resolve()))
+
+    async def estimateOne(pageIndex: int) -> int:
+        if isPageFinished(folder / str(pageIndex), pageOutputName(policy, jobId, pageIndex)):
+            return 0
+
+        async with limit:
+            downloadData = await bili_cache.metaCache.getDownloadUrl(vido, pageIndex)
 
+        return policy.choose(downloadData).estimatedBytes
 
-async def downloadVideos(vido: bapi.video.Video, folder: pathlib.Path) -> None:
+    return sum(await asyncio.gather(*(estimateOne(i) for i in range(len(pages)))))
+
+
+async def downloadVideos(
+    vido: bapi.video.Video,
+    folder: pathlib.Path,
+    policy: Optional[stream_policy.streamPolicy] = None,
+) -> dict[int, Optional[BaseException]]:
+    # 返回每一P的结果，成功为 None
     if not folder.exists():
         folder.mkdir(parents=True, exist_ok=True)
 
-    vidoTasks = [
-        downloadOneVideo(
-            await vido.get_download_url(pageIndex), folder / str(pageIndex)
+    policy = policy or stream_policy.streamPolicy.fromConfig()
+    # 先记下任务再开始，中途退出下次启动能接着下
+    jobId = dlJournal.openJob(vido.get_bvid(), str(folder.resolve()), asdict(policy))
+
+    try:
+        pages = await bili_cache.metaCache.getPages(vido)
+    except asyncio.CancelledError:
+        dlJournal.cancelJob(jobId)
+
+        raise
+    except Exception as e:
+        dlJournal.finishJob(jobId, str(e))
+
+        raise
+
+    async def resolve(pageIndex: int, fresh: bool) -> tuple[dict, int]:
+        downloadData = await bili_cache.metaCache.getDownloadUrl(
+            vido, pageIndex, fresh=fresh
         )
-        for pageIndex in range(await getPageCount(vido))
-    ]
 
-    await asyncio.gather(*vidoTasks, return_exceptions=True)
+        return downloadData, pages[pageIndex]["cid"]
+
+    try:
+        results = await pagePipeline(vido.get_bvid(), resolve, policy, jobId).run(
+            [(pageIndex, folder / str(pageIndex)) for pageIndex in range(len(pages))]
+        )
+    except asyncio.CancelledError:
+        # 主动取消的任务记为已取消；退出程序打断的保持进行中，下次启动时恢复
+        dlJournal.cancelJob(jobId)
+
+        raise
 
+    failed = []
+    for pageIndex, error in sorted(results.items()):
+        if error is not None:
+            print(f"第{pageIndex}P下载失败：{error}")
+            failed.append(pageIndex)
 
-async def downloadVideosV2(vido: bapi.video.Video, folder: pathlib.Path) -> None:
-    if conf.userConf.getFfmpeg() == "" or not pathlib.Path(conf.userConf.getFfmpeg()).exists():
-        print("没找到ffmpeg~")
+    dlJournal.finishJob(jobId, f"分P {failed} 下载失败" if failed else None)
 
+    return results
+
+
+async def downloadVideosV2(
+    vido: bapi.video.Video,
+    folder: pathlib.Path,
+    policy: Optional[stream_policy.streamPolicy] = None,
+) -> dict[int, Optional[BaseException]]:
+    # 常见编码已由内置混流器处理，ffmpeg 只在 FLV 和特殊编码时才需要
+    if not ffmpeg_helper.isAvailable():
+        print("没找到ffmpeg~FLV和杜比/无损音轨的视频将无法混流")
+
+    return await downloadVideos(vido, folder, policy)
+
+
+async def resumeJournal() -> None:
+    """
+    启动时把上次没下完的任务接着下：已完成的分P直接跳过，
+    下到一半的流靠清单从断点续传
+    """
+    jobs = dlJournal.unfinishedJobs()
+    if not jobs:
         return
 
-    if not folder.exists():
-        folder.mkdir(parents=True, exist_ok=True)
+    print(f"恢复上次未完成的 {len(jobs)} 个下载任务")
+    limit = asyncio.Semaphore(RESUME_JOBS)
 
-    for pageIndex in range(await getPageCount(vido)):
-        await downloadOneVideo(
-            await vido.get_download_url(pageIndex), folder / str(pageIndex)
+    async def resumeOne(job: dict):
+        options = job["options"]
+        policy = stream_policy.streamPolicy(
+            options.get("mode", stream_policy.MODE_BEST),
+            options.get("maxHeight", 0),
+            options.get("maxKbps", 0),
+            tuple(options.get("codecs", stream_policy.ALL_CODECS)),
         )
+
+        async with limit:
+            try:
+                await downloadVideosV2(
+                    getVideo(job["bvid"]), pathlib.Path(job["folder"]), policy
+                )
+            except Exception as e:
+                print(f"{job['bvid']} 恢复下载失败：{e}")
+
+    await asyncio.gather(*(resumeOne(job) for job in jobs))
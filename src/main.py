@@ -6,6 +6,41 @@ from qasync import QEventLoop, QApplication
 from widgets.system_tray import biliTrayRegister
 from widgets.animated_image_widget import AnimatedImageWidget
 from utils import config_loader
+from core import video_handler
+from core.download_journal import dlJournal
+from core.preview_server import previewSrv
+from core.image_pipeline import imgPipe
+
+# 退出时等下载任务收尾的最长时间（秒）
+SHUTDOWN_TIMEOUT = 5
+
+
+async def runUntilClosed(closeEvent: asyncio.Event):
+    # 上次没下完的任务在后台接着下；留着引用，免得任务被回收
+    resumeTask = None
+    if config_loader.userConf.getDownloadResumeOnStart():
+        resumeTask = asyncio.ensure_future(video_handler.resumeJournal())
+
+    try:
+        await closeEvent.wait()
+    finally:
+        # 从这里开始被取消的下载都是退出打断的，任务记录保持进行中
+        dlJournal.beginShutdown()
+
+        # 恢复任务和界面里发起的下载都在这里取消并等它们收尾，
+        # 最后的进度、分P状态在关闭任务记录之前写进去
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in tasks:
+            task.cancel()
+
+        if tasks:
+            await asyncio.wait(tasks, timeout=SHUTDOWN_TIMEOUT)
+
+        await previewSrv.close()
+        await imgPipe.close()
+
+        # 退出前把攒着的任务记录提交掉
+        dlJournal.close()
 
 
 if __name__ == "__main__":
@@ -24,4 +59,4 @@ if __name__ == "__main__":
 
     widget.show()
 
-    asyncio.run(appCloseEvent.wait(), loop_factory=QEventLoop)
+    asyncio.run(runUntilClosed(appCloseEvent), loop_factory=QEventLoop)
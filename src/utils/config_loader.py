@@ -34,6 +34,22 @@ class configLoader:
         self._userConfig = {
             "assets": {"image": str(self._defaultAnimatedImage)},
             "deps": {"ffmpeg": ""},
+            "download": {
+                "connections": 4,
+                "max_connections": 16,
+                "max_jobs": 3,
+                "max_per_host": 8,
+                "pipe_mux": True,
+                "content_store": True,
+                "stream_mode": "best",
+                "max_height": 0,
+                "max_kbps": 0,
+                "codecs": ["avc", "hev", "av01"],
+                "resume_on_start": True,
+                "preview": False,
+                "preview_port": 0,
+            },
+            "bandwidth": {"limit_kb": 0, "live_reserve_kb": 512},
             "bilibili": {
                 "sessdata": "",
                 "bili_jct": "",
@@ -88,6 +104,100 @@ class configLoader:
     def saveFfmpeg(self, path: str):
         self._userConfig["deps"]["ffmpeg"] = path
 
+    def getDownloadConnections(self) -> int:
+        return int(self._userConfig.get("download", {}).get("connections", 4))
+
+    def saveDownloadConnections(self, count: int):
+        self._userConfig.setdefault("download", {})["connections"] = count
+
+    def getDownloadMaxConnections(self) -> int:
+        return int(self._userConfig.get("download", {}).get("max_connections", 16))
+
+    def saveDownloadMaxConnections(self, count: int):
+        self._userConfig.setdefault("download", {})["max_connections"] = count
+
+    def getDownloadMaxJobs(self) -> int:
+        return int(self._userConfig.get("download", {}).get("max_jobs", 3))
+
+    def saveDownloadMaxJobs(self, count: int):
+        self._userConfig.setdefault("download", {})["max_jobs"] = count
+
+    def getDownloadMaxPerHost(self) -> int:
+        return int(self._userConfig.get("download", {}).get("max_per_host", 8))
+
+    def saveDownloadMaxPerHost(self, count: int):
+        self._userConfig.setdefault("download", {})["max_per_host"] = count
+
+    def getDownloadPipeMux(self) -> bool:
+        return bool(self._userConfig.get("download", {}).get("pipe_mux", True))
+
+    def saveDownloadPipeMux(self, enabled: bool):
+        self._userConfig.setdefault("download", {})["pipe_mux"] = enabled
+
+    def getDownloadContentStore(self) -> bool:
+        return bool(self._userConfig.get("download", {}).get("content_store", True))
+
+    def saveDownloadContentStore(self, enabled: bool):
+        self._userConfig.setdefault("download", {})["content_store"] = enabled
+
+    def getDownloadStreamMode(self) -> str:
+        return str(self._userConfig.get("download", {}).get("stream_mode", "best"))
+
+    def saveDownloadStreamMode(self, mode: str):
+        self._userConfig.setdefault("download", {})["stream_mode"] = mode
+
+    def getDownloadMaxHeight(self) -> int:
+        return int(self._userConfig.get("download", {}).get("max_height", 0))
+
+    def saveDownloadMaxHeight(self, height: int):
+        self._userConfig.setdefault("download", {})["max_height"] = height
+
+    def getDownloadMaxKbps(self) -> int:
+        return int(self._userConfig.get("download", {}).get("max_kbps", 0))
+
+    def saveDownloadMaxKbps(self, kbps: int):
+        self._userConfig.setdefault("download", {})["max_kbps"] = kbps
+
+    def getDownloadCodecs(self) -> list[str]:
+        return list(
+            self._userConfig.get("download", {}).get("codecs", ["avc", "hev", "av01"])
+        )
+
+    def saveDownloadCodecs(self, codecs: list[str]):
+        self._userConfig.setdefault("download", {})["codecs"] = codecs
+
+    def getDownloadResumeOnStart(self) -> bool:
+        return bool(self._userConfig.get("download", {}).get("resume_on_start", True))
+
+    def saveDownloadResumeOnStart(self, enabled: bool):
+        self._userConfig.setdefault("download", {})["resume_on_start"] = enabled
+
+    def getDownloadPreview(self) -> bool:
+        return bool(self._userConfig.get("download", {}).get("preview", False))
+
+    def saveDownloadPreview(self, enabled: bool):
+        self._userConfig.setdefault("download", {})["preview"] = enabled
+
+    def getDownloadPreviewPort(self) -> int:
+        # 0 表示随便挑一个空闲端口
+        return int(self._userConfig.get("download", {}).get("preview_port", 0))
+
+    def saveDownloadPreviewPort(self, port: int):
+        self._userConfig.setdefault("download", {})["preview_port"] = port
+
+    def getBandwidthLimit(self) -> int:
+        # KB/s，0 表示不限速
+        return int(self._userConfig.get("bandwidth", {}).get("limit_kb", 0))
+
+    def saveBandwidthLimit(self, limitKb: int):
+        self._userConfig.setdefault("bandwidth", {})["limit_kb"] = limitKb
+
+    def getBandwidthLiveReserve(self) -> int:
+        return int(self._userConfig.get("bandwidth", {}).get("live_reserve_kb", 512))
+
+    def saveBandwidthLiveReserve(self, reserveKb: int):
+        self._userConfig.setdefault("bandwidth", {})["live_reserve_kb"] = reserveKb
+
     def getSessData(self) -> str:
         return self._userConfig["bilibili"]["sessdata"]
 
@@ -0,0 +1,116 @@
+import asyncio, errno, os, pathlib, tempfile
+from typing import AsyncIterator
+
+from utils import config_loader
+
+
+class ffmpegError(Exception):
+    pass
+
+
+def isAvailable() -> bool:
+    ffmpeg = config_loader.userConf.getFfmpeg()
+
+    return ffmpeg != "" and pathlib.Path(ffmpeg).exists()
+
+
+def canPipe() -> bool:
+    # 需要命名管道把两路流同时喂给 ffmpeg，windows 上没有 mkfifo
+    return hasattr(os, "mkfifo")
+
+
+async def _spawn(inputs: list[str], out: str) -> asyncio.subprocess.Process:
+    args = ["-y", "-loglevel", "error"]
+    for inputPath in inputs:
+        args += ["-i", inputPath]
+
+    # 先写到 .part，成功后再改名，避免留下半截的成品被当成已完成
+    args += ["-c", "copy", "-f", "mp4", f"{out}.part"]
+
+    return await asyncio.create_subprocess_exec(
+        config_loader.userConf.getFfmpeg(),
+        *args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+
+
+async def _finish(proc: asyncio.subprocess.Process, out: str):
+    _, stderr = await proc.communicate()
+
+    if proc.returncode != 0:
+        pathlib.Path(f"{out}.part").unlink(missing_ok=True)
+
+        raise ffmpegError(
+            f"ffmpeg 退出码 {proc.returncode}：{stderr.decode(errors='ignore')[-500:]}"
+        )
+
+    os.replace(f"{out}.part", out)
+
+
+async def remux(inputs: list[str], out: str) -> None:
+    # 子进程异步执行，混流期间不会卡住界面
+    proc = await _spawn(inputs, out)
+
+    await _finish(proc, out)
+
+
+def _writeAll(fd: int, data: bytes):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
+
+
+async def _feedFifo(
+    path: str, stream: AsyncIterator[bytes], proc: asyncio.subprocess.Process
+):
+    # 非阻塞地等 ffmpeg 打开读端，ffmpeg 提前退出时不会永远卡在 open 上
+    while True:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+            break
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+
+            if proc.returncode is not None:
+                raise ffmpegError("ffmpeg 在读取输入前就退出了")
+
+            await asyncio.sleep(0.05)
+
+    os.set_blocking(fd, True)
+
+    try:
+        async for chunk in stream:
+            # 管道写满时阻塞在线程里，背压会一路传回网络读取
+            await asyncio.to_thread(_writeAll, fd, chunk)
+    finally:
+        os.close(fd)
+
+
+async def remuxStreams(streams: list[AsyncIterator[bytes]], out: str) -> None:
+    # 边下边混流：每路流通过一个命名管道直接送进 ffmpeg，不落临时文件
+    with tempfile.TemporaryDirectory() as tmpDir:
+        fifos = []
+        for i in range(len(streams)):
+            fifo = os.path.join(tmpDir, f"input{i}")
+            os.mkfifo(fifo)
+            fifos.append(fifo)
+
+        proc = await _spawn(fifos, out)
+
+        try:
+            async with asyncio.TaskGroup() as group:
+                for fifo, stream in zip(fifos, streams):
+                    group.create_task(_feedFifo(fifo, stream, proc))
+        except BaseException:
+            if proc.returncode is None:
+                proc.kill()
+
+            await proc.wait()
+            pathlib.Path(f"{out}.part").unlink(missing_ok=True)
+
+            raise
+
+        await _finish(proc, out)
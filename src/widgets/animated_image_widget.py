@@ -6,6 +6,8 @@ from utils import config_loader
 from widgets import (
     emoji_selecter, 
     video_download_widget,
+    archive_widget,
+    download_manager_widget,
     blivedm_widget,
     bulletscreen_player,
     bulletscreen_widget,
@@ -48,6 +50,8 @@ class AnimatedImageWidget(QWidget):
 
         self._emojiSelecter : emoji_selecter.emoSearchListWidget | None = None
         self._videoDownloadWidget : video_download_widget.vdoDownWidget | None = None
+        self._archiveWidget : archive_widget.archiveWidget | None = None
+        self._downloadManager : download_manager_widget.downloadManagerWidget | None = None
         self._blivedmWidget : blivedm_widget.blivedmObject | None = None
         self._bulletscreenPlayer : bulletscreen_player.bulletscreenObject | None = None
         self._bulletscreenWidget : bulletscreen_widget.bullscrContainer | None = None
@@ -112,6 +116,14 @@ class AnimatedImageWidget(QWidget):
         vdoDownloadAction.triggered.connect(self.vdoDownload)
         self._rightMenu.addAction(vdoDownloadAction)
 
+        archiveAction = QAction("批量归档", self._rightMenu)
+        archiveAction.triggered.connect(self.openArchive)
+        self._rightMenu.addAction(archiveAction)
+
+        managerAction = QAction("下载管理", self._rightMenu)
+        managerAction.triggered.connect(self.openDownloadManager)
+        self._rightMenu.addAction(managerAction)
+
         self._rightMenu.addSeparator()
 
         dmPlayerAction = QAction("语音弹幕", self._rightMenu)
@@ -240,6 +252,30 @@ class AnimatedImageWidget(QWidget):
         
         self._videoDownloadWidget.readyToDestory.connect(_setVdoToNone)
 
+    def openArchive(self):
+        if self._archiveWidget:
+            return
+
+        self._archiveWidget = archive_widget.archiveWidget()
+        self._archiveWidget.show()
+
+        def _setArchiveToNone():
+            self._archiveWidget = None
+
+        self._archiveWidget.readyToDestory.connect(_setArchiveToNone)
+
+    def openDownloadManager(self):
+        if self._downloadManager:
+            return
+
+        self._downloadManager = download_manager_widget.downloadManagerWidget()
+        self._downloadManager.show()
+
+        def _setManagerToNone():
+            self._downloadManager = None
+
+        self._downloadManager.readyToDestory.connect(_setManagerToNone)
+
     def onDmPlayer(self, checked):
         if not self._bulletscreenPlayer:
             self._bulletscreenPlayer = bulletscreen_player.bulletscreenObject(self)
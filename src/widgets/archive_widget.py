@@ -0,0 +1,203 @@
+import pathlib
+from typing import Optional
+from PySide6.QtWidgets import (
+    QWidget,
+    QLabel,
+    QLineEdit,
+    QPushButton,
+    QVBoxLayout,
+    QHBoxLayout,
+    QFileDialog,
+    QCheckBox,
+    QComboBox,
+)
+from PySide6.QtCore import Qt, Signal
+from PySide6.QtGui import QIcon
+import qasync
+
+from core import archive_sync, download_progress, stream_policy
+from core.download_signal import dlEmitter
+from utils import config_loader
+
+
+class archiveWidget(QWidget):
+    readyToDestory = Signal()
+
+    def __init__(self):
+        super().__init__()
+        self.setup_ui()
+        self.setup_style()
+
+        self._currentFolder: str = ""
+        self._sync: Optional[archive_sync.archiveSync] = None
+        # 所有正在下载的分P最近一次的进度
+        self._pageProgress: dict[str, download_progress.progressSnapshot] = {}
+
+        dlEmitter.progressUpdated.connect(self.onProgressUpdated)
+
+    def setup_ui(self):
+        self.setWindowTitle("批量归档")
+        self.setWindowIcon(QIcon(str(config_loader.userConf.getDefaultIco())))
+
+        main_layout = QVBoxLayout(self)
+        main_layout.setSpacing(10)
+        main_layout.setContentsMargins(10, 10, 10, 10)
+        main_layout.setAlignment(Qt.AlignTop)
+
+        # 来源区域
+        source_layout = QHBoxLayout()
+        source_layout.setSpacing(8)
+
+        self.cmb_source = QComboBox()
+        self.cmb_source.addItem("收藏夹", archive_sync.SOURCE_FAVORITE)
+        self.cmb_source.addItem("合集", archive_sync.SOURCE_SEASON)
+        self.cmb_source.addItem("系列", archive_sync.SOURCE_SERIES)
+        self.cmb_source.addItem("UP主投稿", archive_sync.SOURCE_UPLOADER)
+        self.cmb_source.setFixedHeight(32)
+        source_layout.addWidget(self.cmb_source)
+
+        self.edit_id = QLineEdit()
+        self.edit_id.setPlaceholderText("收藏夹 / 合集 / 系列 id 或 UP主 mid...")
+        self.edit_id.setFixedHeight(32)
+        source_layout.addWidget(self.edit_id, 1)
+
+        self.btn_sync = QPushButton("同步")
+        self.btn_sync.setFixedSize(60, 32)
+        self.btn_sync.clicked.connect(self.onSyncButtonClicked)
+        source_layout.addWidget(self.btn_sync)
+
+        main_layout.addLayout(source_layout)
+
+        # 下载选项
+        options_layout = QHBoxLayout()
+        options_layout.setSpacing(8)
+
+        self.chk_danmaku = QCheckBox("同时导出弹幕")
+        options_layout.addWidget(self.chk_danmaku, 1)
+
+        self.cmb_stream = QComboBox()
+        self.cmb_stream.addItem("最高画质", stream_policy.MODE_BEST)
+        self.cmb_stream.addItem("同画质最小体积", stream_policy.MODE_SMALLEST)
+        self.cmb_stream.addItem("仅音频", stream_policy.MODE_AUDIO)
+        self.cmb_stream.setCurrentIndex(
+            max(0, self.cmb_stream.findData(config_loader.userConf.getDownloadStreamMode()))
+        )
+        options_layout.addWidget(self.cmb_stream)
+
+        main_layout.addLayout(options_layout)
+
+        # 进度区域
+        self.lbl_report = QLabel("同一个目录再次同步时只会下载新增或有变化的视频")
+        self.lbl_report.setStyleSheet("color: #555; font-size: 11px;")
+        main_layout.addWidget(self.lbl_report)
+
+        self.lbl_progress = QLabel("")
+        self.lbl_progress.setStyleSheet("color: #555; font-size: 11px;")
+        self.lbl_progress.setVisible(False)
+        main_layout.addWidget(self.lbl_progress)
+
+        self.setMinimumWidth(420)
+        self.adjustSize()
+
+    def setup_style(self):
+        self.edit_id.setStyleSheet("""
+            border: 1px solid #ccc;
+            border-radius: 4px;
+            padding: 0 10px;
+        """)
+
+        self.btn_sync.setStyleSheet("""
+            QPushButton {
+                background-color: #0FA958;
+                color: #fff;
+                border: none;
+                border-radius: 4px;
+            }
+            QPushButton:hover {
+                background-color: #0D954D;
+            }
+            QPushButton:pressed {
+                background-color: #0B8142;
+            }
+            QPushButton:disabled {
+                background-color: #E6F4EA;
+                color: #000;
+            }
+        """)
+
+    @qasync.asyncSlot()
+    async def onSyncButtonClicked(self):
+        sourceId = self.edit_id.text().strip()
+        if not sourceId.isdigit():
+            self.lbl_report.setText("id 只能是数字")
+
+            return
+
+        selectedFolder = QFileDialog.getExistingDirectory(
+            self, "选择归档目录", self._currentFolder
+        )
+        if selectedFolder == "":
+            return
+
+        self._currentFolder = selectedFolder
+        self.btn_sync.setEnabled(False)
+        self._pageProgress.clear()
+        self.lbl_report.setText("正在获取列表...")
+        self.lbl_progress.setVisible(True)
+
+        policy = stream_policy.streamPolicy.fromConfig()
+        policy.mode = self.cmb_stream.currentData()
+
+        self._sync = archive_sync.archiveSync(
+            self.cmb_source.currentData(),
+            int(sourceId),
+            pathlib.Path(selectedFolder),
+            policy,
+            self.chk_danmaku.isChecked(),
+            self.onReportUpdated,
+        )
+
+        try:
+            report = await self._sync.run()
+            title = f"批量归档 - 完成，新下载 {report.downloaded} 个"
+            if report.failed:
+                title += f"，失败 {len(report.failed)} 个"
+        except Exception as e:
+            title = f"批量归档 - 失败：{e}"
+        finally:
+            self._sync = None
+            self.btn_sync.setEnabled(True)
+
+        self.setWindowTitle(title)
+
+    def onReportUpdated(self, report: archive_sync.syncReport):
+        listing = "" if report.listingDone else "（列表获取中）"
+        pending = report.listed - report.skipped - report.downloaded - len(report.failed)
+
+        self.lbl_report.setText(
+            f"已列出 {report.listed} 个{listing}  已是最新 {report.skipped}  "
+            f"新下载 {report.downloaded}  失败 {len(report.failed)}  待下载 {pending}"
+        )
+
+    def onProgressUpdated(self, snapshots: list):
+        if self._sync is None:
+            return
+
+        for snap in snapshots:
+            self._pageProgress[snap.key] = snap
+
+        running = [
+            snap
+            for snap in self._pageProgress.values()
+            if snap.state == download_progress.STATE_RUNNING
+        ]
+        speed = sum(snap.speed for snap in running)
+
+        self.lbl_progress.setText(
+            f"正在下载 {len(running)} P  {speed / 1048576:.2f} MB/s"
+        )
+
+    def closeEvent(self, event):
+        dlEmitter.progressUpdated.disconnect(self.onProgressUpdated)
+
+        self.readyToDestory.emit()
@@ -3,6 +3,7 @@ import aiohttp
 import http.cookies
 import blivedm
 from core import blivedm_handler
+from core.rate_limiter import bwLimiter
 from PySide6.QtCore import QObject
 import qasync
 from utils import config_loader
@@ -32,10 +33,13 @@ class blivedmObject(QObject):
             self._blClient.set_handler(blivedm_handler.blivedmHandler())
 
             self._blClient.start()
+            # 直播连接期间给它预留带宽，避免被视频下载挤占
+            bwLimiter.liveStarted()
 
             try:
                 await self._blClient.join()
             finally:
+                bwLimiter.liveStopped()
                 await self._blClient.stop_and_close()
                 self._blClient = None
 
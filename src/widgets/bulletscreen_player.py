@@ -7,6 +7,7 @@ import qasync
 import nava
 from PySide6.QtCore import QObject, Signal
 from core import blivedm_signal
+from core.rate_limiter import bwLimiter, CLASS_LIVE
 from utils import config_loader
 from utils import sovits_http_helper
 
@@ -53,6 +54,7 @@ class bulletscreenObject(QObject):
                     return
 
                 wavData = await resp.read()
+                bwLimiter.record(CLASS_LIVE, len(wavData))
 
                 await self._wavQueue.put(wavMeta(wavData, True))
         except Exception as e:
@@ -0,0 +1,339 @@
+from typing import Any
+from PySide6.QtWidgets import (
+    QWidget,
+    QLabel,
+    QPushButton,
+    QVBoxLayout,
+    QHBoxLayout,
+    QTableView,
+    QHeaderView,
+    QAbstractItemView,
+    QStyledItemDelegate,
+    QStyleOptionProgressBar,
+    QStyle,
+    QApplication,
+)
+from PySide6.QtCore import (
+    Qt,
+    Signal,
+    QAbstractTableModel,
+    QModelIndex,
+    QPersistentModelIndex,
+    QTimer,
+)
+from PySide6.QtGui import QIcon
+
+from core import download_progress
+from core.download_progress import progressSnapshot
+from core.download_scheduler import downScheduler
+from core.download_signal import dlEmitter
+from utils import config_loader
+
+# 模型把攒下的变化通知给视图的最短间隔（毫秒），任务再多、上报再频繁界面也只按这个频率重绘
+FLUSH_INTERVAL_MS = 500
+ROW_HEIGHT = 22
+
+COL_NAME, COL_STATE, COL_PROGRESS, COL_SIZE, COL_SPEED, COL_ETA, COL_CONNS = range(7)
+HEADERS = ["名称", "状态", "进度", "大小", "速度", "剩余", "连接"]
+# 状态不变时只有这几列会变，通知范围按列收窄，视图只重绘这部分
+LIVE_COLUMNS = (COL_PROGRESS, COL_CONNS)
+
+STATE_NAMES = {
+    download_progress.STATE_QUEUED: "排队中",
+    download_progress.STATE_RUNNING: "下载中",
+    download_progress.STATE_DONE: "已完成",
+    download_progress.STATE_FAILED: "失败",
+}
+
+
+def formatBytes(nbytes: float) -> str:
+    if nbytes >= 1073741824:
+        return f"{nbytes / 1073741824:.2f} GB"
+
+    return f"{nbytes / 1048576:.1f} MB"
+
+
+def formatEta(eta: float) -> str:
+    if eta < 0:
+        return "--:--"
+
+    minutes, seconds = divmod(int(eta), 60)
+    if minutes >= 60:
+        return f"{minutes // 60}:{minutes % 60:02d}:{seconds:02d}"
+
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+class downloadTableModel(QAbstractTableModel):
+    """
+    下载任务表：每行是一个分P（或片段）的进度。
+    进度推送只更新内存里的快照并记下脏行，由定时器按固定频率把新行一次性插入、
+    把连续的脏行合并成几段 dataChanged 发出去，几十个任务同时上报时 GUI 线程也基本空闲
+    """
+
+    # 一次刷新做完，界面上的汇总在这时重算
+    flushed = Signal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self._rows: list[progressSnapshot] = []
+        self._rowOf: dict[str, int] = {}
+
+        # 上次刷新以来的变化：新出现的任务，以及 行号 -> 状态是否变了
+        self._incoming: dict[str, progressSnapshot] = {}
+        self._dirty: dict[int, bool] = {}
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(FLUSH_INTERVAL_MS)
+        self._timer.timeout.connect(self.flush)
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(HEADERS)
+
+    def headerData(self, section: int, orientation, role=Qt.DisplayRole) -> Any:
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return HEADERS[section]
+
+        return None
+
+    def data(self, index: QModelIndex | QPersistentModelIndex, role=Qt.DisplayRole) -> Any:
+        if not index.isValid():
+            return None
+
+        snap = self._rows[index.row()]
+        column = index.column()
+
+        if role == Qt.DisplayRole:
+            return self._display(snap, column)
+        if role == Qt.UserRole and column == COL_PROGRESS:
+            # 进度条代理用的 0 ~ 1000
+            return int(snap.doneBytes * 1000 / snap.totalBytes) if snap.totalBytes else 0
+        if role == Qt.TextAlignmentRole and column != COL_NAME:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        if role == Qt.ToolTipRole and column == COL_NAME:
+            phases = "  ".join(f"{name} {sec:.1f}s" for name, sec in snap.phases.items())
+
+            return f"{snap.name}\n{phases}" if phases else snap.name
+
+        return None
+
+    def _display(self, snap: progressSnapshot, column: int) -> Any:
+        running = snap.state == download_progress.STATE_RUNNING
+
+        if column == COL_NAME:
+            return snap.name
+        if column == COL_STATE:
+            return STATE_NAMES.get(snap.state, snap.state)
+        if column == COL_PROGRESS:
+            return f"{snap.doneBytes * 100 / snap.totalBytes:.1f}%" if snap.totalBytes else ""
+        if column == COL_SIZE:
+            return f"{formatBytes(snap.doneBytes)} / {formatBytes(snap.totalBytes)}"
+        if column == COL_SPEED:
+            return f"{snap.speed / 1048576:.2f} MB/s" if running else ""
+        if column == COL_ETA:
+            return formatEta(snap.eta) if running else ""
+        if column == COL_CONNS:
+            return str(len(snap.connections)) if running else ""
+
+        return None
+
+    def updateSnapshots(self, snapshots: list[progressSnapshot]):
+        # 只记账，不通知视图
+        for snap in snapshots:
+            row = self._rowOf.get(snap.key)
+            if row is None:
+                self._incoming[snap.key] = snap
+
+                continue
+
+            stateChanged = self._rows[row].state != snap.state
+            self._rows[row] = snap
+            self._dirty[row] = self._dirty.get(row, False) or stateChanged
+
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def flush(self):
+        if self._incoming:
+            first = len(self._rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(self._incoming) - 1)
+            for key, snap in self._incoming.items():
+                self._rowOf[key] = len(self._rows)
+                self._rows.append(snap)
+            self.endInsertRows()
+
+            self._incoming.clear()
+
+        if self._dirty:
+            self._emitDirty()
+
+        self.flushed.emit()
+
+    def _emitDirty(self):
+        # 把连续的脏行合成一段；状态变了的段整行通知，否则只通知会动的列
+        rows = sorted(self._dirty)
+        start = prev = rows[0]
+        wide = self._dirty[start]
+
+        for row in rows[1:] + [None]:
+            if row is not None and row == prev + 1:
+                prev = row
+                wide = wide or self._dirty[row]
+
+                continue
+
+            self._emitChanged(start, prev, wide)
+
+            if row is not None:
+                start = prev = row
+                wide = self._dirty[row]
+
+        self._dirty.clear()
+
+    def _emitChanged(self, first: int, last: int, wide: bool):
+        if wide:
+            self.dataChanged.emit(self.index(first, 0), self.index(last, len(HEADERS) - 1))
+
+            return
+
+        self.dataChanged.emit(
+            self.index(first, LIVE_COLUMNS[0]), self.index(last, LIVE_COLUMNS[-1])
+        )
+
+    def removeFinished(self) -> int:
+        # 清掉已完成的行；行号整体变化，直接重置模型比逐段删除简单
+        self.flush()
+
+        kept = [snap for snap in self._rows if snap.state != download_progress.STATE_DONE]
+        removed = len(self._rows) - len(kept)
+        if removed == 0:
+            return 0
+
+        self.beginResetModel()
+        self._rows = kept
+        self._rowOf = {snap.key: row for row, snap in enumerate(kept)}
+        self.endResetModel()
+
+        return removed
+
+    def summary(self) -> dict[str, int]:
+        counts = dict.fromkeys(STATE_NAMES, 0)
+        for snap in self._rows:
+            counts[snap.state] = counts.get(snap.state, 0) + 1
+
+        return counts
+
+    def totalSpeed(self) -> float:
+        return sum(
+            snap.speed
+            for snap in self._rows
+            if snap.state == download_progress.STATE_RUNNING
+        )
+
+
+class progressDelegate(QStyledItemDelegate):
+    # 进度列画成进度条，不为每行创建控件
+    def paint(self, painter, option, index):
+        bar = QStyleOptionProgressBar()
+        bar.rect = option.rect.adjusted(2, 3, -2, -3)
+        bar.minimum = 0
+        bar.maximum = 1000
+        bar.progress = index.data(Qt.UserRole) or 0
+        bar.text = index.data(Qt.DisplayRole) or ""
+        bar.textVisible = True
+        bar.state = option.state
+
+        QApplication.style().drawControl(QStyle.CE_ProgressBar, bar, painter)
+
+
+class downloadManagerWidget(QWidget):
+    readyToDestory = Signal()
+
+    def __init__(self):
+        super().__init__()
+        self.setup_ui()
+
+        self.model = downloadTableModel(self)
+        self.table.setModel(self.model)
+        self.table.setItemDelegateForColumn(COL_PROGRESS, progressDelegate(self.table))
+        self.table.horizontalHeader().setSectionResizeMode(COL_NAME, QHeaderView.Stretch)
+        self.model.flushed.connect(self.updateSummary)
+        self.model.modelReset.connect(self.updateSummary)
+
+        # 打开窗口前就在下的任务先拉一次
+        self.model.updateSnapshots(download_progress.progHub.snapshots())
+        self.model.flush()
+
+        dlEmitter.progressUpdated.connect(self.model.updateSnapshots)
+
+    def setup_ui(self):
+        self.setWindowTitle("下载管理")
+        self.setWindowIcon(QIcon(str(config_loader.userConf.getDefaultIco())))
+
+        main_layout = QVBoxLayout(self)
+        main_layout.setSpacing(8)
+        main_layout.setContentsMargins(10, 10, 10, 10)
+
+        self.table = QTableView()
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setAlternatingRowColors(True)
+        self.table.setWordWrap(False)
+        # 固定行高，视图不用逐行量尺寸，几百行滚动也只画可见的部分
+        self.table.verticalHeader().setVisible(False)
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.table.verticalHeader().setDefaultSectionSize(ROW_HEIGHT)
+        main_layout.addWidget(self.table, 1)
+
+        bottom_layout = QHBoxLayout()
+        bottom_layout.setSpacing(8)
+
+        self.lbl_summary = QLabel("")
+        self.lbl_summary.setStyleSheet("color: #555; font-size: 11px;")
+        bottom_layout.addWidget(self.lbl_summary, 1)
+
+        self.btn_pause = QPushButton("继续全部" if downScheduler.isPaused() else "暂停全部")
+        self.btn_pause.setFixedHeight(28)
+        self.btn_pause.clicked.connect(self.onPauseButtonClicked)
+        bottom_layout.addWidget(self.btn_pause)
+
+        self.btn_clear = QPushButton("清除已完成")
+        self.btn_clear.setFixedHeight(28)
+        self.btn_clear.clicked.connect(self.onClearButtonClicked)
+        bottom_layout.addWidget(self.btn_clear)
+
+        main_layout.addLayout(bottom_layout)
+
+        self.resize(720, 420)
+
+    def updateSummary(self):
+        counts = self.model.summary()
+
+        self.lbl_summary.setText(
+            f"下载中 {counts[download_progress.STATE_RUNNING]}  "
+            f"排队 {counts[download_progress.STATE_QUEUED]}  "
+            f"完成 {counts[download_progress.STATE_DONE]}  "
+            f"失败 {counts[download_progress.STATE_FAILED]}  "
+            f"{self.model.totalSpeed() / 1048576:.2f} MB/s"
+        )
+
+    def onPauseButtonClicked(self):
+        if downScheduler.isPaused():
+            downScheduler.resume()
+            self.btn_pause.setText("暂停全部")
+        else:
+            downScheduler.pause()
+            self.btn_pause.setText("继续全部")
+
+    def onClearButtonClicked(self):
+        self.model.removeFinished()
+
+    def closeEvent(self, event):
+        dlEmitter.progressUpdated.disconnect(self.model.updateSnapshots)
+
+        self.readyToDestory.emit()
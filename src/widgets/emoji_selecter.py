@@ -1,51 +1,223 @@
-import sys, asyncio, pathlib
+import sys, asyncio, collections, pathlib
 from typing import override
 from PySide6.QtWidgets import (
     QApplication,
     QWidget,
-    QListWidget,
-    QListWidgetItem,
+    QListView,
     QHBoxLayout,
     QVBoxLayout,
-    QLabel,
     QLineEdit,
     QStyle,
+    QStyledItemDelegate,
     QPushButton,
     QFileDialog,
 )
-from PySide6.QtGui import QPixmap, QPalette, QIcon
-from PySide6.QtCore import Qt, QByteArray, Signal
+from PySide6.QtGui import QPixmap, QPalette, QIcon, QMovie, QPainter
+from PySide6.QtCore import (
+    Qt,
+    Signal,
+    QAbstractListModel,
+    QModelIndex,
+    QByteArray,
+    QBuffer,
+    QPoint,
+    QRect,
+    QSize,
+    QTimer,
+)
 from bilibili_api import emoji, Credential
-import aiofiles, aiohttp, qasync
+import aiofiles, qasync
 from utils.config_loader import userConf
 from core import emoji_handler as emo
+from core.image_pipeline import imgPipe
+
+# 缩略图解码后的边长，比显示的 36 像素大一些，高分屏上也清楚
+THUMB_SIZE = 72
+ICON_SIZE = 36
+ROW_HEIGHT = 48
+# 模型里最多留着的缩略图数，滚过几千个结果也不会一直涨内存
+THUMB_CACHE_ROWS = 400
+# 输入停下这么久（毫秒）后自动搜索
+SEARCH_DELAY_MS = 200
+
+ROLE_ID = Qt.UserRole
+ROLE_URL = Qt.UserRole + 1
 
 
-class emoListItem(QWidget):
-    def __init__(self, pixmap, name, id, parent=None):
+class emojiListModel(QAbstractListModel):
+    """
+    搜索结果列表：只存包的原始数据，图标和名字由代理直接画。
+    缩略图在代理第一次画到这一行时才去加载，也就是只加载看得见的行；
+    动图只给可见的行创建 QMovie，滚出视野就停掉
+    """
+
+    def __init__(self, parent=None):
         super().__init__(parent)
 
-        self.setAttribute(Qt.WA_StyledBackground, True)
+        self._pkgs: list[dict] = []
+        # 地址 -> 缩略图，按最近使用淘汰
+        self._thumbs: collections.OrderedDict[str, QPixmap] = collections.OrderedDict()
+        self._pending: set[str] = set()
+        self._failed: set[str] = set()
+        # 行号 -> 正在播放的动图
+        self._movies: dict[int, QMovie] = {}
+        self._visible = (0, -1)
+        # 每次换结果加一，丢弃上一批结果还没加载完的图
+        self._generation = 0
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._pkgs)
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        pkg = self._pkgs[index.row()]
+
+        if role == Qt.DisplayRole:
+            return pkg["text"]
+        if role == ROLE_ID:
+            return int(pkg["id"])
+        if role == ROLE_URL:
+            return pkg.get("url", "")
+        if role == Qt.DecorationRole:
+            movie = self._movies.get(index.row())
+            if movie is not None:
+                return movie.currentPixmap()
+
+            pixmap = self._thumbs.get(pkg.get("url", ""))
+            if pixmap is not None:
+                self._thumbs.move_to_end(pkg["url"])
+
+            return pixmap
+
+        return None
+
+    def setPackages(self, pkgs: list[dict]):
+        self.beginResetModel()
+        self._stopMovies(set(self._movies))
+        self._pkgs = pkgs
+        self._pending.clear()
+        # 加载失败多半是暂时的，换一批结果时重新给它们机会
+        self._failed.clear()
+        self._generation += 1
+        self.endResetModel()
+
+    def requestThumbnail(self, row: int):
+        url = self._pkgs[row].get("url", "")
+        if not url or url in self._pending or url in self._failed:
+            return
+
+        self._pending.add(url)
+        asyncio.ensure_future(self._loadThumbnail(url, self._generation))
+
+    async def _loadThumbnail(self, url: str, generation: int):
+        image = await imgPipe.image(url, (THUMB_SIZE, THUMB_SIZE))
+        if generation != self._generation:
+            return
 
-        self.emoPkgName: str = name
-        self.emoPkgId: int = id
+        self._pending.discard(url)
+        if image is None:
+            self._failed.add(url)
 
-        layout = QHBoxLayout(self)
-        layout.setContentsMargins(8, 6, 8, 6)
-        layout.setSpacing(10)
+            return
 
-        self.icon_label = QLabel()
-        self.icon_label.setFixedSize(36, 36)
-        self.icon_label.setScaledContents(True)
-        self.icon_label.setPixmap(pixmap)
+        self._thumbs[url] = QPixmap.fromImage(image)
+        while len(self._thumbs) > THUMB_CACHE_ROWS:
+            self._thumbs.popitem(last=False)
+
+        self._notifyUrl(url)
+
+    def _notifyUrl(self, url: str):
+        # 同一张图可能属于好几行，一般只有一行
+        for row, pkg in enumerate(self._pkgs):
+            if pkg.get("url") == url:
+                index = self.index(row)
+                self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def setVisibleRows(self, first: int, last: int):
+        # 只让 [first, last] 里的动图播放
+        self._visible = (first, last)
+        self._stopMovies({row for row in self._movies if not first <= row <= last})
+
+        for row in range(max(first, 0), last + 1):
+            url = self._pkgs[row].get("url", "")
+            if row not in self._movies and url.lower().endswith(".gif"):
+                asyncio.ensure_future(self._startMovie(row, url, self._generation))
+
+    def _stopMovies(self, rows: set[int]):
+        for row in rows:
+            movie = self._movies.pop(row)
+            movie.stop()
+            movie.deleteLater()
+
+    async def _startMovie(self, row: int, url: str, generation: int):
+        try:
+            data = await imgPipe.data(url)
+        except Exception:
+            return
 
-        self.name_label = QLabel(name)
-        self.name_label.setAlignment(Qt.AlignVCenter)
+        first, last = self._visible
+        if generation != self._generation or row in self._movies or not first <= row <= last:
+            return
 
-        layout.addWidget(self.icon_label)
-        layout.addStretch()
-        layout.addWidget(self.name_label)
-        layout.addStretch()
+        movie = QMovie(self)
+        buffer = QBuffer(movie)
+        buffer.setData(QByteArray(data))
+        movie.setDevice(buffer)
+
+        if movie.frameCount() <= 1:
+            movie.deleteLater()
+
+            return
+
+        self._movies[row] = movie
+        index = self.index(row)
+        movie.frameChanged.connect(
+            lambda _: self.dataChanged.emit(index, index, [Qt.DecorationRole])
+        )
+        movie.start()
+
+    def stopAll(self):
+        self._visible = (0, -1)
+        self._stopMovies(set(self._movies))
+
+
+class emojiItemDelegate(QStyledItemDelegate):
+    # 直接画图标和名字，不为每一行创建控件
+    def sizeHint(self, option, index) -> QSize:
+        return QSize(option.rect.width(), ROW_HEIGHT)
+
+    def paint(self, painter: QPainter, option, index):
+        widget = option.widget
+        style = widget.style() if widget else QApplication.style()
+        style.drawPrimitive(QStyle.PE_PanelItemViewItem, option, painter, widget)
+
+        rect = option.rect.adjusted(8, 6, -8, -6)
+        iconRect = QRect(
+            rect.left(), rect.center().y() - ICON_SIZE // 2 + 1, ICON_SIZE, ICON_SIZE
+        )
+
+        pixmap = index.data(Qt.DecorationRole)
+        if pixmap is None or pixmap.isNull():
+            index.model().requestThumbnail(index.row())
+        else:
+            painter.save()
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
+            target = QRect(QPoint(0, 0), pixmap.size().scaled(iconRect.size(), Qt.KeepAspectRatio))
+            target.moveCenter(iconRect.center())
+            painter.drawPixmap(target, pixmap)
+            painter.restore()
+
+        textRect = rect.adjusted(ICON_SIZE + 10, 0, 0, 0)
+        name = option.fontMetrics.elidedText(
+            index.data(Qt.DisplayRole), Qt.ElideRight, textRect.width()
+        )
+
+        painter.save()
+        painter.setPen(option.palette.color(QPalette.Text))
+        painter.drawText(textRect, Qt.AlignCenter, name)
+        painter.restore()
 
 
 class emoSearchListWidget(QWidget):
@@ -59,8 +231,9 @@ class emoSearchListWidget(QWidget):
         self.setWindowIcon(QIcon(str(userConf.getDefaultIco())))
 
         self._emoPkgs = {}
-        self._emoListItems = []
         self._saveFolder: str = ""
+        # 每次搜索加一，输入很快时只采用最后一次搜索的结果
+        self._searchGeneration = 0
 
         main_layout = QVBoxLayout(self)
         main_layout.setContentsMargins(10, 10, 10, 10)
@@ -69,6 +242,8 @@ class emoSearchListWidget(QWidget):
         search_layout = QHBoxLayout()
 
         self.search_edit = QLineEdit(placeholderText="输入表情包名搜索...")
+        self.search_edit.textEdited.connect(self.on_text_edited)
+        self.search_edit.returnPressed.connect(self.on_search_clicked)
 
         self.search_button = QPushButton("搜索")
         self.search_button.clicked.connect(self.on_search_clicked)
@@ -76,12 +251,28 @@ class emoSearchListWidget(QWidget):
         search_layout.addWidget(self.search_edit)
         search_layout.addWidget(self.search_button)
 
-        self.list_widget = QListWidget()
-        self.list_widget.doubleClicked.connect(self.on_item_double_click)
-        self.list_widget.setUniformItemSizes(True)
+        self.list_model = emojiListModel(self)
+        self.list_view = QListView()
+        self.list_view.setModel(self.list_model)
+        self.list_view.setItemDelegate(emojiItemDelegate(self.list_view))
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.doubleClicked.connect(self.on_item_double_click)
+
+        # 滚动、缩放、换结果之后重新确定哪些行可见，动图只在这些行里播放
+        self._visibleTimer = QTimer(self)
+        self._visibleTimer.setSingleShot(True)
+        self._visibleTimer.setInterval(50)
+        self._visibleTimer.timeout.connect(self.update_visible_rows)
+        self.list_view.verticalScrollBar().valueChanged.connect(self._visibleTimer.start)
+        self.list_model.modelReset.connect(self._visibleTimer.start)
+
+        self._searchTimer = QTimer(self)
+        self._searchTimer.setSingleShot(True)
+        self._searchTimer.setInterval(SEARCH_DELAY_MS)
+        self._searchTimer.timeout.connect(self.on_search_clicked)
 
         main_layout.addLayout(search_layout)
-        main_layout.addWidget(self.list_widget)
+        main_layout.addWidget(self.list_view)
 
         self.update_styles()
         self.resize(400, 400)
@@ -89,61 +280,61 @@ class emoSearchListWidget(QWidget):
         app: QApplication = QApplication.instance()
         app.paletteChanged.connect(self.update_styles)
 
-    def add_item(self, pix, name, id):
-        item = QListWidgetItem(self.list_widget)
-        widget = emoListItem(pix, name, id)
-        item.setSizeHint(widget.sizeHint())
-        self.list_widget.setItemWidget(item, widget)
-        self._emoListItems.append((item, widget))
+    def update_visible_rows(self):
+        count = self.list_model.rowCount()
+        if count == 0:
+            return
 
-    @qasync.asyncSlot()
-    async def searchEmoByName(self):
-        if not self._emoPkgs:
-            self._emoPkgs = await emo.getAllEmojiPackages()
+        viewport = self.list_view.viewport()
+        first = self.list_view.indexAt(QPoint(0, 0)).row()
+        last = self.list_view.indexAt(QPoint(0, viewport.height() - 1)).row()
 
-        pkgs = await emo.searchMatchEmoji(self._emoPkgs, self.search_edit.text())
+        self.list_model.setVisibleRows(max(first, 0), last if last >= 0 else count - 1)
 
-        self.setWindowTitle(f"搜索完毕 - {len(pkgs)}个结果")
+    @qasync.asyncSlot()
+    async def searchEmoByName(self, generation: int):
+        try:
+            # 目录在本地缓存着，每次搜索都取一遍，后台刷新后的新包马上能搜到
+            self._emoPkgs = await emo.getAllEmojiPackages()
 
-        if not pkgs:
-            self.search_button.setEnabled(True)
+            pkgs = await emo.searchMatchEmoji(self._emoPkgs, self.search_edit.text())
+        except Exception as e:
+            if generation == self._searchGeneration:
+                self.setWindowTitle(f"搜索失败 - {e}")
 
             return
+        finally:
+            if generation == self._searchGeneration:
+                self.search_button.setEnabled(True)
 
-        async with aiohttp.ClientSession() as session:
-            for pkg in pkgs:
-                headers = {
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36 Edg/116.0.1938.54",
-                    "Referer": pkg["url"],
-                }
-
-                async with session.get(pkg["url"], headers=headers) as response:
-                    coverImage = await response.read()
-
-                    coverImgPix = QPixmap()
-                    coverImgPix.loadFromData(QByteArray(coverImage))
+        if generation != self._searchGeneration:
+            return
 
-                    self.add_item(coverImgPix, pkg["text"], int(pkg["id"]))
+        self.setWindowTitle(f"搜索完毕 - {len(pkgs)}个结果")
+        self.list_model.setPackages(pkgs)
 
-        self.search_button.setEnabled(True)
+    def on_text_edited(self, text: str):
+        self._searchTimer.start()
 
     def on_search_clicked(self):
+        self._searchTimer.stop()
+
         if self.search_edit.text() == "":
             return
 
-        self.list_widget.clear()
-        self._emoListItems.clear()
+        self._searchGeneration += 1
         self.search_button.setEnabled(False)
 
-        self.searchEmoByName()
+        self.searchEmoByName(self._searchGeneration)
 
     @qasync.asyncSlot()
     async def on_item_double_click(self, index):
-        emoItem = self.list_widget.itemWidget(self.list_widget.item(index.row()))
-
-        if not emoItem:
+        if not index.isValid():
             return
 
+        emoPkgId = index.data(ROLE_ID)
+        emoPkgName = index.data(Qt.DisplayRole)
+
         selectedFolder = QFileDialog.getExistingDirectory(
             self, "选择表情包下载目录", self._saveFolder
         )
@@ -153,11 +344,20 @@ class emoSearchListWidget(QWidget):
 
         self._saveFolder = selectedFolder
 
-        await emo.downloadPkg(
-            emoItem.emoPkgId, pathlib.Path(self._saveFolder) / emoItem.emoPkgName
+        results = await emo.downloadPkg(
+            emoPkgId, pathlib.Path(self._saveFolder) / emoPkgName
         )
 
-        self.setWindowTitle(f"下载完毕 - {emoItem.emoPkgName}")
+        failed = sum(not result.ok for result in results)
+        if failed:
+            self.setWindowTitle(f"下载完毕，{failed} 个失败 - {emoPkgName}")
+        else:
+            self.setWindowTitle(f"下载完毕 - {emoPkgName}")
+
+    @override
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self._visibleTimer.start()
 
     def is_dark_theme(self):
         app: QApplication = QApplication.instance()
@@ -259,7 +459,7 @@ class emoSearchListWidget(QWidget):
             }}
             
             /* 列表控件样式 */
-            QListWidget {{
+            QListView {{
                 background: {colors["widget_bg"]};
                 color: {colors["text"]};
                 border: 1px solid {colors["border"]};
@@ -268,27 +468,25 @@ class emoSearchListWidget(QWidget):
                 outline: none;
                 font-size: 13px;
             }}
-            QListWidget::item {{
+            QListView::item {{
                 background: transparent;
                 border-radius: 6px;
                 padding: 2px;
                 margin: 2px 0;
             }}
-            QListWidget::item:hover {{ background: {colors["hover"]}; }}
-            QListWidget::item:selected {{ background: {colors["selected"]}; }}
+            QListView::item:hover {{ background: {colors["hover"]}; }}
+            QListView::item:selected {{ background: {colors["selected"]}; }}
             
             /* 滚动条样式 */
             QScrollBar:vertical {{ background: {colors["scroll_bg"]}; width: 12px; border-radius: 6px; }}
             QScrollBar::handle:vertical {{ background: {colors["scroll_handle"]}; border-radius: 6px; min-height: 30px; }}
             QScrollBar::handle:vertical:hover {{ background: {colors["focus"]}; }}
             QScrollBar::add-line, QScrollBar::sub-line {{ height: 0; width: 0; }}
-            
-            /* 列表项子控件 */
-            ImageItemWidget, QLabel {{ background: transparent; border: none; }}
         """
 
         self.setStyleSheet(qss)
 
     @override
     def closeEvent(self, event):
+        self.list_model.stopAll()
         self.readyToDestory.emit()
\ No newline at end of file
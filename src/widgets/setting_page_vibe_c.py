@@ -15,6 +15,7 @@ import pathlib
 import aiohttp
 import qasync
 from utils import config_loader, sovits_http_helper
+from core.rate_limiter import bwLimiter
 
 
 class settingPage(QWidget):
@@ -134,7 +135,7 @@ class settingPage(QWidget):
         assetsBlockLayout.addLayout(userAssetLayout)
 
         # ---- depsBlock ----
-        depsBlock = QGroupBox("ffmpeg可执行文件路径——若需下载视频则填~", self)
+        depsBlock = QGroupBox("ffmpeg可执行文件路径——下载FLV或杜比/无损视频时需要~", self)
         depsBlockLayout = QVBoxLayout(depsBlock)
         self._ffmpegPath = QLineEdit(
             config_loader.userConf.getFfmpeg(),
@@ -149,6 +150,30 @@ class settingPage(QWidget):
         ffmpegLayout.addWidget(ffmpegBtn)
         depsBlockLayout.addLayout(ffmpegLayout)
 
+        # ---- bandwidthBlock ----
+        bandwidthBlock = QGroupBox("带宽限制——单位KB/s，填0不限速~", self)
+        bandwidthBlockLayout = QVBoxLayout(bandwidthBlock)
+        bandwidthInfo = QLabel("下载总限速: ", bandwidthBlock)
+        self._bandwidthEdit = QLineEdit(
+            str(config_loader.userConf.getBandwidthLimit()),
+            placeholderText="视频、表情包、封面共用...",
+            parent=bandwidthBlock,
+        )
+        bandwidthLayout = QHBoxLayout()
+        bandwidthLayout.addWidget(bandwidthInfo)
+        bandwidthLayout.addWidget(self._bandwidthEdit)
+        liveReserveInfo = QLabel("直播预留: ", bandwidthBlock)
+        self._liveReserveEdit = QLineEdit(
+            str(config_loader.userConf.getBandwidthLiveReserve()),
+            placeholderText="直播弹幕和语音进行时留给它们的带宽...",
+            parent=bandwidthBlock,
+        )
+        liveReserveLayout = QHBoxLayout()
+        liveReserveLayout.addWidget(liveReserveInfo)
+        liveReserveLayout.addWidget(self._liveReserveEdit)
+        bandwidthBlockLayout.addLayout(bandwidthLayout)
+        bandwidthBlockLayout.addLayout(liveReserveLayout)
+
         # ---- biliBlock ----
         biliBlock = QGroupBox("b站cookie配置——请去浏览器中获得~必填~", self)
         biliBlockLayout = QVBoxLayout(biliBlock)
@@ -268,6 +293,7 @@ class settingPage(QWidget):
 
         mainLayout.addWidget(assetsBlock)
         mainLayout.addWidget(depsBlock)
+        mainLayout.addWidget(bandwidthBlock)
         mainLayout.addWidget(biliBlock)
         mainLayout.addWidget(biliveBlock)
         mainLayout.addWidget(biliTtsBlock)
@@ -326,7 +352,8 @@ class settingPage(QWidget):
             self.changeCurrentImage.emit(self._userAssetPath.text())
 
         
-        if not pathlib.Path(self._ffmpegPath.text()).exists():
+        # ffmpeg 只在 FLV 和特殊编码时才用得到，可以不填
+        if self._ffmpegPath.text() != "" and not pathlib.Path(self._ffmpegPath.text()).exists():
             self.setStatus("保存状态: 保存失败~ffmpeg不存在~", "#B22222")
             self._saveBtn.setEnabled(True)
             
@@ -335,6 +362,25 @@ class settingPage(QWidget):
         if self._ffmpegPath.text() != config_loader.userConf.getFfmpeg():
             config_loader.userConf.saveFfmpeg(self._ffmpegPath.text())
 
+        if not (
+            self._bandwidthEdit.text().isdigit()
+            and self._liveReserveEdit.text().isdigit()
+        ):
+            self.setStatus("保存状态: 保存失败~带宽限制要填非负整数~", "#B22222")
+            self._saveBtn.setEnabled(True)
+
+            return
+
+        config_loader.userConf.saveBandwidthLimit(int(self._bandwidthEdit.text()))
+        config_loader.userConf.saveBandwidthLiveReserve(
+            int(self._liveReserveEdit.text())
+        )
+        # 正在进行的下载立刻按新的限速执行
+        bwLimiter.setLimits(
+            int(self._bandwidthEdit.text()) * 1024,
+            int(self._liveReserveEdit.text()) * 1024,
+        )
+
         config_loader.userConf.saveSessData(self._sessDataEdit.text()) 
         config_loader.userConf.saveBiliJct(self._biliJctEdit.text())
         config_loader.userConf.saveBuvid3(self._buvid3Edit.text())
@@ -10,11 +10,12 @@ from PySide6.QtWidgets import (
     QHBoxLayout,
     QFrame,
 )
-from PySide6.QtCore import Qt, QSize, QByteArray, Signal
+from PySide6.QtCore import Qt, QSize, Signal
 from PySide6.QtGui import QPixmap, QFont, QPalette, QColor
-import qasync, aiohttp
+import qasync
 
-from core import video_handler
+from core import video_handler, bili_cache
+from core.image_pipeline import imgPipe
 
 
 class videoCard(QFrame):
@@ -76,7 +77,7 @@ class videoCard(QFrame):
         self._vdo = video_handler.getVideo(vdoBv)
         self._currentBvid = vdoBv
 
-        vdoInfo = await self._vdo.get_info()
+        vdoInfo = await bili_cache.metaCache.getInfo(self._vdo)
 
         self.lbl_title.setText(vdoInfo["title"])
         self.lbl_author.setText(vdoInfo["owner"]["name"])
@@ -86,23 +87,18 @@ class videoCard(QFrame):
             )
         )
 
-        async with aiohttp.ClientSession() as session:
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36 Edg/116.0.1938.54",
-                "Referer": vdoInfo["pic"],
-            }
+        # 解码和缩放在线程里完成，这里只是转成 QPixmap
+        cover = await imgPipe.image(vdoInfo["pic"], (320, 180))
+        if cover is not None and self._currentBvid == vdoBv:
+            self.lbl_cover.setPixmap(QPixmap.fromImage(cover))
 
-            async with session.get(vdoInfo["pic"], headers=headers) as response:
-                coverImage = await response.read()
-
-                coverImgPix = QPixmap()
-                coverImgPix.loadFromData(QByteArray(coverImage))
-
-                if not coverImgPix.isNull():
-                    coverImgPix = coverImgPix.scaled(
-                        320, 180, Qt.KeepAspectRatio, Qt.SmoothTransformation
-                    )
+        self.videoLoaded.emit()
 
-                    self.lbl_cover.setPixmap(coverImgPix)
+        # 趁用户还在看卡片，先把第一P的下载地址取好放进缓存
+        asyncio.ensure_future(self._prefetchDownloadUrl(self._vdo))
 
-        self.videoLoaded.emit()
+    async def _prefetchDownloadUrl(self, vdo: video_handler.bapi.video.Video):
+        try:
+            await bili_cache.metaCache.getDownloadUrl(vdo, 0)
+        except Exception as e:
+            print(f"预取下载地址失败：{e}")
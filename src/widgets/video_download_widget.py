@@ -1,4 +1,4 @@
-import pathlib
+import asyncio, pathlib
 from typing import Optional
 from PySide6.QtWidgets import (
     QWidget,
@@ -9,12 +9,17 @@ from PySide6.QtWidgets import (
     QHBoxLayout,
     QFrame,
     QFileDialog,
+    QProgressBar,
+    QCheckBox,
+    QComboBox,
 )
 from PySide6.QtCore import Qt, QSize, Signal
 from PySide6.QtGui import QPixmap, QFont, QPalette, QColor, QIcon
 import qasync
 
-from core import video_handler
+from core import video_handler, download_progress, stream_policy
+from core.download_signal import dlEmitter
+from core.preview_server import previewSrv
 from widgets import video_card_widget
 from utils import config_loader
 
@@ -29,6 +34,10 @@ class vdoDownWidget(QWidget):
 
         self._currentVdo: Optional[video_handler.bapi.video.Video] = None
         self._currentDownFolder: str = ""
+        # 当前下载的视频各分P最近一次的进度
+        self._pageProgress: dict[str, download_progress.progressSnapshot] = {}
+
+        dlEmitter.progressUpdated.connect(self.onProgressUpdated)
 
     def setup_ui(self):
         self.setWindowTitle("视频助手")
@@ -62,11 +71,54 @@ class vdoDownWidget(QWidget):
 
         main_layout.addLayout(search_layout)
 
+        # 下载选项
+        options_layout = QHBoxLayout()
+        options_layout.setSpacing(8)
+
+        self.chk_danmaku = QCheckBox("同时导出弹幕（ASS，和视频同名）")
+        options_layout.addWidget(self.chk_danmaku, 1)
+
+        self.chk_preview = QCheckBox("边下边看")
+        self.chk_preview.setChecked(config_loader.userConf.getDownloadPreview())
+        options_layout.addWidget(self.chk_preview)
+
+        # 分辨率、码率上限和可用编码沿用设置里的值，这里只切换模式
+        self.cmb_stream = QComboBox()
+        self.cmb_stream.addItem("最高画质", stream_policy.MODE_BEST)
+        self.cmb_stream.addItem("同画质最小体积", stream_policy.MODE_SMALLEST)
+        self.cmb_stream.addItem("仅音频", stream_policy.MODE_AUDIO)
+        self.cmb_stream.setCurrentIndex(
+            max(0, self.cmb_stream.findData(config_loader.userConf.getDownloadStreamMode()))
+        )
+        options_layout.addWidget(self.cmb_stream)
+
+        main_layout.addLayout(options_layout)
+
         # 卡片区域
         self.card = video_card_widget.videoCard()
         self.card.videoLoaded.connect(self.onCardVideoLoaded)
         main_layout.addWidget(self.card, alignment=Qt.AlignHCenter)
 
+        # 进度区域
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setFixedHeight(16)
+        self.progress_bar.setRange(0, 1000)
+        self.progress_bar.setTextVisible(False)
+        self.progress_bar.setVisible(False)
+        main_layout.addWidget(self.progress_bar)
+
+        self.lbl_progress = QLabel("")
+        self.lbl_progress.setStyleSheet("color: #555; font-size: 11px;")
+        self.lbl_progress.setVisible(False)
+        main_layout.addWidget(self.lbl_progress)
+
+        # 预览地址可以复制到播放器（mpv、VLC、PotPlayer 等）里打开
+        self.lbl_preview = QLabel("")
+        self.lbl_preview.setStyleSheet("color: #555; font-size: 11px;")
+        self.lbl_preview.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        self.lbl_preview.setVisible(False)
+        main_layout.addWidget(self.lbl_preview)
+
         self.adjustSize()
 
     def setup_style(self):
@@ -146,13 +198,103 @@ class vdoDownWidget(QWidget):
 
         self._currentDownFolder = selectedFolder
 
-        await video_handler.downloadVideosV2(
-            self.card._vdo,
-            pathlib.Path(self._currentDownFolder) / self.card.getCurrentBvid(),
-        )
+        self._pageProgress.clear()
+        self.progress_bar.setValue(0)
+        self.progress_bar.setVisible(True)
+        self.lbl_progress.setText("正在获取下载地址...")
+        self.lbl_progress.setVisible(True)
+
+        folder = pathlib.Path(self._currentDownFolder) / self.card.getCurrentBvid()
+        exportDanmaku = self.chk_danmaku.isChecked()
+
+        policy = stream_policy.streamPolicy.fromConfig()
+        policy.mode = self.cmb_stream.currentData()
+        config_loader.userConf.saveDownloadPreview(self.chk_preview.isChecked())
+
+        # 先估算总量，取到的地址会被下载直接复用
+        try:
+            estimated = await video_handler.estimateDownload(
+                self.card._vdo, folder, policy
+            )
+            self.lbl_progress.setText(f"预计下载 {estimated / 1048576:.1f} MB，开始下载...")
+        except Exception as e:
+            print(f"估算下载量失败：{e}")
+
+        # 弹幕导出和视频下载同时进行
+        jobs = [video_handler.downloadVideosV2(self.card._vdo, folder, policy)]
+        if exportDanmaku:
+            jobs.append(video_handler.downloadVideoAss(self.card._vdo, folder))
+
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+
+        title = f"{self.card.getCurrentBvid()} - 下载完成"
+        if isinstance(results[0], BaseException):
+            title = f"{self.card.getCurrentBvid()} - 下载失败：{results[0]}"
+        else:
+            # 分P失败不会抛出，要看每一P的结果
+            failed = sorted(page for page, error in results[0].items() if error is not None)
+            if failed:
+                title = (
+                    f"{self.card.getCurrentBvid()} - {len(failed)} P 失败"
+                    f"（{', '.join(f'P{page}' for page in failed)}）"
+                )
+        if exportDanmaku:
+            if isinstance(results[1], BaseException):
+                title += f"，弹幕导出失败：{results[1]}"
+            else:
+                succeeded = sum(result.ok() for result in results[1])
+                title += f"，弹幕 {succeeded} / {len(results[1])} P"
 
         self.setBtnsEnabled(True)
-        self.setWindowTitle(f"{self.card.getCurrentBvid()} - 下载完成")
+        self.lbl_preview.setVisible(False)
+        self.setWindowTitle(title)
+
+    def onProgressUpdated(self, snapshots: list):
+        bvid = self.card.getCurrentBvid()
+
+        for snap in snapshots:
+            if snap.group == bvid:
+                self._pageProgress[snap.key] = snap
+
+        if not self._pageProgress:
+            return
+
+        pages = self._pageProgress.values()
+        done = sum(snap.doneBytes for snap in pages)
+        total = sum(snap.totalBytes for snap in pages)
+        speed = sum(
+            snap.speed for snap in pages if snap.state == download_progress.STATE_RUNNING
+        )
+        finished = sum(snap.state in download_progress.FINAL_STATES for snap in pages)
+        connections = sum(len(snap.connections) for snap in pages)
+
+        if total > 0:
+            self.progress_bar.setValue(int(done * 1000 / total))
+
+        # 显示正在下载的最靠前一P的预览地址；同组里还有 "bvid/分P/clip" 这样的片段任务，不参与
+        running = sorted(
+            (
+                snap.key
+                for snap in pages
+                if snap.state == download_progress.STATE_RUNNING
+                and snap.key.count("/") == 1
+            ),
+            key=lambda key: int(key.split("/")[1]),
+        )
+        url = next(filter(None, map(previewSrv.urlFor, running)), "")
+        self.lbl_preview.setText(f"边下边看：{url}")
+        self.lbl_preview.setVisible(bool(url))
+
+        eta = (total - done) / speed if speed > 0 else -1
+        etaText = f"{int(eta) // 60:02d}:{int(eta) % 60:02d}" if eta >= 0 else "--:--"
+
+        self.lbl_progress.setText(
+            f"{done / 1048576:.1f} / {total / 1048576:.1f} MB  "
+            f"{speed / 1048576:.2f} MB/s  剩余 {etaText}  "
+            f"已完成 {finished} / {len(self._pageProgress)} P  连接 {connections}"
+        )
 
     def closeEvent(self, event):
+        dlEmitter.progressUpdated.disconnect(self.onProgressUpdated)
+
         self.readyToDestory.emit()
\ No newline at end of file